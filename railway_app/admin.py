@@ -2,8 +2,122 @@ from django.contrib import admin
 
 # Register your models here.
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections, transaction
+from django.db.models import Max
+from django.utils.functional import cached_property
 from django.utils.html import format_html
-from .models import Station, Train, Route, Schedule, Booking, BookingLeg, UserProfile, AdminSettings
+from .models import (Station, Train, Route, Schedule, Booking, BookingLeg, Passenger, SeatHold, UserProfile,
+                     AdminSettings, TimetableChange, ScheduleException, InventoryEntry, ArchivedBooking,
+                     ArchivedBookingLeg)
+
+# ==================== Admin Helpers ====================
+# Unfiltered changelists on tables above this size show an estimated total
+ESTIMATED_COUNT_THRESHOLD = 100000
+
+def estimated_row_count(model, using):
+    """Cheap row estimate: planner statistics on PostgreSQL/MySQL, highest id elsewhere"""
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE relname = %s", [table])
+            row = cursor.fetchone()
+            if row and row[0] > 0:
+                return row[0]
+        elif connection.vendor == 'mysql':
+            cursor.execute("SELECT table_rows FROM information_schema.tables "
+                           "WHERE table_schema = DATABASE() AND table_name = %s", [table])
+            row = cursor.fetchone()
+            if row and row[0]:
+                return row[0]
+    return model._default_manager.using(using).aggregate(top=Max('pk'))['top'] or 0
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that estimates the size of large unfiltered tables instead of COUNT(*)"""
+    
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if getattr(queryset, 'query', None) is not None and not queryset.query.where:
+            estimate = estimated_row_count(queryset.model, queryset.db)
+            if estimate >= ESTIMATED_COUNT_THRESHOLD:
+                return estimate
+        return super().count
+
+class InputFilter(admin.SimpleListFilter):
+    """Text-box filter on one lookup, instead of a sidebar listing every related row"""
+    template = 'admin/input_filter.html'
+    lookup = None
+    placeholder = ''
+    
+    def has_output(self):
+        return True
+    
+    def lookups(self, request, model_admin):
+        return ()
+    
+    def queryset(self, request, queryset):
+        value = (self.value() or '').strip()
+        if value:
+            return queryset.filter(**{self.lookup: value})
+        return queryset
+    
+    def choices(self, changelist):
+        preserved = []
+        for name, values in changelist.params.items():
+            if name != self.parameter_name:
+                preserved.extend((name, value) for value in (values if isinstance(values, list) else [values]))
+        yield {
+            'parameter_name': self.parameter_name,
+            'value': self.value() or '',
+            'placeholder': self.placeholder,
+            'preserved': preserved,
+            'clear_query_string': changelist.get_query_string(remove=[self.parameter_name]),
+        }
+
+class TrainNumberFilter(InputFilter):
+    title = 'train number'
+    parameter_name = 'train_number'
+    lookup = 'train__train_number__iexact'
+    placeholder = 'e.g. 12727'
+
+class RouteTrainNumberFilter(TrainNumberFilter):
+    lookup = 'route__train__train_number__iexact'
+
+class ScheduleTrainNumberFilter(TrainNumberFilter):
+    lookup = 'schedule__route__train__train_number__iexact'
+
+class SourceStationFilter(InputFilter):
+    title = 'source station code'
+    parameter_name = 'source_code'
+    lookup = 'source__code__iexact'
+    placeholder = 'e.g. BZA'
+
+class DestinationStationFilter(InputFilter):
+    title = 'destination station code'
+    parameter_name = 'destination_code'
+    lookup = 'destination__code__iexact'
+    placeholder = 'e.g. HYD'
+
+# ==================== Bulk Timetable Actions ====================
+# queryset.update() sends no model signals, so bulk edits log their own timetable change
+def _set_active(queryset, is_active):
+    ids = list(queryset.values_list('id', flat=True))
+    with transaction.atomic():
+        queryset.model.objects.filter(pk__in=ids).update(is_active=is_active)
+        TimetableChange.record(queryset.model._meta.model_name, ids, TimetableChange.SAVE)
+    return len(ids)
+
+@admin.action(description="Activate selected")
+def activate_selected(modeladmin, request, queryset):
+    count = _set_active(queryset, True)
+    modeladmin.message_user(request, f"Activated {count} {queryset.model._meta.verbose_name_plural}.")
+
+@admin.action(description="Deactivate selected")
+def deactivate_selected(modeladmin, request, queryset):
+    count = _set_active(queryset, False)
+    modeladmin.message_user(request, f"Deactivated {count} {queryset.model._meta.verbose_name_plural}.")
 
 # ==================== Station Admin ====================
 @admin.register(Station)
@@ -34,6 +148,7 @@ class TrainAdmin(admin.ModelAdmin):
     list_display = ('train_number', 'train_name', 'train_type', 'total_capacity', 'is_active', 'status_badge')
     list_filter = ('train_type', 'is_active', 'created_at')
     search_fields = ('train_number', 'train_name')
+    actions = [activate_selected, deactivate_selected]
     
     fieldsets = (
         ('Basic Information', {
@@ -64,8 +179,10 @@ class TrainAdmin(admin.ModelAdmin):
 @admin.register(Route)
 class RouteAdmin(admin.ModelAdmin):
     list_display = ('train', 'source', 'destination', 'distance', 'calculated_fare', 'is_active')
-    list_filter = ('train', 'source', 'destination', 'is_active')
+    list_filter = (TrainNumberFilter, SourceStationFilter, DestinationStationFilter, 'is_active')
     search_fields = ('train__train_number', 'source__name', 'destination__name')
+    autocomplete_fields = ('train', 'source', 'destination')
+    actions = [activate_selected, deactivate_selected]
     
     fieldsets = (
         ('Route Information', {
@@ -80,13 +197,26 @@ class RouteAdmin(admin.ModelAdmin):
     )
     
     readonly_fields = ('created_at',)
+    
+    def get_queryset(self, request):
+        # Route.__str__ reads train and both stations (changelist, autocomplete, FK displays)
+        return super().get_queryset(request).select_related('train', 'source', 'destination')
 
 # ==================== Schedule Admin ====================
+class ScheduleExceptionInline(admin.TabularInline):
+    model = ScheduleException
+    extra = 0
+    fields = ('kind', 'start_date', 'end_date', 'reason')
+
 @admin.register(Schedule)
 class ScheduleAdmin(admin.ModelAdmin):
     list_display = ('route', 'departure_time', 'arrival_time', 'runs_on_display', 'total_available', 'is_active')
-    list_filter = ('route__train', 'is_active', 'departure_time')
+    list_filter = (RouteTrainNumberFilter, 'is_active', 'departure_time')
     search_fields = ('route__train__train_number', 'route__source__name')
+    autocomplete_fields = ('route',)
+    show_full_result_count = False
+    actions = [activate_selected, deactivate_selected]
+    inlines = [ScheduleExceptionInline]
     
     fieldsets = (
         ('Schedule Information', {
@@ -101,6 +231,9 @@ class ScheduleAdmin(admin.ModelAdmin):
     
     readonly_fields = ('created_at', 'updated_at')
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('route__train', 'route__source', 'route__destination')
+    
     def total_available(self, obj):
         total = (obj.ac_first_available + obj.ac_two_tier_available + 
                 obj.ac_three_tier_available + obj.sleeper_available + obj.general_available)
@@ -113,13 +246,37 @@ class ScheduleAdmin(admin.ModelAdmin):
         return ', '.join(running_days) if running_days else 'N/A'
     runs_on_display.short_description = 'Runs On'
 
+@admin.register(ScheduleException)
+class ScheduleExceptionAdmin(admin.ModelAdmin):
+    list_display = ('schedule', 'kind', 'start_date', 'end_date', 'reason')
+    list_filter = ('kind', ScheduleTrainNumberFilter)
+    search_fields = ('schedule__route__train__train_number', 'reason')
+    autocomplete_fields = ('schedule',)
+    date_hierarchy = 'start_date'
+    show_full_result_count = False
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related(
+            'schedule__route__train', 'schedule__route__source', 'schedule__route__destination'
+        )
+
 # ==================== Booking Admin ====================
+class PassengerInline(admin.TabularInline):
+    model = Passenger
+    extra = 0
+    fields = ('sequence', 'name', 'age', 'gender', 'seat_numbers')
+
 @admin.register(Booking)
 class BookingAdmin(admin.ModelAdmin):
-    list_display = ('pnr', 'passenger_name', 'journey_date', 'status_badge', 'total_fare', 'booking_date')
-    list_filter = ('status', 'journey_date', 'seat_class', 'booking_date')
-    search_fields = ('pnr', 'passenger_name', 'passenger_email', 'passenger_phone')
+    list_display = ('pnr', 'passenger_name', 'passenger_count', 'journey_date', 'status_badge', 'total_fare', 'booking_date')
+    list_filter = ('status', 'seat_class', 'journey_date')
+    search_fields = ('=pnr', '^passenger_email', '^passenger_phone', 'passenger_name')
     readonly_fields = ('pnr', 'booking_date', 'cancellation_date')
+    autocomplete_fields = ('user',)
+    date_hierarchy = 'booking_date'
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+    inlines = [PassengerInline]
     
     fieldsets = (
         ('Booking Information', {
@@ -127,7 +284,7 @@ class BookingAdmin(admin.ModelAdmin):
         }),
         ('Passenger Details', {
             'fields': ('passenger_name', 'passenger_email', 'passenger_phone', 
-                      'passenger_age', 'passenger_gender')
+                      'passenger_age', 'passenger_gender', 'passenger_count')
         }),
         ('Booking Details', {
             'fields': ('seat_class', 'total_fare', 'is_refundable')
@@ -159,19 +316,87 @@ class BookingAdmin(admin.ModelAdmin):
 @admin.register(BookingLeg)
 class BookingLegAdmin(admin.ModelAdmin):
     list_display = ('booking', 'route', 'leg_sequence', 'seat_number', 'leg_fare')
-    list_filter = ('route__train', 'leg_sequence')
-    search_fields = ('booking__pnr', 'seat_number')
+    list_filter = (RouteTrainNumberFilter, 'leg_sequence')
+    list_select_related = ('booking', 'route__train', 'route__source', 'route__destination')
+    search_fields = ('=booking__pnr', 'seat_number')
     readonly_fields = ('created_at',)
+    autocomplete_fields = ('booking', 'route', 'schedule')
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
     
     def has_add_permission(self, request):
         return False  # Created through booking
 
+# ==================== Booking Archive Admin ====================
+class ArchivedBookingLegInline(admin.TabularInline):
+    model = ArchivedBookingLeg
+    extra = 0
+    can_delete = False
+    
+    def has_add_permission(self, request, obj=None):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+
+@admin.register(ArchivedBooking)
+class ArchivedBookingAdmin(admin.ModelAdmin):
+    list_display = ('pnr', 'passenger_name', 'journey_date', 'status', 'seat_class', 'total_fare', 'archived_at')
+    list_filter = ('status', 'seat_class')
+    search_fields = ('=pnr', 'passenger_email')
+    date_hierarchy = 'journey_date'
+    inlines = [ArchivedBookingLegInline]
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+    
+    def has_add_permission(self, request):
+        return False  # Written by archive_bookings
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+
+# ==================== Seat Hold Admin ====================
+@admin.register(SeatHold)
+class SeatHoldAdmin(admin.ModelAdmin):
+    list_display = ('hold_token', 'schedule', 'seat_class', 'seats', 'user', 'expires_at')
+    list_filter = ('seat_class', 'expires_at')
+    list_select_related = ('schedule__route__train', 'schedule__route__source', 'schedule__route__destination', 'user')
+    search_fields = ('hold_token', 'user__username')
+    readonly_fields = ('created_at',)
+    autocomplete_fields = ('schedule', 'user')
+    show_full_result_count = False
+    
+    def has_add_permission(self, request):
+        return False  # Created through the hold_seats API
+
+# ==================== Inventory Ledger Admin ====================
+@admin.register(InventoryEntry)
+class InventoryEntryAdmin(admin.ModelAdmin):
+    list_display = ('id', 'schedule', 'seat_class', 'delta', 'reason', 'reference', 'created_at')
+    list_filter = ('reason', 'seat_class')
+    list_select_related = ('schedule__route__train', 'schedule__route__source', 'schedule__route__destination')
+    search_fields = ('=reference', '=schedule__id')
+    date_hierarchy = 'created_at'
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+    
+    def has_add_permission(self, request):
+        return False  # Written with every counter change; fix drift with reconcile_inventory
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
+
 # ==================== User Profile Admin ====================
 @admin.register(UserProfile)
 class UserProfileAdmin(admin.ModelAdmin):
     list_display = ('user', 'phone', 'city', 'total_bookings', 'total_spent', 'is_verified')
     list_filter = ('is_verified', 'city', 'created_at')
+    list_select_related = ('user',)
     search_fields = ('user__username', 'user__email', 'phone')
+    autocomplete_fields = ('user',)
     readonly_fields = ('total_bookings', 'total_spent', 'created_at')
 
 # ==================== Admin Settings ====================
@@ -186,4 +411,20 @@ class AdminSettingsAdmin(admin.ModelAdmin):
         }),
     )
     
-    readonly_fields = ('updated_at',)
\ No newline at end of file
+    readonly_fields = ('updated_at',)
+
+# ==================== Timetable Change Log ====================
+@admin.register(TimetableChange)
+class TimetableChangeAdmin(admin.ModelAdmin):
+    list_display = ('id', 'model_name', 'object_id', 'action', 'created_at')
+    list_filter = ('model_name', 'action')
+    search_fields = ('=object_id',)
+    date_hierarchy = 'created_at'
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+    
+    def has_add_permission(self, request):
+        return False  # Written by signals and bulk actions
+    
+    def has_change_permission(self, request, obj=None):
+        return False
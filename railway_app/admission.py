@@ -0,0 +1,320 @@
+"""
+Admission control for write endpoints that surge when popular trains open.
+
+Each protected endpoint has a TokenBucket sized to what the database sustains and
+a FIFO WaitingRoom. A request that finds the queue empty and a token free goes
+straight through. Otherwise it gets a ticket and its queue position (HTTP 429),
+polls the waiting room, and once its ticket is admitted re-sends the request with
+the X-Admission-Ticket header. Tickets at the head are admitted as tokens free up;
+tickets that stop polling are dropped. Once the queue is full, requests get HTTP
+429 without a ticket and retry later.
+
+The rate alone still lets admitted clients arrive in clumps (everyone queued in the
+same second polls in the same second), and a clump pushed into the database turns
+into lock contention that slows every transaction. So admitted requests also take
+one of `max_active` slots, waiting up to `max_wait` seconds for one to free up.
+
+State is per process: with several worker processes, give each its share of the
+rate and keep clients on one process (polls to another process see an unknown
+ticket and start over).
+
+Read endpoints that one client could hammer (PNR lookups, seat holds) are limited
+per client instead: each user, or each IP address for anonymous requests, gets its
+own TokenBucket (CLIENT_RATE_LIMITS), and requests beyond it get HTTP 429 at once.
+"""
+import functools
+import itertools
+import math
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.http import JsonResponse
+from django.urls import reverse
+
+TICKET_HEADER = 'X-Admission-Ticket'
+
+# Poll interval bounds suggested to queued clients (seconds)
+MIN_RETRY_SECONDS = 1
+MAX_RETRY_SECONDS = 10
+
+
+class TokenBucket:
+    """`rate` tokens per second, holding at most `burst`"""
+
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.clock = clock
+        self.tokens = float(self.burst)
+        self.updated = clock()
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        with self._lock:
+            now = self.clock()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+class Ticket:
+    __slots__ = ('id', 'seq', 'last_seen')
+
+    def __init__(self, ticket_id, seq, now):
+        self.id = ticket_id
+        self.seq = seq
+        self.last_seen = now
+
+
+# ==================== Waiting Room ====================
+class WaitingRoom:
+    ADMITTED = 'admitted'
+    WAITING = 'waiting'
+    UNKNOWN = 'unknown'
+
+    def __init__(self, bucket, max_queue, idle_seconds, admit_seconds, clock=time.monotonic):
+        """
+        bucket: admission rate; max_queue: tickets beyond this are refused;
+        idle_seconds: drop waiting tickets not polled for this long;
+        admit_seconds: how long an admitted ticket stays valid.
+        """
+        self.bucket = bucket
+        self.max_queue = max_queue
+        self.idle_seconds = idle_seconds
+        self.admit_seconds = admit_seconds
+        self.clock = clock
+        self.waiting = OrderedDict()  # ticket id -> Ticket, oldest first
+        self.admitted = {}  # ticket id -> valid until
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def enter(self):
+        """
+        (True, None) if the request may proceed now, (False, ticket) if it was
+        queued, (False, None) if the queue is full.
+        """
+        with self._lock:
+            now = self.clock()
+            self._advance(now)
+            # Nobody jumps the queue: fresh requests only get a token while it is empty
+            if not self.waiting and self.bucket.try_acquire():
+                return True, None
+            if len(self.waiting) >= self.max_queue:
+                return False, None
+            ticket = Ticket(secrets.token_urlsafe(16), next(self._seq), now)
+            self.waiting[ticket.id] = ticket
+            return False, ticket
+
+    def poll(self, ticket_id):
+        """(state, position): ADMITTED, WAITING with a 1-based position, or UNKNOWN"""
+        with self._lock:
+            now = self.clock()
+            self._advance(now)
+            if ticket_id in self.admitted:
+                return self.ADMITTED, 0
+            ticket = self.waiting.get(ticket_id)
+            if ticket is None:
+                return self.UNKNOWN, None
+            ticket.last_seen = now
+            return self.WAITING, self.position(ticket)
+
+    def use(self, ticket_id):
+        """Redeem an admitted ticket; True once per admission"""
+        with self._lock:
+            valid_until = self.admitted.pop(ticket_id, None)
+            return valid_until is not None and valid_until >= self.clock()
+
+    def position(self, ticket):
+        # Tickets only leave from the head, so sequence numbers in the queue are contiguous
+        head = next(iter(self.waiting.values()))
+        return ticket.seq - head.seq + 1
+
+    def retry_after(self, position):
+        """Suggested poll interval for a client at this position"""
+        return min(max(position / self.bucket.rate, MIN_RETRY_SECONDS), MAX_RETRY_SECONDS)
+
+    def _advance(self, now):
+        """Expire unused admissions, drop abandoned tickets, admit from the head while tokens last"""
+        for ticket_id in [t for t, valid_until in self.admitted.items() if valid_until < now]:
+            del self.admitted[ticket_id]
+        while self.waiting:
+            head = next(iter(self.waiting.values()))
+            if now - head.last_seen > self.idle_seconds:
+                self.waiting.popitem(last=False)
+                continue
+            if not self.bucket.try_acquire():
+                break
+            self.waiting.popitem(last=False)
+            self.admitted[head.id] = now + self.admit_seconds
+
+
+_rooms_lock = threading.Lock()
+_rooms = {}
+_slots = {}
+
+
+def get_waiting_room(name):
+    """Process-wide waiting room for an endpoint, configured from ADMISSION_CONTROL[name]"""
+    room = _rooms.get(name)
+    if room is None:
+        with _rooms_lock:
+            room = _rooms.get(name)
+            if room is None:
+                config = settings.ADMISSION_CONTROL[name]
+                room = _rooms[name] = WaitingRoom(
+                    TokenBucket(config['rate'], config['burst']),
+                    max_queue=config['max_queue'],
+                    idle_seconds=config['idle_seconds'],
+                    admit_seconds=config['admit_seconds'],
+                )
+                _slots[name] = threading.BoundedSemaphore(config['max_active'])
+    return room
+
+
+def busy_response():
+    return JsonResponse({
+        'status': 'error',
+        'error': 'Booking is very busy right now, please try again in a few minutes'
+    }, status=503)
+
+
+def queue_full_response():
+    response = JsonResponse({
+        'status': 'error',
+        'error': 'Too many people are waiting to book right now, please try again shortly'
+    }, status=429)
+    response['Retry-After'] = str(MAX_RETRY_SECONDS)
+    return response
+
+
+def run_admitted(name, view, request, *args, **kwargs):
+    """Run an admitted request in one of the endpoint's max_active slots"""
+    slots = _slots[name]
+    if not slots.acquire(timeout=settings.ADMISSION_CONTROL[name]['max_wait']):
+        return busy_response()
+    try:
+        return view(request, *args, **kwargs)
+    finally:
+        slots.release()
+
+
+def queued_response(name, room, ticket):
+    state, position = room.poll(ticket.id)
+    position = position or 1
+    retry_after = room.retry_after(position) if state == WaitingRoom.WAITING else MIN_RETRY_SECONDS
+    response = JsonResponse({
+        'status': 'queued',
+        'ticket': ticket.id,
+        'position': position,
+        'retry_after': retry_after,
+        'poll_url': reverse('waiting_room', args=[name, ticket.id]),
+    }, status=429)
+    response['Retry-After'] = str(int(retry_after))
+    return response
+
+
+def admission_control(name):
+    """
+    Gate POSTs to a view through the `name` waiting room. Other methods, and all
+    requests when ADMISSION_CONTROL has no entry for `name` (rate 0), pass through.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapped(request, *args, **kwargs):
+            config = settings.ADMISSION_CONTROL.get(name)
+            if request.method != 'POST' or not config or not config['rate']:
+                return view(request, *args, **kwargs)
+            room = get_waiting_room(name)
+            ticket_id = request.headers.get(TICKET_HEADER)
+            if ticket_id and room.use(ticket_id):
+                return run_admitted(name, view, request, *args, **kwargs)
+            admitted, ticket = room.enter()
+            if admitted:
+                return run_admitted(name, view, request, *args, **kwargs)
+            if ticket is None:
+                return queue_full_response()
+            return queued_response(name, room, ticket)
+        return wrapped
+    return decorator
+
+
+# ==================== Per-client Rate Limits ====================
+class ClientRateLimiter:
+    """A TokenBucket per client, for the `max_clients` most recently seen clients"""
+
+    def __init__(self, rate, burst, max_clients=10000, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.clock = clock
+        self.buckets = OrderedDict()  # client key -> TokenBucket, least recently seen first
+        self._lock = threading.Lock()
+
+    def try_acquire(self, client):
+        with self._lock:
+            bucket = self.buckets.get(client)
+            if bucket is None:
+                bucket = self.buckets[client] = TokenBucket(self.rate, self.burst, clock=self.clock)
+                while len(self.buckets) > self.max_clients:
+                    self.buckets.popitem(last=False)
+            else:
+                self.buckets.move_to_end(client)
+        return bucket.try_acquire()
+
+
+_limiters = {}
+
+
+def get_rate_limiter(name):
+    """Process-wide per-client limiter, configured from CLIENT_RATE_LIMITS[name]"""
+    limiter = _limiters.get(name)
+    if limiter is None:
+        with _rooms_lock:
+            limiter = _limiters.get(name)
+            if limiter is None:
+                config = settings.CLIENT_RATE_LIMITS[name]
+                limiter = _limiters[name] = ClientRateLimiter(
+                    config['rate'], config['burst'], max_clients=config.get('max_clients', 10000),
+                )
+    return limiter
+
+
+def client_key(request):
+    """Signed-in users are limited per account, anonymous requests per IP address"""
+    if request.user.is_authenticated:
+        return f'user:{request.user.pk}'
+    return f'ip:{request.META.get("REMOTE_ADDR", "")}'
+
+
+def rate_limited_response(name):
+    retry_after = max(math.ceil(1 / settings.CLIENT_RATE_LIMITS[name]['rate']), MIN_RETRY_SECONDS)
+    response = JsonResponse({
+        'status': 'error',
+        'error': 'Too many requests, please slow down'
+    }, status=429)
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+def rate_limit(name):
+    """
+    Limit each client to CLIENT_RATE_LIMITS[name]; requests pass through when there
+    is no entry for `name` (or its rate is 0).
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapped(request, *args, **kwargs):
+            config = settings.CLIENT_RATE_LIMITS.get(name)
+            if not config or not config['rate']:
+                return view(request, *args, **kwargs)
+            if not get_rate_limiter(name).try_acquire(client_key(request)):
+                return rate_limited_response(name)
+            return view(request, *args, **kwargs)
+        return wrapped
+    return decorator
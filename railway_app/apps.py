@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class RailwayAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'railway_app'
+
+    def ready(self):
+        from . import signals  # noqa: F401
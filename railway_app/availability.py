@@ -0,0 +1,89 @@
+"""
+Availability calendar for a station pair.
+
+Seat inventory is kept per schedule, and a schedule runs on a fixed set of
+weekdays, so availability repeats weekly. The calendar is one query for the
+direct schedules, a 7 x N weekday grid built from their weekday masks, and a
+gather of that grid by each date's weekday. The cost depends on the number of
+schedules, not on how many days are requested. NumPy is used when installed;
+the array fallback computes the same grid.
+
+Dates where a schedule's service calendar (ScheduleException) departs from its
+weekly pattern are then corrected one by one: suspended runs are taken out of the
+day's totals and extra runs added, as the booking path would accept them.
+"""
+from array import array
+from datetime import timedelta
+
+from .models import Schedule
+from .service_calendar import get_service_calendar
+from .timetable import weekday_mask
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency
+    np = None
+
+MAX_CALENDAR_DAYS = 120
+
+
+def weekday_totals(masks, seats):
+    """
+    Per-weekday (seats, trains with seats) for schedules given as parallel
+    sequences of weekday masks and available seats.
+    """
+    if np is not None and len(masks):
+        masks = np.asarray(masks, dtype=np.int32)
+        seats = np.asarray(seats, dtype=np.int64)
+        runs = (masks[np.newaxis, :] >> np.arange(7, dtype=np.int32)[:, np.newaxis]) & 1
+        return runs @ seats, runs @ (seats > 0)
+
+    total_seats = array('q', [0] * 7)
+    total_trains = array('q', [0] * 7)
+    for mask, available in zip(masks, seats):
+        for weekday in range(7):
+            if mask >> weekday & 1:
+                total_seats[weekday] += available
+                total_trains[weekday] += available > 0
+    return total_seats, total_trains
+
+
+def availability_calendar(source, destination, seat_class, start_date, days, calendar=None):
+    """Per-day direct-train availability from start_date for `days` days"""
+    calendar = calendar or get_service_calendar()
+    seat_field = Schedule.SEAT_FIELDS.get(seat_class, 'sleeper_available')
+    rows = Schedule.objects.filter(
+        route__source=source,
+        route__destination=destination,
+        route__is_active=True,
+        is_active=True,
+    ).values_list('id', 'runs_on', seat_field)
+
+    masks, seats = array('i'), array('q')
+    excepted = []  # schedules whose service calendar has exceptions
+    for schedule_id, runs_on, available in rows:
+        masks.append(weekday_mask(runs_on))
+        seats.append(available)
+        if schedule_id in calendar.suspended or schedule_id in calendar.extra:
+            excepted.append((schedule_id, runs_on, available))
+    seats_by_weekday, trains_by_weekday = weekday_totals(masks, seats)
+
+    first_weekday = start_date.weekday()
+    calendar_days = []
+    for offset in range(days):
+        day = start_date + timedelta(days=offset)
+        weekday = (first_weekday + offset) % 7
+        available_seats = int(seats_by_weekday[weekday])
+        trains = int(trains_by_weekday[weekday])
+        for schedule_id, runs_on, available in excepted:
+            runs = calendar.runs(schedule_id, runs_on, day)
+            if runs != (str(weekday) in runs_on):
+                sign = 1 if runs else -1
+                available_seats += sign * available
+                trains += sign * (available > 0)
+        calendar_days.append({
+            'date': day.isoformat(),
+            'available_seats': available_seats,
+            'trains': trains,
+        })
+    return calendar_days
@@ -0,0 +1,160 @@
+"""
+Single-flight coalescing for identical concurrent searches.
+
+Within a process, SingleFlight hands every caller with the same key the future
+of the first (leader) call until it finishes, so N identical searches cost one
+computation. Across processes, shared_call() serializes identical calls through
+an flock()ed file per key in SEARCH_COALESCE_DIR: the process holding the lock
+computes and writes the JSON result into the file, the others wait for the lock
+and read it. Without SEARCH_COALESCE_DIR (or fcntl, e.g. on Windows) only
+in-process coalescing applies.
+
+A result is only read by calls that were waiting while it was written, so files
+untouched for SEARCH_COALESCE_MAX_AGE_SECONDS are dead weight; sweep() removes
+those that no process holds, and leaders run it at most once per that interval.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+# How often a waiting process retries the lock of a search another process runs
+LOCK_POLL_SECONDS = 0.02
+
+_sweep_lock = threading.Lock()
+_last_sweep = 0.0
+
+
+class SingleFlight:
+    """Share one in-flight concurrent.futures.Future per key"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.leaders = 0
+        self.followers = 0
+
+    def submit(self, key, start):
+        """
+        (future, is_leader) for key. start() must return a concurrent.futures.Future
+        and is only called when no identical call is in flight.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.followers += 1
+                return future, False
+            future = self._calls[key] = start()
+            self.leaders += 1
+        future.add_done_callback(lambda done: self._forget(key, done))
+        return future, True
+
+    def _forget(self, key, future):
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+
+
+search_flights = SingleFlight()
+
+
+def _lock_path(key):
+    digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+    return os.path.join(settings.SEARCH_COALESCE_DIR, f'{digest}.json')
+
+
+def _wait_for_lock(fd, timeout):
+    """Block until the file lock is ours or timeout passes; True if acquired"""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(LOCK_POLL_SECONDS)
+
+
+def sweep(directory, max_age):
+    """Remove lock files untouched for max_age seconds that no process holds; returns how many"""
+    cutoff = time.time() - max_age
+    removed = 0
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if not entry.name.endswith('.json'):
+                continue
+            try:
+                if entry.stat().st_mtime >= cutoff:
+                    continue
+                with open(entry.path, 'a+', encoding='utf-8') as f:
+                    try:
+                        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        continue  # a search is running or waiting on it
+                    # Check again under the lock: a leader may have written since
+                    if os.fstat(f.fileno()).st_mtime < cutoff:
+                        os.unlink(entry.path)
+                        removed += 1
+            except FileNotFoundError:
+                continue  # swept by another process
+    return removed
+
+
+def _maybe_sweep(directory):
+    global _last_sweep
+    max_age = getattr(settings, 'SEARCH_COALESCE_MAX_AGE_SECONDS', 60)
+    now = time.monotonic()
+    if now - _last_sweep < max_age or not _sweep_lock.acquire(blocking=False):
+        return
+    try:
+        _last_sweep = now
+        sweep(directory, max_age)
+    finally:
+        _sweep_lock.release()
+
+
+def shared_call(key, func, *args):
+    """
+    func(*args), or the JSON result an identical call in another process finished
+    while this one waited. func must return JSON-serializable data.
+    """
+    directory = getattr(settings, 'SEARCH_COALESCE_DIR', None)
+    if not directory or fcntl is None:
+        return func(*args)
+
+    started = time.time()
+    with open(_lock_path(key), 'a+', encoding='utf-8') as f:
+        fd = f.fileno()
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            # Another process is running this search; its result lands in the file
+            if not _wait_for_lock(fd, settings.SEARCH_TIMEOUT_SECONDS):
+                return func(*args)
+            if os.fstat(fd).st_mtime >= started:
+                f.seek(0)
+                try:
+                    return json.load(f)
+                except ValueError:
+                    pass  # leader died mid-write; compute below
+            # Nothing written since we started waiting (the leader failed): compute ourselves
+
+        try:
+            result = func(*args)
+            f.seek(0)
+            f.truncate()
+            json.dump(result, f, separators=(',', ':'))
+            f.flush()
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+    _maybe_sweep(directory)
+    return result
@@ -0,0 +1,222 @@
+import json
+import threading
+from collections import namedtuple
+from decimal import Decimal, ROUND_HALF_UP
+
+from .models import Route, AdminSettings, TimetableChange
+from . import timetable
+
+# ==================== Fare Configuration ====================
+# Defaults used when the corresponding AdminSettings key is missing or invalid.
+# Each setting value is stored as JSON in AdminSettings.value.
+
+SEAT_CLASSES = ('AC_FIRST', 'AC_2_TIER', 'AC_3_TIER', 'SLEEPER', 'GENERAL')
+
+# AdminSettings key: fare_class_multipliers -> {"AC_FIRST": "4.0", ...}
+DEFAULT_CLASS_MULTIPLIERS = {
+    'AC_FIRST': Decimal('4.00'),
+    'AC_2_TIER': Decimal('2.60'),
+    'AC_3_TIER': Decimal('1.80'),
+    'SLEEPER': Decimal('1.00'),
+    'GENERAL': Decimal('0.60'),
+}
+
+# AdminSettings key: fare_distance_slabs -> [[upto_km, factor], ..., [null, factor]]
+# Each slab charges its own kilometres at base_fare_per_km * factor.
+DEFAULT_DISTANCE_SLABS = [
+    (500, Decimal('1.00')),
+    (1000, Decimal('0.90')),
+    (2000, Decimal('0.80')),
+    (None, Decimal('0.70')),
+]
+
+# AdminSettings key: fare_surge_tiers -> [[min_occupancy_percent, multiplier], ...]
+DEFAULT_SURGE_TIERS = [
+    (0, Decimal('1.00')),
+    (50, Decimal('1.10')),
+    (75, Decimal('1.25')),
+    (90, Decimal('1.50')),
+]
+
+GST_RATE = Decimal('0.05')
+CONVENIENCE_FEE = Decimal('50.00')
+
+# Train capacity field (via Route) for each seat class
+CAPACITY_FIELDS = {
+    'AC_FIRST': 'train__ac_first_seats',
+    'AC_2_TIER': 'train__ac_two_tier_seats',
+    'AC_3_TIER': 'train__ac_three_tier_seats',
+    'SLEEPER': 'train__sleeper_seats',
+    'GENERAL': 'train__general_seats',
+}
+
+PAISE = Decimal('0.01')
+
+
+def money(value):
+    """Round a Decimal to paise"""
+    return Decimal(value).quantize(PAISE, rounding=ROUND_HALF_UP)
+
+
+def slab_fare(base_fare_per_km, distance, slabs):
+    """Base fare for a distance, charging each slab at its own factor"""
+    fare = Decimal('0')
+    covered = 0
+    for upto, factor in slabs:
+        if covered >= distance:
+            break
+        end = distance if upto is None else min(distance, upto)
+        if end > covered:
+            fare += Decimal(end - covered) * base_fare_per_km * factor
+            covered = end
+    return fare
+
+
+def _load_json_setting(key, default, parse):
+    """Read a JSON AdminSettings value, falling back to the default"""
+    raw = AdminSettings.get_value(key)
+    if raw is None:
+        return default
+    try:
+        return parse(json.loads(raw))
+    except (ValueError, TypeError, KeyError):
+        return default
+
+
+def _parse_multipliers(data):
+    multipliers = dict(DEFAULT_CLASS_MULTIPLIERS)
+    multipliers.update({k: Decimal(str(v)) for k, v in data.items() if k in SEAT_CLASSES})
+    return multipliers
+
+
+def _parse_slabs(data):
+    slabs = [(None if upto is None else int(upto), Decimal(str(factor))) for upto, factor in data]
+    return sorted(slabs, key=lambda s: float('inf') if s[0] is None else s[0])
+
+
+def _parse_tiers(data):
+    return sorted((float(threshold), Decimal(str(mult))) for threshold, mult in data)
+
+
+# ==================== Fare Engine ====================
+FareState = namedtuple('FareState', 'table capacity tiers multipliers slabs version')
+
+
+class FareEngine:
+    """
+    Precomputed fare tables keyed by (route_id, seat_class, surge_tier).
+
+    The table is built lazily on first use. When the timetable version moves
+    (TimetableChange) only the affected routes are recomputed; invalidate(), called
+    when AdminSettings change, drops everything.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = None
+
+    def invalidate(self):
+        """Drop the precomputed tables; they are rebuilt on next access"""
+        with self._lock:
+            self._state = None
+
+    def _loaded(self):
+        """Return the current FareState, building or patching it if needed"""
+        state = self._state
+        if state is None or state.version < timetable.latest_version():
+            with self._lock:
+                if self._state is None:
+                    self._state = self._build()
+                elif self._state.version < timetable.latest_version():
+                    self._state = self._refresh(self._state)
+                state = self._state
+        return state
+
+    def _build(self):
+        multipliers = _load_json_setting('fare_class_multipliers', DEFAULT_CLASS_MULTIPLIERS, _parse_multipliers)
+        slabs = _load_json_setting('fare_distance_slabs', DEFAULT_DISTANCE_SLABS, _parse_slabs)
+        tiers = _load_json_setting('fare_surge_tiers', DEFAULT_SURGE_TIERS, _parse_tiers)
+        version = TimetableChange.current_version()
+
+        state = FareState({}, {}, tiers, multipliers, slabs, version)
+        self._fill(state, Route.objects.all())
+        return state
+
+    def _refresh(self, state):
+        """Patch the routes touched since state.version (a route's fare depends on it and its train)"""
+        changes = TimetableChange.changes_since(state.version)
+        if changes is None:
+            return self._build()
+        version, changed = changes
+        route_ids = set(changed.get('route', ()))
+        if changed.get('train'):
+            route_ids.update(Route.objects.filter(train_id__in=changed['train']).values_list('id', flat=True))
+        if not route_ids:
+            return state._replace(version=version)
+
+        # Patch copies: readers holding the old state keep a consistent view
+        patched = state._replace(table=dict(state.table), capacity=dict(state.capacity), version=version)
+        for route_id in route_ids:
+            for seat_class in SEAT_CLASSES:
+                patched.capacity.pop((route_id, seat_class), None)
+                for tier in range(len(state.tiers)):
+                    patched.table.pop((route_id, seat_class, tier), None)
+        self._fill(patched, Route.objects.filter(id__in=route_ids))
+        return patched
+
+    @staticmethod
+    def _fill(state, routes):
+        rows = routes.values('id', 'distance', 'base_fare_per_km', *CAPACITY_FIELDS.values())
+        for row in rows:
+            base = slab_fare(row['base_fare_per_km'], row['distance'], state.slabs)
+            for seat_class in SEAT_CLASSES:
+                class_fare = base * state.multipliers[seat_class]
+                for tier, (_, surge) in enumerate(state.tiers):
+                    state.table[(row['id'], seat_class, tier)] = money(class_fare * surge)
+                state.capacity[(row['id'], seat_class)] = row[CAPACITY_FIELDS[seat_class]]
+
+    def surge_tier(self, schedule, seat_class, held=0):
+        """
+        Surge tier index for a schedule, based on current class occupancy. `held` seats,
+        taken out by the booking's own hold, still count as available, so a hold never
+        raises the fare of the booking it was placed for.
+        """
+        state = self._loaded()
+        capacity, tiers = state.capacity, state.tiers
+        total = capacity.get((schedule.route_id, seat_class)) or 0
+        if total <= 0:
+            return 0
+        available = schedule.get_available_seats(seat_class) + held
+        occupancy = max(0.0, 1 - available / total) * 100
+        tier = 0
+        for idx, (threshold, _) in enumerate(tiers):
+            if occupancy >= threshold:
+                tier = idx
+        return tier
+
+    def get_fare(self, route_id, seat_class, tier=0):
+        """Per-passenger fare for a route/class/tier (O(1) table lookup)"""
+        fare = self._loaded().table.get((route_id, seat_class, tier))
+        if fare is None:
+            raise KeyError(f"No fare for route {route_id} in class {seat_class}")
+        return fare
+
+    def fare_for_schedule(self, schedule, seat_class, held=0):
+        """Current per-passenger fare for a schedule, including surge"""
+        return self.get_fare(schedule.route_id, seat_class, self.surge_tier(schedule, seat_class, held))
+
+    def quote(self, schedules, seat_class, passengers=1, held=0):
+        """Server-side price for a journey: per-leg fares, GST, fee and total (held: see surge_tier)"""
+        leg_fares = [self.fare_for_schedule(s, seat_class, held) * passengers for s in schedules]
+        base = sum(leg_fares, Decimal('0'))
+        gst = money(base * GST_RATE)
+        return {
+            'leg_fares': leg_fares,
+            'base_fare': base,
+            'gst': gst,
+            'convenience_fee': CONVENIENCE_FEE,
+            'total': base + gst + CONVENIENCE_FEE,
+        }
+
+
+fare_engine = FareEngine()
@@ -1,7 +1,33 @@
 
 from django import forms
 from django.contrib.auth.models import User
+from django.urls import reverse_lazy
 from .models import Booking, Station, Train, Route, Schedule
+from .lookup import get_lookup_index
+
+class AutocompleteSelect(forms.Select):
+    """
+    FK select that renders only the selected option, labelled from the in-memory
+    lookup index (no queries). autocomplete_select.js turns it into a search box
+    that pages through the lookup endpoint.
+    """
+    
+    class Media:
+        js = ('js/autocomplete_select.js',)
+    
+    def __init__(self, kind, attrs=None):
+        self.kind = kind
+        attrs = {'class': 'form-control', **(attrs or {})}
+        attrs['data-autocomplete-url'] = reverse_lazy('lookup', kwargs={'kind': kind})
+        super().__init__(attrs)
+    
+    def optgroups(self, name, value, attrs=None):
+        index = get_lookup_index(self.kind)
+        options = [self.create_option(name, '', '---------', not any(value), 0)]
+        for position, selected in enumerate(v for v in value if v):
+            label = index.label(int(selected)) or selected
+            options.append(self.create_option(name, selected, label, True, position + 1))
+        return [(None, options, 0)]
 
 class BookingForm(forms.ModelForm):
     class Meta:
@@ -74,9 +100,9 @@ class RouteForm(forms.ModelForm):
         fields = ['train', 'source', 'destination', 'distance', 'duration_hours', 
                   'duration_minutes', 'base_fare_per_km', 'is_active']
         widgets = {
-            'train': forms.Select(attrs={'class': 'form-control'}),
-            'source': forms.Select(attrs={'class': 'form-control'}),
-            'destination': forms.Select(attrs={'class': 'form-control'}),
+            'train': AutocompleteSelect('train'),
+            'source': AutocompleteSelect('station'),
+            'destination': AutocompleteSelect('station'),
             'distance': forms.NumberInput(attrs={'class': 'form-control'}),
             'duration_hours': forms.NumberInput(attrs={'class': 'form-control'}),
             'duration_minutes': forms.NumberInput(attrs={'class': 'form-control'}),
@@ -91,7 +117,7 @@ class ScheduleForm(forms.ModelForm):
                   'ac_first_available', 'ac_two_tier_available', 'ac_three_tier_available',
                   'sleeper_available', 'general_available', 'is_active']
         widgets = {
-            'route': forms.Select(attrs={'class': 'form-control'}),
+            'route': AutocompleteSelect('route'),
             'departure_time': forms.TimeInput(attrs={'class': 'form-control', 'type': 'time'}),
             'arrival_time': forms.TimeInput(attrs={'class': 'form-control', 'type': 'time'}),
             'runs_on': forms.TextInput(attrs={
@@ -0,0 +1,133 @@
+"""
+In-memory spatial index over Station coordinates.
+
+Stations are bucketed into a fixed grid of GRID_DEGREES cells, so a radius query
+only looks at the cells overlapping the query's bounding box. The index is
+rebuilt when the timetable version moves, like the timetable snapshot. Stations
+without coordinates are left out; callers treat them as "unknown", never as "far".
+"""
+import math
+import threading
+
+from django.conf import settings
+
+from . import timetable
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE_LAT = 111.32
+GRID_DEGREES = 0.5
+MAX_NEARBY_RADIUS_KM = 500
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance in km"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+# ==================== Station Index ====================
+class StationIndex:
+    def __init__(self, stations, version=0):
+        """stations: iterable of (id, code, name, city, latitude, longitude)"""
+        self.version = version
+        self.stations = {}
+        self.cells = {}
+        for station_id, code, name, city, lat, lon in stations:
+            self.stations[station_id] = (code, name, city, lat, lon)
+            self.cells.setdefault(self._cell(lat, lon), []).append(station_id)
+
+    @classmethod
+    def from_db(cls):
+        from .models import Station, TimetableChange
+
+        version = TimetableChange.current_version()
+        stations = Station.objects.filter(latitude__isnull=False, longitude__isnull=False).values_list(
+            'id', 'code', 'name', 'city', 'latitude', 'longitude'
+        )
+        return cls(stations.iterator(), version)
+
+    @staticmethod
+    def _cell(lat, lon):
+        return int(math.floor(lat / GRID_DEGREES)), int(math.floor(lon / GRID_DEGREES))
+
+    def coords(self, station_id):
+        """(lat, lon) of a station, or None if it has no coordinates"""
+        station = self.stations.get(station_id)
+        return (station[3], station[4]) if station else None
+
+    def distance_km(self, a_id, b_id):
+        """Distance between two stations, or None if either has no coordinates"""
+        a, b = self.coords(a_id), self.coords(b_id)
+        if a is None or b is None:
+            return None
+        return haversine_km(a[0], a[1], b[0], b[1])
+
+    def nearby(self, lat, lon, radius_km, limit=10):
+        """[(distance_km, station_id)] within radius_km, nearest first"""
+        dlat = radius_km / KM_PER_DEGREE_LAT
+        dlon = radius_km / (KM_PER_DEGREE_LAT * max(math.cos(math.radians(lat)), 0.01))
+        min_row, min_col = self._cell(lat - dlat, lon - dlon)
+        max_row, max_col = self._cell(lat + dlat, lon + dlon)
+
+        found = []
+        for row in range(min_row, max_row + 1):
+            for col in range(min_col, max_col + 1):
+                for station_id in self.cells.get((row, col), ()):
+                    _, _, _, s_lat, s_lon = self.stations[station_id]
+                    distance = haversine_km(lat, lon, s_lat, s_lon)
+                    if distance <= radius_km:
+                        found.append((distance, station_id))
+        found.sort()
+        return found[:limit]
+
+    def city_centre(self, city):
+        """Mean coordinates of the indexed stations in a city, or None"""
+        points = [(s[3], s[4]) for s in self.stations.values() if s[2].lower() == city.lower()]
+        if not points:
+            return None
+        return sum(p[0] for p in points) / len(points), sum(p[1] for p in points) / len(points)
+
+    def plausible_via(self, source_id, dest_id, via_id, max_ratio):
+        """
+        False if going through via_id is a detour longer than max_ratio times the
+        straight-line distance. Unknown coordinates are always plausible.
+        """
+        direct = self.distance_km(source_id, dest_id)
+        first = self.distance_km(source_id, via_id)
+        second = self.distance_km(via_id, dest_id)
+        if direct is None or first is None or second is None or direct < 1:
+            return True
+        return first + second <= max_ratio * direct
+
+
+_lock = threading.Lock()
+_index = None
+
+
+def get_station_index():
+    """Process-wide station index, rebuilt when the timetable version moves"""
+    global _index
+    index = _index
+    if index is None or index.version < timetable.latest_version():
+        with _lock:
+            if _index is None or _index.version < timetable.latest_version():
+                _index = StationIndex.from_db()
+            index = _index
+    return index
+
+
+def detour_filter(source_id, dest_id):
+    """
+    Predicate on intermediate station ids that drops implausible detours, or None
+    when pruning is off (SEARCH_MAX_DETOUR_RATIO unset or 0).
+    """
+    max_ratio = getattr(settings, 'SEARCH_MAX_DETOUR_RATIO', 0)
+    if not max_ratio:
+        return None
+    index = get_station_index()
+    if index.coords(source_id) is None or index.coords(dest_id) is None:
+        return None
+    return lambda via_id: index.plausible_via(source_id, dest_id, via_id, max_ratio)
@@ -0,0 +1,95 @@
+"""
+In-memory label indexes for the station, train and route pickers.
+
+The admin forms' autocomplete widgets page through these instead of rendering
+every row as an <option>. Stations reuse the home page station catalog; trains
+and routes are rebuilt when the timetable version moves.
+"""
+import threading
+
+from . import timetable
+from .station_catalog import get_station_catalog
+
+LOOKUP_PAGE_SIZE = 20
+
+
+class LabelIndex:
+    def __init__(self, rows, version=0):
+        """rows: iterable of (id, label) in display order"""
+        self.version = version
+        self.rows = [(row_id, label, label.lower()) for row_id, label in rows]
+        self.labels = {row_id: label for row_id, label, _ in self.rows}
+
+    def label(self, row_id):
+        return self.labels.get(row_id)
+
+    def search(self, query, page=1, page_size=LOOKUP_PAGE_SIZE):
+        """(results, has_more) for labels containing query (case-insensitive)"""
+        query = query.strip().lower()
+        start = (page - 1) * page_size
+        results = []
+        skipped = 0
+        for row_id, label, folded in self.rows:
+            if query not in folded:
+                continue
+            if skipped < start:
+                skipped += 1
+                continue
+            if len(results) == page_size:
+                return results, True
+            results.append({'id': row_id, 'text': label})
+        return results, False
+
+
+def _station_rows():
+    return [(sid, f"{code} - {name}") for sid, code, name, city in get_station_catalog().stations]
+
+
+def _train_rows():
+    from .models import Train
+
+    return [(tid, f"{number} - {name}") for tid, number, name in
+            Train.objects.order_by('train_number').values_list('id', 'train_number', 'train_name')]
+
+
+def _route_rows():
+    from .models import Route
+
+    routes = Route.objects.order_by('train__train_number', 'source__code').values_list(
+        'id', 'train__train_number', 'source__code', 'destination__code'
+    )
+    # Same text as Route.__str__
+    return [(rid, f"{number}: {src} → {dst}") for rid, number, src, dst in routes]
+
+
+BUILDERS = {
+    'station': _station_rows,
+    'train': _train_rows,
+    'route': _route_rows,
+}
+
+_lock = threading.Lock()
+_indexes = {}
+
+
+def get_lookup_index(kind):
+    """Index for 'station', 'train' or 'route', rebuilt when the timetable version moves"""
+    if kind == 'station':
+        # Follows the station catalog, which only changes with stations
+        catalog = get_station_catalog()
+        index = _indexes.get(kind)
+        if index is None or index.version != catalog.tag:
+            index = _indexes[kind] = LabelIndex(_station_rows(), catalog.tag)
+        return index
+
+    latest = timetable.latest_version()
+    index = _indexes.get(kind)
+    if index is None or index.version < latest:
+        with _lock:
+            index = _indexes.get(kind)
+            if index is None or index.version < latest:
+                from .models import TimetableChange
+
+                version = TimetableChange.current_version()
+                index = _indexes[kind] = LabelIndex(BUILDERS[kind](), version)
+    return index
@@ -0,0 +1,40 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from railway_app.models import ArchivedBooking
+
+
+class Command(BaseCommand):
+    help = "Move bookings for long-past journeys from the hot booking tables to the archive (run nightly)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.BOOKING_ARCHIVE_AFTER_DAYS,
+                            help="Archive journeys more than N days past (default: BOOKING_ARCHIVE_AFTER_DAYS)")
+        parser.add_argument('--batch-size', type=int, default=settings.BOOKING_ARCHIVE_BATCH_SIZE,
+                            help="Bookings moved per transaction (default: BOOKING_ARCHIVE_BATCH_SIZE)")
+        parser.add_argument('--max-batches', type=int, default=0, help="Stop after N batches (default: no limit)")
+        parser.add_argument('--pause', type=float, default=0.05,
+                            help="Seconds between batches, so bookings get the write lock in between")
+
+    def handle(self, *args, **options):
+        if options['days'] <= 0:
+            self.stdout.write("Archiving is off (--days 0)")
+            return
+        cutoff = timezone.localdate() - timedelta(days=options['days'])
+        moved = batches = 0
+        started = time.perf_counter()
+        while not options['max_batches'] or batches < options['max_batches']:
+            count = ArchivedBooking.archive_before(cutoff, options['batch_size'])
+            if not count:
+                break
+            moved += count
+            batches += 1
+            time.sleep(options['pause'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {moved} bookings with journeys before {cutoff} in {batches} batches "
+            f"({time.perf_counter() - started:.1f}s)"
+        ))
@@ -0,0 +1,190 @@
+import collections
+import heapq
+import itertools
+import math
+
+from django.core.management.base import BaseCommand
+
+from railway_app.admission import TokenBucket, WaitingRoom
+
+
+class SimulatedClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class SimulatedDatabase:
+    """
+    Booking write path with a single writer, as on SQLite: transactions commit one at a
+    time in arrival order at `capacity` per second while at most `parallel` are in
+    flight. Beyond that, every extra waiter adds `contention` of lock polling and retry
+    overhead to each commit, so throughput falls as the backlog grows. Transactions
+    waiting longer than `busy_timeout` fail ("database is locked").
+    """
+
+    def __init__(self, capacity, parallel, contention, busy_timeout):
+        self.capacity = capacity
+        self.parallel = parallel
+        self.contention = contention
+        self.busy_timeout = busy_timeout
+        self.in_flight = collections.deque()  # (started at, arrived at), oldest first
+        self.progress = 0.0
+
+    def submit(self, now, arrived_at):
+        self.in_flight.append((now, arrived_at))
+
+    def step(self, now, dt):
+        """Advance by dt; returns (arrival times of finished bookings, number failed)"""
+        failed = 0
+        while self.in_flight and now - self.in_flight[0][0] >= self.busy_timeout:
+            self.in_flight.popleft()
+            failed += 1
+        if not self.in_flight:
+            self.progress = 0.0
+            return [], failed
+        overhead = 1 + self.contention * max(0, len(self.in_flight) - self.parallel)
+        self.progress += self.capacity / overhead * dt
+        finished = []
+        while self.progress >= 1 and self.in_flight:
+            self.progress -= 1
+            finished.append(self.in_flight.popleft()[1])
+        return finished, failed
+
+
+class SimulatedSlots:
+    """The admission max_active semaphore: FIFO waiters, giving up after max_wait"""
+
+    def __init__(self, max_active, max_wait):
+        self.max_active = max_active
+        self.max_wait = max_wait
+        self.waiting = collections.deque()  # (queued at, arrived at)
+
+    def submit(self, now, arrived_at):
+        self.waiting.append((now, arrived_at))
+
+    def step(self, now, db):
+        """Move waiters into free slots; returns the number that timed out"""
+        timed_out = 0
+        while self.waiting and now - self.waiting[0][0] > self.max_wait:
+            self.waiting.popleft()
+            timed_out += 1
+        while self.waiting and len(db.in_flight) < self.max_active:
+            db.submit(now, self.waiting.popleft()[1])
+        return timed_out
+
+
+class Command(BaseCommand):
+    help = "Simulate a booking-open surge with and without admission control and report goodput"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--capacity', type=float, default=50, help="Bookings/s the database sustains")
+        parser.add_argument('--overload', type=float, default=10, help="Offered load as a multiple of capacity")
+        parser.add_argument('--duration', type=float, default=60, help="Surge length in seconds")
+        parser.add_argument('--parallel', type=int, default=8,
+                            help="Concurrent transactions before contention sets in")
+        parser.add_argument('--contention', type=float, default=0.05,
+                            help="Extra cost per commit for each waiter beyond --parallel")
+        parser.add_argument('--busy-timeout', type=float, default=5, help="Seconds before a transaction fails")
+        parser.add_argument('--admit-rate', type=float, default=None,
+                            help="Admission rate in bookings/s (default: 90%% of capacity)")
+        parser.add_argument('--max-active', type=int, default=None,
+                            help="Admitted bookings running at once (default: --parallel)")
+        parser.add_argument('--patience', type=float, default=600, help="Seconds a user stays in the queue")
+        parser.add_argument('--step', type=float, default=0.02, help="Simulation time step in seconds")
+
+    def handle(self, *args, **options):
+        admit_rate = options['admit_rate'] or options['capacity'] * 0.9
+        self.stdout.write(
+            f"capacity {options['capacity']:.0f}/s, offered {options['capacity'] * options['overload']:.0f}/s "
+            f"for {options['duration']:.0f}s, admission rate {admit_rate:.0f}/s"
+        )
+        self.stdout.write(f"{'mode':<11}{'offered':>9}{'booked':>8}{'failed':>8}{'gave up':>9}"
+                          f"{'goodput/s':>11}{'p50 s':>8}{'p95 s':>8}{'max queue':>11}")
+        timelines = {}
+        for mode in ('none', 'admission'):
+            stats = self.simulate(mode, admit_rate, options)
+            timelines[mode] = stats['timeline']
+            self.stdout.write(
+                f"{mode:<11}{stats['offered']:>9}{stats['booked']:>8}{stats['failed']:>8}{stats['gave_up']:>9}"
+                f"{stats['goodput']:>11.1f}{stats['p50']:>8.1f}{stats['p95']:>8.1f}{stats['max_queue']:>11}"
+            )
+
+        self.stdout.write("\nbookings/s per 10s window during the surge")
+        for mode, timeline in timelines.items():
+            self.stdout.write(f"{mode:<11}" + ''.join(f"{rate:>7.1f}" for rate in timeline))
+
+    def simulate(self, mode, admit_rate, options):
+        clock = SimulatedClock()
+        db = SimulatedDatabase(options['capacity'], options['parallel'], options['contention'], options['busy_timeout'])
+        room = WaitingRoom(
+            # Bursts no larger than the writer handles without contention
+            TokenBucket(admit_rate, options['parallel'], clock=clock),
+            max_queue=10 ** 9, idle_seconds=30, admit_seconds=60, clock=clock,
+        )
+        slots = SimulatedSlots(options['max_active'] or options['parallel'], max_wait=5)
+        step, duration = options['step'], options['duration']
+        arrival_rate = options['capacity'] * options['overload']
+
+        polls = []  # (time, order, ticket id, arrived at)
+        order = itertools.count()
+        offered = failed = gave_up = max_queue = 0
+        latencies = []
+        windows = [0] * math.ceil(duration / 10)
+        due = 0.0
+
+        # Run the surge, then let the queue drain
+        while clock.now < duration or polls or slots.waiting or db.in_flight:
+            if clock.now < duration:
+                due += arrival_rate * step
+                while due >= 1:
+                    due -= 1
+                    offered += 1
+                    if mode == 'none':
+                        db.submit(clock.now, clock.now)
+                        continue
+                    admitted, ticket = room.enter()
+                    if admitted:
+                        slots.submit(clock.now, clock.now)
+                    else:
+                        _, position = room.poll(ticket.id)
+                        heapq.heappush(polls, (clock.now + room.retry_after(position), next(order), ticket.id, clock.now))
+
+            while polls and polls[0][0] <= clock.now:
+                _, _, ticket_id, arrived_at = heapq.heappop(polls)
+                if clock.now - arrived_at > options['patience']:
+                    gave_up += 1
+                    continue
+                state, position = room.poll(ticket_id)
+                if state == WaitingRoom.ADMITTED and room.use(ticket_id):
+                    slots.submit(clock.now, arrived_at)
+                elif state == WaitingRoom.WAITING:
+                    heapq.heappush(polls, (clock.now + room.retry_after(position), next(order), ticket_id, arrived_at))
+                else:
+                    gave_up += 1
+            max_queue = max(max_queue, len(room.waiting))
+
+            failed += slots.step(clock.now, db)
+            finished, lost = db.step(clock.now, step)
+            failed += lost
+            for arrived_at in finished:
+                latencies.append(clock.now - arrived_at)
+                if clock.now < duration:
+                    windows[int(clock.now // 10)] += 1
+            clock.now += step
+
+        latencies.sort()
+        percentile = lambda p: latencies[min(int(p * len(latencies)), len(latencies) - 1)] if latencies else 0.0
+        return {
+            'offered': offered,
+            'booked': len(latencies),
+            'failed': failed,
+            'gave_up': gave_up,
+            'goodput': sum(windows) / duration,
+            'p50': percentile(0.5),
+            'p95': percentile(0.95),
+            'max_queue': max_queue,
+            'timeline': [count / 10 for count in windows],
+        }
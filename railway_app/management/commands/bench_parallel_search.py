@@ -0,0 +1,73 @@
+import os
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from railway_app import timetable
+from railway_app.timetable import Timetable
+
+
+class Command(BaseCommand):
+    help = "Benchmark the process-pool connecting search on a synthetic hub timetable (no database needed)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--intermediates', type=int, default=2000, help="Stations reachable from the hub")
+        parser.add_argument('--schedules', type=int, default=8, help="Schedules per route")
+        parser.add_argument('--workers', default='1,2,4,8', help="Comma-separated pool sizes to try")
+        parser.add_argument('--repeat', type=int, default=3, help="Runs per configuration (best is reported)")
+
+    def handle(self, *args, **options):
+        tt = self.build_timetable(options['intermediates'], options['schedules'])
+        hub, dest, weekday = tt.station_index[0], tt.station_index[1], 2
+        first_rows = tt.first_leg_rows(hub, dest, weekday)
+        available = frozenset(tt.schedule_id)
+        self.stdout.write(f"{len(tt)} schedules, {len(first_rows)} first legs from the hub, {os.cpu_count()} CPUs")
+
+        started = time.perf_counter()
+        baseline = sorted(tt.connecting(first_rows, dest, weekday, 30, available), key=lambda o: o[3])
+        sequential = time.perf_counter() - started
+        self.stdout.write(f"{'workers':<10}{'seconds':>10}{'speedup':>10}")
+        self.stdout.write(f"{'inline':<10}{sequential:>10.3f}{1.0:>10.2f}")
+
+        for workers in [int(w) for w in options['workers'].split(',')]:
+            timetable.invalidate()
+            # First call forks the pool; keep that out of the timing
+            timetable.parallel_connecting(tt, first_rows[:1], dest, weekday, 30, available, workers)
+            best = None
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                result = timetable.parallel_connecting(tt, first_rows, dest, weekday, 30, available, workers)
+                elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+            if [o[3] for o in result] != [o[3] for o in baseline]:
+                self.stderr.write(f"Result mismatch with {workers} workers")
+            self.stdout.write(f"{workers:<10}{best:>10.3f}{sequential / best:>10.2f}")
+        timetable.invalidate()
+
+    @staticmethod
+    def build_timetable(intermediates, per_route):
+        """Hub (id 0) -> every intermediate -> destination (id 1), plus cross links between intermediates"""
+        rnd = random.Random(42)
+        station_ids = list(range(intermediates + 2))
+        rows = []
+        schedule_id = 0
+        route_id = 0
+
+        def add_route(src, dst):
+            nonlocal schedule_id, route_id
+            route_id += 1
+            distance = rnd.randint(50, 1500)
+            for _ in range(per_route):
+                schedule_id += 1
+                dep = rnd.randrange(24 * 60)
+                rows.append((schedule_id, route_id, route_id, src, dst, dep,
+                             (dep + rnd.randint(60, 1200)) % (24 * 60), rnd.randint(1, 127), distance, distance * 150))
+
+        for mid in range(2, intermediates + 2):
+            add_route(0, mid)
+            add_route(mid, 1)
+            for other in rnd.sample(range(2, intermediates + 2), 5):
+                if other != mid:
+                    add_route(mid, other)
+        return Timetable(station_ids, rows)
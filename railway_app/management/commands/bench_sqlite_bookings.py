@@ -0,0 +1,89 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+
+from railway_project.sqlite_tuning import sqlite_pragmas
+
+# Default Python/Django SQLite behaviour vs the tuned profile (settings.SQLITE_PRAGMAS with WAL)
+PROFILES = {
+    'default': {'pragmas': {'journal_mode': 'DELETE', 'synchronous': 'FULL'}, 'begin': 'BEGIN'},
+    'tuned': {'pragmas': None, 'begin': 'BEGIN IMMEDIATE'},
+}
+
+SCHEMA = """
+CREATE TABLE schedule (id INTEGER PRIMARY KEY, sleeper_available INTEGER NOT NULL);
+CREATE TABLE booking (id INTEGER PRIMARY KEY AUTOINCREMENT, pnr TEXT UNIQUE NOT NULL, total_fare TEXT NOT NULL);
+CREATE TABLE booking_leg (id INTEGER PRIMARY KEY AUTOINCREMENT, booking_id INTEGER NOT NULL, schedule_id INTEGER NOT NULL);
+"""
+
+
+class Command(BaseCommand):
+    help = "Benchmark concurrent booking transactions on SQLite, default settings vs the tuned profile"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help="Concurrent booking writers")
+        parser.add_argument('--bookings', type=int, default=200, help="Bookings attempted per writer")
+        parser.add_argument('--schedules', type=int, default=4, help="Schedules the writers compete for")
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'profile':<10}{'booked':>8}{'locked':>8}{'seconds':>10}{'bookings/s':>12}")
+        for name, profile in PROFILES.items():
+            pragmas = profile['pragmas'] if profile['pragmas'] is not None else sqlite_pragmas(wal=True)
+            booked, locked, elapsed = self.run_profile(pragmas, profile['begin'], options)
+            self.stdout.write(f"{name:<10}{booked:>8}{locked:>8}{elapsed:>10.2f}{booked / elapsed:>12.1f}")
+
+    def run_profile(self, pragmas, begin, options):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'bench.sqlite3')
+            setup = sqlite3.connect(path)
+            setup.executescript(SCHEMA)
+            setup.executemany("INSERT INTO schedule (id, sleeper_available) VALUES (?, ?)",
+                              [(i, 10 ** 9) for i in range(options['schedules'])])
+            setup.commit()
+            setup.close()
+
+            counts = {'booked': 0, 'locked': 0}
+            counts_lock = threading.Lock()
+            start_gate = threading.Barrier(options['threads'])
+
+            def writer(worker):
+                # Python's default 5s busy timeout applies to both profiles
+                conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+                for pragma, value in pragmas.items():
+                    conn.execute(f'PRAGMA {pragma} = {value}')
+                booked = locked = 0
+                start_gate.wait()
+                for n in range(options['bookings']):
+                    schedule_id = n % options['schedules']
+                    try:
+                        conn.execute(begin)
+                        conn.execute("SELECT sleeper_available FROM schedule WHERE id = ?", (schedule_id,)).fetchone()
+                        conn.execute("UPDATE schedule SET sleeper_available = sleeper_available - 1 "
+                                     "WHERE id = ? AND sleeper_available >= 1", (schedule_id,))
+                        cursor = conn.execute("INSERT INTO booking (pnr, total_fare) VALUES (?, ?)",
+                                              (f'{worker:03d}{n:07d}', '359.75'))
+                        conn.execute("INSERT INTO booking_leg (booking_id, schedule_id) VALUES (?, ?)",
+                                     (cursor.lastrowid, schedule_id))
+                        conn.execute("COMMIT")
+                        booked += 1
+                    except sqlite3.OperationalError:
+                        locked += 1
+                        if conn.in_transaction:
+                            conn.execute("ROLLBACK")
+                conn.close()
+                with counts_lock:
+                    counts['booked'] += booked
+                    counts['locked'] += locked
+
+            threads = [threading.Thread(target=writer, args=(i,)) for i in range(options['threads'])]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+        return counts['booked'], counts['locked'], elapsed
@@ -0,0 +1,32 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from railway_app import timetable
+from railway_app.timetable import Timetable
+
+
+class Command(BaseCommand):
+    help = "Compile active stations, routes and schedules into the binary timetable snapshot"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=None,
+                            help="Snapshot file (default: settings.TIMETABLE_SNAPSHOT_PATH)")
+
+    def handle(self, *args, **options):
+        path = options['output'] or settings.TIMETABLE_SNAPSHOT_PATH
+        if not path:
+            raise CommandError("Pass --output or set TIMETABLE_SNAPSHOT_PATH")
+
+        started = time.perf_counter()
+        tt = timetable.compile_snapshot(path)
+        compiled = time.perf_counter() - started
+
+        started = time.perf_counter()
+        Timetable.load(path)
+        loaded = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {len(tt)} schedules, {len(tt.station_ids)} stations to {path} "
+            f"(compile {compiled * 1000:.0f} ms, load {loaded * 1000:.1f} ms)"
+        ))
@@ -0,0 +1,28 @@
+import os
+
+from django.core.management.base import BaseCommand
+from django.utils.dateparse import parse_datetime
+
+from railway_app.ticket_tokens import RevocationList, revoked_since
+
+
+class Command(BaseCommand):
+    help = "Write the revocation list of cancelled PNRs for offline ticket checkers"
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help="Revocation list file; an existing one is synced incrementally")
+        parser.add_argument('--full', action='store_true', help="Rebuild the list instead of syncing it")
+
+    def handle(self, *args, **options):
+        path = options['output']
+        revoked = RevocationList()
+        if os.path.exists(path) and not options['full']:
+            revoked = RevocationList.load(path)
+        before = len(revoked.pnrs)
+        since = parse_datetime(revoked.synced_at) if revoked.synced_at else None
+        revoked.merge(revoked_since(since))
+        revoked.save(path)
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(revoked.pnrs) - before} newly revoked, {len(revoked.pnrs)} PNRs in {path} "
+            f"(synced at {revoked.synced_at})"
+        ))
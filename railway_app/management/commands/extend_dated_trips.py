@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from railway_app.models import DatedTrip
+
+
+class Command(BaseCommand):
+    help = "Expand schedules into dated trips up to the search horizon and drop past trips (run nightly)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.DATED_TRIP_HORIZON_DAYS,
+                            help="Expand this many days ahead (default: DATED_TRIP_HORIZON_DAYS)")
+
+    def handle(self, *args, **options):
+        expanded, pruned = DatedTrip.extend(options['days'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Expanded {expanded} schedule runs, pruned {pruned} past trips; trips cover up to {DatedTrip.horizon()}"
+        ))
@@ -0,0 +1,20 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from railway_app.models import TimetableChange
+
+
+class Command(BaseCommand):
+    help = "Delete old timetable change-log entries (caches older than the log reload fully)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7,
+                            help="Keep entries from the last N days (default: 7)")
+
+    def handle(self, *args, **options):
+        deleted = TimetableChange.prune(timezone.now() - timedelta(days=options['days']))
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {deleted} change-log entries; timetable version is {TimetableChange.current_version()}"
+        ))
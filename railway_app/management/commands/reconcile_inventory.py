@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from railway_app.models import InventoryEntry
+
+
+class Command(BaseCommand):
+    help = "Check seat counters against the inventory ledger and live bookings/holds, optionally repairing drift"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repair', action='store_true',
+                            help="Set drifting counters to the expected value and ledger the correction")
+        parser.add_argument('--limit', type=int, default=50, help="Drifting pairs to list (default: 50)")
+
+    def handle(self, *args, **options):
+        drift = InventoryEntry.reconcile(repair=options['repair'])
+        if not drift:
+            self.stdout.write(self.style.SUCCESS("Seat counters match the ledger and live bookings"))
+            return
+        
+        self.stdout.write(f"{'schedule':>9} {'class':<10}{'counter':>8}{'ledger':>8}{'expected':>9}")
+        for schedule_id, seat_class, counter, ledger, expected in drift[:options['limit']]:
+            self.stdout.write(f"{schedule_id:>9} {seat_class:<10}{counter:>8}{ledger:>8}{expected:>9}")
+        if len(drift) > options['limit']:
+            self.stdout.write(f"... and {len(drift) - options['limit']} more")
+        
+        # counter != ledger: changed without an entry; ledger != expected: seats lost or double-counted
+        unlogged = sum(1 for _, _, counter, ledger, _ in drift if counter != ledger)
+        summary = f"{len(drift)} drifting pairs ({unlogged} changed outside the ledger)"
+        if options['repair']:
+            self.stdout.write(self.style.SUCCESS(f"Repaired {summary}"))
+        else:
+            self.stdout.write(self.style.WARNING(f"{summary}; run with --repair to fix"))
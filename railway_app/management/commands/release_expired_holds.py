@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from railway_app.models import SeatHold
+
+
+class Command(BaseCommand):
+    help = "Release expired seat holds back to schedule inventory in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Holds released per transaction (default: 1000)")
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            released = SeatHold.release_expired(batch_size=options['batch_size'])
+            total += released
+            if released < options['batch_size']:
+                break
+        self.stdout.write(self.style.SUCCESS(f"Released {total} expired seat holds"))
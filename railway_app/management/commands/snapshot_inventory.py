@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from railway_app.models import InventoryEntry, InventorySnapshot
+
+
+class Command(BaseCommand):
+    help = "Snapshot inventory ledger balances so balance reads only scan newer entries (run every few minutes)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep', type=int, default=2,
+                            help="Snapshot sets to keep (default: 2)")
+
+    def handle(self, *args, **options):
+        through, rows = InventorySnapshot.take(max(options['keep'], 1))
+        tail = InventoryEntry.objects.filter(id__gt=through).count()
+        self.stdout.write(self.style.SUCCESS(
+            f"Snapshot through entry #{through} ({rows} balances written); {tail} entries in the tail"
+        ))
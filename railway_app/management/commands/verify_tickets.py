@@ -0,0 +1,61 @@
+import sys
+import time
+from collections import Counter
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from railway_app.ticket_tokens import InvalidTicket, RevocationList, signing_keys, verify
+
+
+class Command(BaseCommand):
+    help = "Verify ticket tokens (one per line) offline against the signing keys and a revocation list"
+    # Verification must work on a checker without a database
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('tokens', nargs='?', default='-', help="File of tokens, one per line (default: stdin)")
+        parser.add_argument('--revoked', help="Revocation list written by export_revoked_tickets")
+        parser.add_argument('--date', help="Only accept tickets for this journey date (YYYY-MM-DD)")
+        parser.add_argument('--quiet', action='store_true', help="Only print the summary")
+
+    def handle(self, *args, **options):
+        revoked = RevocationList.load(options['revoked']) if options['revoked'] else None
+        on_date = None
+        if options['date']:
+            try:
+                on_date = datetime.strptime(options['date'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError("--date must be YYYY-MM-DD")
+
+        if options['tokens'] == '-':
+            tokens = [line.strip() for line in sys.stdin]
+        else:
+            with open(options['tokens'], encoding='utf-8') as f:
+                tokens = [line.strip() for line in f]
+        tokens = [token for token in tokens if token]
+
+        keys = signing_keys()
+        results = Counter()
+        started = time.perf_counter()
+        for token in tokens:
+            try:
+                claims = verify(token, keys=keys, revoked=revoked, on_date=on_date)
+            except InvalidTicket as e:
+                results[str(e)] += 1
+                if not options['quiet']:
+                    self.stdout.write(f"INVALID {token[:24]}... {e}")
+            else:
+                results['valid'] += 1
+                if not options['quiet']:
+                    self.stdout.write(
+                        f"VALID {claims.pnr} {claims.journey_date} {claims.seat_class} x{claims.passenger_count} "
+                        + ' '.join(f"{leg.train_number}:{leg.source}-{leg.destination}" for leg in claims.legs)
+                    )
+        elapsed = time.perf_counter() - started
+
+        rate = len(tokens) / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Verified {len(tokens)} tokens in {elapsed:.3f}s ({rate:,.0f}/s): "
+            + ', '.join(f"{reason} {count}" for reason, count in results.most_common())
+        ))
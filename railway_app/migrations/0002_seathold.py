@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:36
+
+import django.core.validators
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('railway_app', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SeatHold',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hold_token', models.CharField(db_index=True, max_length=32)),
+                ('seat_class', models.CharField(choices=[('AC_FIRST', 'AC First Class'), ('AC_2_TIER', 'AC 2-Tier'), ('AC_3_TIER', 'AC 3-Tier'), ('SLEEPER', 'Sleeper'), ('GENERAL', 'General')], max_length=20)),
+                ('seats', models.IntegerField(default=1, validators=[django.core.validators.MinValueValidator(1)])),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+                ('schedule', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='holds', to='railway_app.schedule')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='seat_holds', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'Seat Holds',
+                'ordering': ['expires_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:36
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def copy_lead_passengers(apps, schema_editor):
+    """Give every existing booking a Passenger row for its single traveller"""
+    Booking = apps.get_model('railway_app', 'Booking')
+    Passenger = apps.get_model('railway_app', 'Passenger')
+    batch = []
+    for booking in Booking.objects.prefetch_related('legs').iterator(chunk_size=1000):
+        batch.append(Passenger(
+            booking_id=booking.id,
+            name=booking.passenger_name,
+            age=booking.passenger_age,
+            gender=booking.passenger_gender,
+            seat_numbers=','.join(leg.seat_number for leg in booking.legs.all()),
+            sequence=1,
+        ))
+        if len(batch) >= 1000:
+            Passenger.objects.bulk_create(batch)
+            batch = []
+    Passenger.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('railway_app', '0002_seathold'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='booking',
+            name='passenger_count',
+            field=models.IntegerField(default=1, validators=[django.core.validators.MinValueValidator(1)]),
+        ),
+        migrations.CreateModel(
+            name='Passenger',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('age', models.IntegerField(validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(120)])),
+                ('gender', models.CharField(choices=[('M', 'Male'), ('F', 'Female'), ('O', 'Other')], max_length=1)),
+                ('seat_numbers', models.CharField(blank=True, help_text='Seat per leg, e.g. 1A or 1A,32C', max_length=50)),
+                ('sequence', models.IntegerField(default=1)),
+                ('booking', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='passengers', to='railway_app.booking')),
+            ],
+            options={
+                'verbose_name_plural': 'Passengers',
+                'ordering': ['sequence'],
+            },
+        ),
+        migrations.RunPython(copy_lead_passengers, migrations.RunPython.noop),
+    ]
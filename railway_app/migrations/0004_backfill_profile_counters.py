@@ -0,0 +1,35 @@
+from django.db import migrations
+from django.db.models import Count, Sum, Q
+
+
+def backfill_profile_counters(apps, schema_editor):
+    """Seed total_bookings/total_spent from existing bookings in one grouped query"""
+    Booking = apps.get_model('railway_app', 'Booking')
+    UserProfile = apps.get_model('railway_app', 'UserProfile')
+    totals = (
+        Booking.objects.filter(user__isnull=False)
+        .values('user_id')
+        .annotate(
+            confirmed=Count('id', filter=Q(status='CONFIRMED')),
+            spent=Sum('total_fare', filter=Q(status='CONFIRMED')),
+            kept=Sum('total_fare', filter=Q(status='CANCELLED')),
+            refunded=Sum('refund_amount', filter=Q(status='CANCELLED')),
+        )
+    )
+    for row in totals:
+        spent = (row['spent'] or 0) + (row['kept'] or 0) - (row['refunded'] or 0)
+        UserProfile.objects.update_or_create(
+            user_id=row['user_id'],
+            defaults={'total_bookings': row['confirmed'], 'total_spent': spent},
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('railway_app', '0003_passenger'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_profile_counters, migrations.RunPython.noop),
+    ]
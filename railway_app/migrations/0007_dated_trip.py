@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('railway_app', '0006_booking_date_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DatedTrip',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('service_date', models.DateField(help_text='Date the train leaves its origin')),
+                ('departure_ts', models.DateTimeField()),
+                ('arrival_ts', models.DateTimeField()),
+                ('destination', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='railway_app.station')),
+                ('origin', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='railway_app.station')),
+                ('schedule', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trips', to='railway_app.schedule')),
+            ],
+            options={
+                'ordering': ['departure_ts'],
+                'indexes': [models.Index(fields=['origin', 'departure_ts'], name='railway_app_origin__10f791_idx'), models.Index(fields=['destination', 'arrival_ts'], name='railway_app_destina_a52a6b_idx')],
+                'unique_together': {('schedule', 'service_date')},
+            },
+        ),
+    ]
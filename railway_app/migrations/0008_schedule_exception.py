@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('railway_app', '0007_dated_trip'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScheduleException',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('CANCELLED', 'Cancelled'), ('DIVERTED', 'Diverted'), ('EXTRA', 'Extra run')], max_length=10)),
+                ('start_date', models.DateField()),
+                ('end_date', models.DateField(help_text='Last affected date (inclusive)')),
+                ('reason', models.CharField(blank=True, max_length=200)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('schedule', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='exceptions', to='railway_app.schedule')),
+            ],
+            options={
+                'ordering': ['start_date'],
+                'indexes': [models.Index(fields=['schedule', 'start_date'], name='railway_app_schedul_755a0b_idx')],
+            },
+        ),
+    ]
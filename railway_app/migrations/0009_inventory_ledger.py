@@ -0,0 +1,87 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Sum
+
+SEAT_FIELDS = {
+    'AC_FIRST': 'ac_first_available',
+    'AC_2_TIER': 'ac_two_tier_available',
+    'AC_3_TIER': 'ac_three_tier_available',
+    'SLEEPER': 'sleeper_available',
+    'GENERAL': 'general_available',
+}
+
+
+def open_inventory_ledger(apps, schema_editor):
+    """
+    Start the ledger from the current counters: an opening balance of the counter
+    plus the seats live bookings and holds already took, then those takings, so
+    every pair's balance equals its counter.
+    """
+    Schedule = apps.get_model('railway_app', 'Schedule')
+    BookingLeg = apps.get_model('railway_app', 'BookingLeg')
+    SeatHold = apps.get_model('railway_app', 'SeatHold')
+    InventoryEntry = apps.get_model('railway_app', 'InventoryEntry')
+    booked = {
+        (row['schedule_id'], row['booking__seat_class']): row['total']
+        for row in BookingLeg.objects.exclude(booking__status='CANCELLED')
+        .values('schedule_id', 'booking__seat_class').annotate(total=Sum('booking__passenger_count'))
+    }
+    held = {
+        (row['schedule_id'], row['seat_class']): row['total']
+        for row in SeatHold.objects.values('schedule_id', 'seat_class').annotate(total=Sum('seats'))
+    }
+    entries = []
+    for row in Schedule.objects.values('id', *SEAT_FIELDS.values()).iterator():
+        for seat_class, attr in SEAT_FIELDS.items():
+            key = (row['id'], seat_class)
+            taken_booked, taken_held = booked.get(key, 0), held.get(key, 0)
+            for delta, reason in ((row[attr] + taken_booked + taken_held, 'OPENING'),
+                                  (-taken_booked, 'BOOK'), (-taken_held, 'HOLD')):
+                if delta:
+                    entries.append(InventoryEntry(schedule_id=row['id'], seat_class=seat_class, delta=delta,
+                                                  reason=reason))
+    InventoryEntry.objects.bulk_create(entries, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('railway_app', '0008_schedule_exception'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InventorySnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seat_class', models.CharField(choices=[('AC_FIRST', 'AC First Class'), ('AC_2_TIER', 'AC 2-Tier'), ('AC_3_TIER', 'AC 3-Tier'), ('SLEEPER', 'Sleeper'), ('GENERAL', 'General')], max_length=20)),
+                ('available', models.IntegerField()),
+                ('through_entry', models.BigIntegerField(db_index=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('schedule', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inventory_snapshots', to='railway_app.schedule')),
+            ],
+            options={
+                'ordering': ['-through_entry'],
+            },
+        ),
+        migrations.CreateModel(
+            name='InventoryEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seat_class', models.CharField(choices=[('AC_FIRST', 'AC First Class'), ('AC_2_TIER', 'AC 2-Tier'), ('AC_3_TIER', 'AC 3-Tier'), ('SLEEPER', 'Sleeper'), ('GENERAL', 'General')], max_length=20)),
+                ('delta', models.IntegerField()),
+                ('reason', models.CharField(choices=[('OPENING', 'Opening balance'), ('ADJUST', 'Admin adjustment'), ('BOOK', 'Booked'), ('CANCEL', 'Cancelled'), ('HOLD', 'Held'), ('RELEASE', 'Hold released'), ('RECONCILE', 'Reconciliation repair')], max_length=10)),
+                ('reference', models.CharField(blank=True, max_length=32)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('schedule', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inventory_entries', to='railway_app.schedule')),
+            ],
+            options={
+                'verbose_name_plural': 'Inventory Entries',
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['schedule', 'seat_class'], name='railway_app_schedul_fe509f_idx')],
+            },
+        ),
+        migrations.RunPython(open_inventory_ledger, migrations.RunPython.noop),
+    ]
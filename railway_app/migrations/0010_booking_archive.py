@@ -0,0 +1,63 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('railway_app', '0009_inventory_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedBooking',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pnr', models.CharField(max_length=10, unique=True)),
+                ('user_id', models.IntegerField(blank=True, db_index=True, null=True)),
+                ('passenger_name', models.CharField(max_length=100)),
+                ('passenger_email', models.EmailField(max_length=254)),
+                ('passenger_phone', models.CharField(max_length=15)),
+                ('passenger_age', models.IntegerField()),
+                ('passenger_gender', models.CharField(choices=[('M', 'Male'), ('F', 'Female'), ('O', 'Other')], max_length=1)),
+                ('passenger_count', models.IntegerField(default=1)),
+                ('passengers', models.JSONField(default=list)),
+                ('booking_date', models.DateTimeField()),
+                ('journey_date', models.DateField(db_index=True)),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('CONFIRMED', 'Confirmed'), ('CANCELLED', 'Cancelled')], max_length=20)),
+                ('seat_class', models.CharField(choices=[('AC_FIRST', 'AC First Class'), ('AC_2_TIER', 'AC 2-Tier'), ('AC_3_TIER', 'AC 3-Tier'), ('SLEEPER', 'Sleeper'), ('GENERAL', 'General')], max_length=20)),
+                ('total_fare', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('is_refundable', models.BooleanField(default=True)),
+                ('cancellation_date', models.DateTimeField(blank=True, null=True)),
+                ('refund_amount', models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Archived Bookings',
+                'ordering': ['-booking_date'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedBookingLeg',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('leg_sequence', models.IntegerField(default=1)),
+                ('schedule_id', models.IntegerField(db_index=True)),
+                ('train_number', models.CharField(max_length=10)),
+                ('train_name', models.CharField(max_length=100)),
+                ('source_code', models.CharField(max_length=5)),
+                ('destination_code', models.CharField(max_length=5)),
+                ('departure_time', models.TimeField()),
+                ('arrival_time', models.TimeField()),
+                ('seat_number', models.CharField(max_length=5)),
+                ('leg_fare', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('booking', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='legs', to='railway_app.archivedbooking')),
+            ],
+            options={
+                'verbose_name_plural': 'Archived Booking Legs',
+                'ordering': ['leg_sequence'],
+            },
+        ),
+    ]
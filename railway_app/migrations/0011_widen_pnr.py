@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('railway_app', '0010_booking_archive'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='archivedbooking',
+            name='pnr',
+            field=models.CharField(max_length=14, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='booking',
+            name='pnr',
+            field=models.CharField(db_index=True, editable=False, max_length=14, unique=True),
+        ),
+    ]
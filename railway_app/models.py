@@ -1,9 +1,18 @@
-from django.db import models
+from django.conf import settings
+from django.db import models, router, transaction, connection
+from django.db.models import F, Max, Prefetch, Sum
 from django.contrib.auth.models import User
+from django.utils import timezone
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator, MaxValueValidator
+from collections import namedtuple
 from datetime import datetime, timedelta
 import uuid
 
+from railway_project.sqlite_tuning import immediate_transaction
+
+from .pnr import PNR_LENGTH, pnr_allocator
+
 # ==================== Station Model ====================
 class Station(models.Model):
     code = models.CharField(max_length=5, unique=True, help_text="Station code (e.g., BZA)")
@@ -88,7 +97,8 @@ class Route(models.Model):
     
     @property
     def calculated_fare(self):
-        return float(self.base_fare_per_km) * self.distance
+        """Flat distance fare before class, slab and surge adjustments"""
+        return self.base_fare_per_km * self.distance
 
 # ==================== Schedule Model ====================
 class Schedule(models.Model):
@@ -128,31 +138,194 @@ class Schedule(models.Model):
     def __str__(self):
         return f"{self.route} @ {self.departure_time}"
     
+    # Availability field for each seat class
+    SEAT_FIELDS = {
+        'AC_FIRST': 'ac_first_available',
+        'AC_2_TIER': 'ac_two_tier_available',
+        'AC_3_TIER': 'ac_three_tier_available',
+        'SLEEPER': 'sleeper_available',
+        'GENERAL': 'general_available',
+    }
+    # Fields searches and dated trips are built from; a save changing none of them
+    # (seat counters only) is not a timetable change
+    TIMETABLE_FIELDS = ('route_id', 'departure_time', 'arrival_time', 'runs_on', 'is_active')
+    
     def get_available_seats(self, seat_class):
         """Get available seats for a specific class"""
-        class_map = {
-            'AC_FIRST': self.ac_first_available,
-            'AC_2_TIER': self.ac_two_tier_available,
-            'AC_3_TIER': self.ac_three_tier_available,
-            'SLEEPER': self.sleeper_available,
-            'GENERAL': self.general_available,
-        }
-        return class_map.get(seat_class, 0)
-    
-    def reduce_available_seats(self, seat_class, count=1):
-        """Reduce seat count for a class"""
-        class_map = {
-            'AC_FIRST': 'ac_first_available',
-            'AC_2_TIER': 'ac_two_tier_available',
-            'AC_3_TIER': 'ac_three_tier_available',
-            'SLEEPER': 'sleeper_available',
-            'GENERAL': 'general_available',
-        }
-        attr = class_map.get(seat_class)
+        attr = self.SEAT_FIELDS.get(seat_class)
+        return getattr(self, attr) if attr else 0
+    
+    # Counters only change through these methods or save(); each change is written to
+    # the InventoryEntry ledger in the caller's transaction
+    def reduce_available_seats(self, seat_class, count=1, reason=None, reference=''):
+        """Atomically reduce seat count for a class (default reason BOOK); False if not enough seats"""
+        attr = self.SEAT_FIELDS.get(seat_class)
+        if not attr:
+            return False
+        updated = Schedule.objects.filter(pk=self.pk, **{f'{attr}__gte': count}).update(**{attr: F(attr) - count})
+        if updated:
+            setattr(self, attr, getattr(self, attr) - count)
+            InventoryEntry.record([(self.pk, seat_class, -count, reason or InventoryEntry.BOOK, reference)])
+        return bool(updated)
+    
+    def restore_available_seats(self, seat_class, count=1, reason=None, reference=''):
+        """Atomically give seats back to a class (default reason CANCEL)"""
+        attr = self.SEAT_FIELDS.get(seat_class)
         if attr:
-            current = getattr(self, attr, 0)
-            setattr(self, attr, max(0, current - count))
-            self.save()
+            Schedule.objects.filter(pk=self.pk).update(**{attr: F(attr) + count})
+            setattr(self, attr, getattr(self, attr) + count)
+            InventoryEntry.record([(self.pk, seat_class, count, reason or InventoryEntry.CANCEL, reference)])
+
+# ==================== Schedule Exception Model ====================
+class ScheduleException(models.Model):
+    """
+    A date range on which a schedule departs the weekly runs_on pattern: the run is
+    cancelled or diverted (not bookable on its route), or an extra run is added.
+    Dates are departure dates from the route's source.
+    """
+    CANCELLED = 'CANCELLED'
+    DIVERTED = 'DIVERTED'
+    EXTRA = 'EXTRA'
+    KINDS = [
+        (CANCELLED, 'Cancelled'),
+        (DIVERTED, 'Diverted'),
+        (EXTRA, 'Extra run'),
+    ]
+    # Kinds that take the regular run off its route
+    SUSPENDING = (CANCELLED, DIVERTED)
+    
+    schedule = models.ForeignKey(Schedule, on_delete=models.CASCADE, related_name='exceptions')
+    kind = models.CharField(max_length=10, choices=KINDS)
+    start_date = models.DateField()
+    end_date = models.DateField(help_text="Last affected date (inclusive)")
+    reason = models.CharField(max_length=200, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['start_date']
+        indexes = [models.Index(fields=['schedule', 'start_date'])]
+    
+    def __str__(self):
+        return f"{self.get_kind_display()}: {self.schedule} {self.start_date}..{self.end_date}"
+    
+    def clean(self):
+        if self.start_date and self.end_date and self.end_date < self.start_date:
+            raise ValidationError({'end_date': 'End date cannot be before the start date.'})
+
+# ==================== Dated Trip Model ====================
+class DatedTrip(models.Model):
+    """
+    One run of a schedule on a service date, with absolute departure and arrival
+    timestamps. Expanded over a rolling horizon by the extend_dated_trips command so
+    searches are range scans on (origin, departure_ts) instead of weekday matching.
+    Schedule exceptions are applied here; trips are expanded for inactive schedules
+    too and searches filter on is_active.
+    """
+    schedule = models.ForeignKey(Schedule, on_delete=models.CASCADE, related_name='trips')
+    # Copied from the route so the search indexes need no join
+    origin = models.ForeignKey(Station, on_delete=models.CASCADE, related_name='+')
+    destination = models.ForeignKey(Station, on_delete=models.CASCADE, related_name='+')
+    service_date = models.DateField(help_text="Date the train leaves its origin")
+    departure_ts = models.DateTimeField()
+    arrival_ts = models.DateTimeField()
+    
+    # AdminSettings key holding the last expanded service date
+    HORIZON_KEY = 'dated_trips_until'
+    
+    class Meta:
+        unique_together = ('schedule', 'service_date')
+        ordering = ['departure_ts']
+        indexes = [
+            models.Index(fields=['origin', 'departure_ts']),
+            models.Index(fields=['destination', 'arrival_ts']),
+        ]
+    
+    def __str__(self):
+        return f"{self.schedule} on {self.service_date}"
+    
+    @staticmethod
+    def timestamps(service_date, departure_time, arrival_time, duration):
+        """
+        Aware (departure, arrival) for a run leaving on service_date. The arrival day is
+        the one that puts arrival_time closest to departure + route duration, so runs
+        longer than a day land on the right date.
+        """
+        departure = datetime.combine(service_date, departure_time)
+        arrival = datetime.combine(service_date, arrival_time)
+        arrival += timedelta(days=round((departure + duration - arrival) / timedelta(days=1)))
+        while arrival <= departure:
+            arrival += timedelta(days=1)
+        tz = timezone.get_current_timezone()
+        return timezone.make_aware(departure, tz), timezone.make_aware(arrival, tz)
+    
+    @classmethod
+    def expand(cls, start, end, schedule_ids=None, batch_size=1000):
+        """Expand runs for service dates start..end (inclusive); existing trips are kept. Returns the run count."""
+        from .service_calendar import ServiceCalendar
+        
+        # Read fresh: the process-wide calendar only notices new exceptions on its next poll
+        calendar = ServiceCalendar.from_db(schedule_ids)
+        schedules = Schedule.objects.all()
+        if schedule_ids is not None:
+            schedules = schedules.filter(id__in=schedule_ids)
+        schedules = list(schedules.values_list(
+            'id', 'route__source_id', 'route__destination_id', 'departure_time', 'arrival_time',
+            'runs_on', 'route__duration_hours', 'route__duration_minutes'
+        ))
+        
+        created = 0
+        batch = []
+        day = start
+        while day <= end:
+            for schedule_id, origin_id, destination_id, dep, arr, runs_on, hours, minutes in schedules:
+                if not calendar.runs(schedule_id, runs_on, day):
+                    continue
+                departure, arrival = cls.timestamps(day, dep, arr, timedelta(hours=hours, minutes=minutes))
+                batch.append(cls(schedule_id=schedule_id, origin_id=origin_id, destination_id=destination_id,
+                                 service_date=day, departure_ts=departure, arrival_ts=arrival))
+                if len(batch) >= batch_size:
+                    created += len(cls.objects.bulk_create(batch, ignore_conflicts=True))
+                    batch = []
+            day += timedelta(days=1)
+        if batch:
+            created += len(cls.objects.bulk_create(batch, ignore_conflicts=True))
+        return created
+    
+    @classmethod
+    def horizon(cls):
+        """Last expanded service date, or None if trips were never expanded"""
+        value = AdminSettings.get_value(cls.HORIZON_KEY)
+        return datetime.strptime(value, '%Y-%m-%d').date() if value else None
+    
+    @classmethod
+    def covers(cls, service_date):
+        """True if trips for service_date (and the day after, for connections) are expanded"""
+        until = cls.horizon()
+        return until is not None and timezone.localdate() <= service_date < until
+    
+    @classmethod
+    def extend(cls, days):
+        """Expand trips from today to today + days, prune past ones and record the horizon"""
+        today = timezone.localdate()
+        until = today + timedelta(days=days)
+        expanded = cls.expand(today, until)
+        # Yesterday's trips can still be running; anything older is history
+        pruned = cls.objects.filter(service_date__lt=today - timedelta(days=1)).delete()[0]
+        AdminSettings.objects.update_or_create(
+            key=cls.HORIZON_KEY,
+            defaults={'value': until.isoformat(), 'description': 'Last service date in the dated trip table'},
+        )
+        return expanded, pruned
+    
+    @classmethod
+    def refresh_schedules(cls, schedule_ids):
+        """Re-expand upcoming trips of edited schedules (times, days or route duration changed)"""
+        until = cls.horizon()
+        if until is None:
+            return
+        today = timezone.localdate()
+        cls.objects.filter(schedule_id__in=schedule_ids, service_date__gte=today).delete()
+        cls.expand(today, until, schedule_ids)
 
 # ==================== Booking Model ====================
 class Booking(models.Model):
@@ -177,7 +350,7 @@ class Booking(models.Model):
     ]
     
     # PNR (Passenger Name Record)
-    pnr = models.CharField(max_length=10, unique=True, db_index=True, editable=False)
+    pnr = models.CharField(max_length=PNR_LENGTH, unique=True, db_index=True, editable=False)
     
     # User reference (optional - for registered users)
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='bookings')
@@ -190,10 +363,13 @@ class Booking(models.Model):
     passenger_gender = models.CharField(max_length=1, choices=GENDER_CHOICES)
     
     # Booking details
-    booking_date = models.DateTimeField(auto_now_add=True)
-    journey_date = models.DateField()
+    booking_date = models.DateTimeField(auto_now_add=True, db_index=True)
+    journey_date = models.DateField(db_index=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING')
     
+    # Number of travellers on this PNR (see Passenger); contact details above are the lead passenger
+    passenger_count = models.IntegerField(default=1, validators=[MinValueValidator(1)])
+    
     # Pricing
     seat_class = models.CharField(max_length=20, choices=SEAT_CLASSES)
     total_fare = models.DecimalField(max_digits=12, decimal_places=2)
@@ -217,8 +393,8 @@ class Booking(models.Model):
     
     @staticmethod
     def generate_pnr():
-        """Generate unique 10-character PNR"""
-        return str(uuid.uuid4())[:10].upper()
+        """Generate a unique, unguessable PNR (time-ordered, see pnr.py)"""
+        return pnr_allocator.next()
 
 # ==================== Booking Leg Model ====================
 class BookingLeg(models.Model):
@@ -241,6 +417,490 @@ class BookingLeg(models.Model):
     def __str__(self):
         return f"{self.booking.pnr} - Leg {self.leg_sequence}: {self.route}"
 
+# ==================== Passenger Model ====================
+class Passenger(models.Model):
+    booking = models.ForeignKey(Booking, on_delete=models.CASCADE, related_name='passengers')
+    name = models.CharField(max_length=100)
+    age = models.IntegerField(validators=[MinValueValidator(1), MaxValueValidator(120)])
+    gender = models.CharField(max_length=1, choices=Booking.GENDER_CHOICES)
+    seat_numbers = models.CharField(max_length=50, blank=True, help_text="Seat per leg, e.g. 1A or 1A,32C")
+    sequence = models.IntegerField(default=1)
+    
+    class Meta:
+        ordering = ['sequence']
+        verbose_name_plural = "Passengers"
+    
+    def __str__(self):
+        return f"{self.name} ({self.age}/{self.gender})"
+
+# ==================== Booking Archive ====================
+class ArchivedBooking(models.Model):
+    """
+    A booking moved out of the hot Booking/BookingLeg/Passenger tables by
+    archive_bookings once its journey is long past. Legs keep the train and
+    stations as booked, since routes may change later, and passengers are kept
+    as JSON. Stored in the 'archive' database when one is configured (see db_router).
+    """
+    pnr = models.CharField(max_length=PNR_LENGTH, unique=True)
+    # Plain id, not a foreign key: the archive may be a separate database
+    user_id = models.IntegerField(null=True, blank=True, db_index=True)
+    
+    passenger_name = models.CharField(max_length=100)
+    passenger_email = models.EmailField()
+    passenger_phone = models.CharField(max_length=15)
+    passenger_age = models.IntegerField()
+    passenger_gender = models.CharField(max_length=1, choices=Booking.GENDER_CHOICES)
+    passenger_count = models.IntegerField(default=1)
+    passengers = models.JSONField(default=list)
+    
+    booking_date = models.DateTimeField()
+    journey_date = models.DateField(db_index=True)
+    status = models.CharField(max_length=20, choices=Booking.STATUS_CHOICES)
+    seat_class = models.CharField(max_length=20, choices=Booking.SEAT_CLASSES)
+    total_fare = models.DecimalField(max_digits=12, decimal_places=2)
+    is_refundable = models.BooleanField(default=True)
+    cancellation_date = models.DateTimeField(null=True, blank=True)
+    refund_amount = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+    
+    archived_at = models.DateTimeField(auto_now_add=True)
+    
+    # Booking fields copied as they are
+    COPIED_FIELDS = (
+        'pnr', 'user_id', 'passenger_name', 'passenger_email', 'passenger_phone', 'passenger_age',
+        'passenger_gender', 'passenger_count', 'booking_date', 'journey_date', 'status', 'seat_class',
+        'total_fare', 'is_refundable', 'cancellation_date', 'refund_amount',
+    )
+    
+    class Meta:
+        ordering = ['-booking_date']
+        verbose_name_plural = "Archived Bookings"
+    
+    def __str__(self):
+        return f"PNR: {self.pnr} - {self.passenger_name} (archived)"
+    
+    @classmethod
+    def archive_before(cls, cutoff, batch_size=500):
+        """
+        Move up to batch_size bookings with a journey date before `cutoff` into the
+        archive; returns how many moved. With a separate archive database the copy
+        commits first and the hot rows are deleted after, so a batch interrupted in
+        between is copied again (replacing the earlier copy) on the next run.
+        """
+        archive_db = router.db_for_write(cls)
+        legs = BookingLeg.objects.select_related('schedule', 'route__train', 'route__source', 'route__destination')
+        with immediate_transaction():
+            bookings = list(
+                Booking.objects.filter(journey_date__lt=cutoff).order_by('journey_date', 'id')
+                .prefetch_related(Prefetch('legs', queryset=legs), 'passengers')[:batch_size]
+            )
+            if not bookings:
+                return 0
+            
+            with transaction.atomic(using=archive_db):
+                cls.objects.filter(pnr__in=[b.pnr for b in bookings]).delete()
+                archived = cls.objects.bulk_create([
+                    cls(
+                        passengers=[
+                            {'sequence': p.sequence, 'name': p.name, 'age': p.age, 'gender': p.gender,
+                             'seat_numbers': p.seat_numbers}
+                            for p in booking.passengers.all()
+                        ],
+                        **{field: getattr(booking, field) for field in cls.COPIED_FIELDS}
+                    )
+                    for booking in bookings
+                ])
+                ArchivedBookingLeg.objects.bulk_create([
+                    ArchivedBookingLeg.from_leg(copy, leg)
+                    for copy, booking in zip(archived, bookings) for leg in booking.legs.all()
+                ])
+            
+            # Raw deletes (children first): the per-row delete signals only refresh
+            # cached PNR statuses, which archiving leaves unchanged
+            ids = [b.id for b in bookings]
+            for queryset in (Passenger.objects.filter(booking_id__in=ids),
+                             BookingLeg.objects.filter(booking_id__in=ids),
+                             Booking.objects.filter(id__in=ids)):
+                queryset._raw_delete(queryset.db)
+        return len(bookings)
+    
+    def passenger_list(self):
+        """Passengers with the attributes of Passenger, for pages and tickets"""
+        return [
+            ArchivedPassenger(p['sequence'], p['name'], p['age'], p['gender'], p['seat_numbers'])
+            for p in self.passengers
+        ]
+
+class ArchivedPassenger(namedtuple('ArchivedPassenger', 'sequence name age gender seat_numbers')):
+    """A passenger of an ArchivedBooking (kept as JSON)"""
+    
+    def get_gender_display(self):
+        return dict(Booking.GENDER_CHOICES).get(self.gender, self.gender)
+
+class ArchivedBookingLeg(models.Model):
+    booking = models.ForeignKey(ArchivedBooking, on_delete=models.CASCADE, related_name='legs')
+    leg_sequence = models.IntegerField(default=1)
+    # Plain id: reconcile_inventory still counts archived seats against the schedule
+    schedule_id = models.IntegerField(db_index=True)
+    train_number = models.CharField(max_length=10)
+    train_name = models.CharField(max_length=100)
+    source_code = models.CharField(max_length=5)
+    destination_code = models.CharField(max_length=5)
+    departure_time = models.TimeField()
+    arrival_time = models.TimeField()
+    seat_number = models.CharField(max_length=5)
+    leg_fare = models.DecimalField(max_digits=10, decimal_places=2)
+    
+    class Meta:
+        ordering = ['leg_sequence']
+        verbose_name_plural = "Archived Booking Legs"
+    
+    def __str__(self):
+        return f"{self.booking.pnr} - Leg {self.leg_sequence}: {self.source_code} → {self.destination_code}"
+    
+    @classmethod
+    def from_leg(cls, archived_booking, leg):
+        return cls(
+            booking=archived_booking,
+            leg_sequence=leg.leg_sequence,
+            schedule_id=leg.schedule_id,
+            train_number=leg.route.train.train_number,
+            train_name=leg.route.train.train_name,
+            source_code=leg.route.source.code,
+            destination_code=leg.route.destination.code,
+            departure_time=leg.schedule.departure_time,
+            arrival_time=leg.schedule.arrival_time,
+            seat_number=leg.seat_number,
+            leg_fare=leg.leg_fare,
+        )
+
+# ==================== Seat Hold Model ====================
+class SeatHold(models.Model):
+    """
+    Short-lived soft lock on seats while a user fills in the booking form.
+    
+    Placing a hold decrements schedule inventory straight away. A hold is either
+    consumed by a booking or, once expires_at has passed, released back to
+    inventory in batches by release_expired() (sweeper command or lazily on read).
+    """
+    DEFAULT_TTL_SECONDS = 600
+    
+    hold_token = models.CharField(max_length=32, db_index=True)
+    schedule = models.ForeignKey(Schedule, on_delete=models.CASCADE, related_name='holds')
+    seat_class = models.CharField(max_length=20, choices=Booking.SEAT_CLASSES)
+    seats = models.IntegerField(default=1, validators=[MinValueValidator(1)])
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='seat_holds')
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+    
+    class Meta:
+        ordering = ['expires_at']
+        verbose_name_plural = "Seat Holds"
+    
+    def __str__(self):
+        return f"Hold {self.hold_token} - {self.seats} x {self.seat_class} on {self.schedule_id}"
+    
+    @classmethod
+    def ttl_seconds(cls):
+        try:
+            return int(AdminSettings.get_value('seat_hold_ttl_seconds', cls.DEFAULT_TTL_SECONDS))
+        except ValueError:
+            return cls.DEFAULT_TTL_SECONDS
+    
+    @classmethod
+    def place(cls, schedules, seat_class, seats=1, user=None, ttl_seconds=None):
+        """Hold seats on every leg; returns the hold token, or None if any leg is full"""
+        ttl = cls.ttl_seconds() if ttl_seconds is None else ttl_seconds
+        token = uuid.uuid4().hex
+        expires_at = timezone.now() + timedelta(seconds=ttl)
+        held = []
+        with immediate_transaction():
+            for schedule in schedules:
+                if not schedule.reduce_available_seats(seat_class, seats, InventoryEntry.HOLD, token):
+                    transaction.set_rollback(True)
+                    break
+                held.append(schedule)
+            else:
+                cls.objects.bulk_create([
+                    cls(hold_token=token, schedule=schedule, seat_class=seat_class, seats=seats,
+                        user=user if user and user.is_authenticated else None, expires_at=expires_at)
+                    for schedule in schedules
+                ])
+                return token
+        # Partial hold was rolled back; resync the in-memory counters
+        for schedule in held:
+            schedule.refresh_from_db(fields=[Schedule.SEAT_FIELDS[seat_class]])
+        return None
+    
+    @classmethod
+    def live_count(cls, user):
+        """Number of unexpired holds the user has"""
+        return cls.objects.filter(user=user, expires_at__gt=timezone.now()).values('hold_token').distinct().count()
+    
+    @staticmethod
+    def _covers(holds, schedules, seat_class, seats):
+        wanted = {(s.id, seat_class, seats) for s in schedules}
+        return {(h.schedule_id, h.seat_class, h.seats) for h in holds} == wanted and len(holds) == len(wanted)
+    
+    @classmethod
+    def covers(cls, token, schedules, seat_class, seats=1):
+        """True if the live hold exactly covers these legs, i.e. a booking of them would consume it"""
+        if not token:
+            return False
+        holds = list(cls.objects.filter(hold_token=token, expires_at__gt=timezone.now()))
+        return cls._covers(holds, schedules, seat_class, seats)
+    
+    @classmethod
+    def consume(cls, token, schedules, seat_class, seats=1, pnr=''):
+        """
+        Turn a live hold into a booking. Returns True when the hold exactly covers
+        the requested legs, in which case inventory is already decremented.
+        Must be called inside the booking transaction.
+        """
+        if not token:
+            return False
+        holds = list(cls._locked(cls.objects.filter(hold_token=token, expires_at__gt=timezone.now())))
+        if not cls._covers(holds, schedules, seat_class, seats):
+            return False
+        cls.objects.filter(id__in=[h.id for h in holds]).delete()
+        # Counters are unchanged; the ledger moves the seats from the hold to the booking
+        InventoryEntry.record(
+            [(h.schedule_id, h.seat_class, h.seats, InventoryEntry.RELEASE, token) for h in holds]
+            + [(h.schedule_id, h.seat_class, -h.seats, InventoryEntry.BOOK, pnr) for h in holds]
+        )
+        return True
+    
+    @classmethod
+    def release(cls, token):
+        """Give back the seats of a hold that will not be used"""
+        if token:
+            with immediate_transaction():
+                cls._release_rows(cls._locked(cls.objects.filter(hold_token=token)))
+    
+    @classmethod
+    def release_expired(cls, batch_size=500):
+        """Release one batch of expired holds; returns the number of holds released"""
+        # Cheap indexed probe first so read paths don't take the write lock for nothing
+        if not cls.objects.filter(expires_at__lte=timezone.now()).exists():
+            return 0
+        with immediate_transaction():
+            expired = cls.objects.filter(expires_at__lte=timezone.now()).order_by('expires_at')[:batch_size]
+            return cls._release_rows(cls._locked(expired))
+    
+    @staticmethod
+    def _locked(queryset):
+        """
+        Lock rows where supported so concurrent sweepers never release the same hold
+        twice. select_for_update() also keeps these reads on the primary database.
+        """
+        if connection.features.has_select_for_update_skip_locked:
+            return queryset.select_for_update(skip_locked=True)
+        return queryset.select_for_update()
+    
+    @classmethod
+    def _release_rows(cls, holds):
+        totals = {}
+        ids = []
+        entries = []
+        for schedule_id, seat_class, seats, hold_id, token in holds.values_list(
+            'schedule_id', 'seat_class', 'seats', 'id', 'hold_token'
+        ):
+            totals[(schedule_id, seat_class)] = totals.get((schedule_id, seat_class), 0) + seats
+            ids.append(hold_id)
+            entries.append((schedule_id, seat_class, seats, InventoryEntry.RELEASE, token))
+        if not ids:
+            return 0
+        cls.objects.filter(id__in=ids).delete()
+        for (schedule_id, seat_class), seats in totals.items():
+            attr = Schedule.SEAT_FIELDS[seat_class]
+            Schedule.objects.filter(pk=schedule_id).update(**{attr: F(attr) + seats})
+        InventoryEntry.record(entries)
+        return len(ids)
+
+# ==================== Inventory Ledger ====================
+class InventoryEntry(models.Model):
+    """
+    Append-only ledger of changes to the Schedule seat counters, written in the same
+    transaction as the change. The sum of a (schedule, class) pair's deltas equals
+    its counter; InventorySnapshot keeps those sums so balances need only a tail scan.
+    """
+    OPENING = 'OPENING'
+    ADJUST = 'ADJUST'
+    BOOK = 'BOOK'
+    CANCEL = 'CANCEL'
+    HOLD = 'HOLD'
+    RELEASE = 'RELEASE'
+    RECONCILE = 'RECONCILE'
+    REASONS = [
+        (OPENING, 'Opening balance'),
+        (ADJUST, 'Admin adjustment'),
+        (BOOK, 'Booked'),
+        (CANCEL, 'Cancelled'),
+        (HOLD, 'Held'),
+        (RELEASE, 'Hold released'),
+        (RECONCILE, 'Reconciliation repair'),
+    ]
+    # Reasons that change how many seats a schedule offers, rather than who has them
+    PROVISIONING = (OPENING, ADJUST)
+    
+    schedule = models.ForeignKey(Schedule, on_delete=models.CASCADE, related_name='inventory_entries')
+    seat_class = models.CharField(max_length=20, choices=Booking.SEAT_CLASSES)
+    delta = models.IntegerField()
+    reason = models.CharField(max_length=10, choices=REASONS)
+    # PNR for bookings and cancellations, hold token for holds and releases
+    reference = models.CharField(max_length=32, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    
+    class Meta:
+        ordering = ['id']
+        verbose_name_plural = "Inventory Entries"
+        indexes = [models.Index(fields=['schedule', 'seat_class'])]
+    
+    def __str__(self):
+        return f"#{self.id} {self.reason} {self.delta:+d} {self.seat_class} on {self.schedule_id}"
+    
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Inventory entries are append-only")
+        super().save(*args, **kwargs)
+    
+    @classmethod
+    def record(cls, entries):
+        """Append (schedule_id, seat_class, delta, reason, reference) tuples, skipping zero deltas"""
+        cls.objects.bulk_create([
+            cls(schedule_id=schedule_id, seat_class=seat_class, delta=delta, reason=reason, reference=reference)
+            for schedule_id, seat_class, delta, reason, reference in entries if delta
+        ])
+    
+    @staticmethod
+    def _totals(queryset, schedule_field, class_field, amount):
+        return {
+            (row[schedule_field], row[class_field]): row['total']
+            for row in queryset.values(schedule_field, class_field).annotate(total=Sum(amount))
+        }
+    
+    @classmethod
+    def reconcile(cls, repair=False):
+        """
+        Compare every (schedule, class) counter with its ledger balance and with the
+        inventory implied by the ledger's provisioning entries minus seats taken by
+        bookings (live and archived) and holds (one grouped query each). Returns rows of drifting
+        pairs: (schedule_id, seat_class, counter, ledger, expected). With repair,
+        counters are set to the expected value and a RECONCILE entry brings the
+        ledger in line.
+        """
+        with immediate_transaction() if repair else transaction.atomic():
+            provisioned = cls._totals(cls.objects.filter(reason__in=cls.PROVISIONING),
+                                      'schedule_id', 'seat_class', 'delta')
+            booked = cls._totals(BookingLeg.objects.exclude(booking__status='CANCELLED'),
+                                 'schedule_id', 'booking__seat_class', 'booking__passenger_count')
+            # Archived bookings keep their seats (counters are not per journey date)
+            archived = cls._totals(ArchivedBookingLeg.objects.exclude(booking__status='CANCELLED'),
+                                   'schedule_id', 'booking__seat_class', 'booking__passenger_count')
+            for key, seats in archived.items():
+                booked[key] = booked.get(key, 0) + seats
+            held = cls._totals(SeatHold.objects.all(), 'schedule_id', 'seat_class', 'seats')
+            ledger = InventorySnapshot.balances()
+            counters = {}
+            for row in Schedule.objects.values('id', *Schedule.SEAT_FIELDS.values()):
+                for seat_class, attr in Schedule.SEAT_FIELDS.items():
+                    counters[(row['id'], seat_class)] = row[attr]
+            
+            drift = []
+            for key, counter in counters.items():
+                expected = provisioned.get(key, 0) - booked.get(key, 0) - held.get(key, 0)
+                balance = ledger.get(key, 0)
+                if counter != expected or counter != balance:
+                    drift.append((*key, counter, balance, expected))
+            if repair:
+                repairs = []
+                for schedule_id, seat_class, counter, balance, expected in drift:
+                    # An oversold class can only go down to zero
+                    target = max(expected, 0)
+                    Schedule.objects.filter(pk=schedule_id).update(**{Schedule.SEAT_FIELDS[seat_class]: target})
+                    repairs.append((schedule_id, seat_class, target - balance, cls.RECONCILE, ''))
+                cls.record(repairs)
+        return drift
+
+class InventorySnapshot(models.Model):
+    """
+    Ledger balance of one (schedule, class) pair through ledger entry `through_entry`.
+    Snapshots are taken for every pair at once (take()); the newest set plus the
+    entries after it give the current balances.
+    """
+    # Entries younger than this are left to the tail, so a transaction that got its
+    # entry id earlier but commits later is never skipped by a snapshot
+    SETTLE_SECONDS = 60
+    
+    schedule = models.ForeignKey(Schedule, on_delete=models.CASCADE, related_name='inventory_snapshots')
+    seat_class = models.CharField(max_length=20, choices=Booking.SEAT_CLASSES)
+    available = models.IntegerField()
+    through_entry = models.BigIntegerField(db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-through_entry']
+    
+    def __str__(self):
+        return f"{self.seat_class} on {self.schedule_id}: {self.available} through #{self.through_entry}"
+    
+    @classmethod
+    def latest_through(cls):
+        return cls.objects.aggregate(through=Max('through_entry'))['through'] or 0
+    
+    @classmethod
+    def balances_through(cls, through):
+        """{(schedule_id, seat_class): balance} from the snapshot set at `through`"""
+        return {
+            (schedule_id, seat_class): available
+            for schedule_id, seat_class, available in cls.objects.filter(through_entry=through).values_list(
+                'schedule_id', 'seat_class', 'available'
+            )
+        }
+    
+    @classmethod
+    def balances(cls, schedule_ids=None):
+        """Current {(schedule_id, seat_class): ledger balance}: newest snapshot plus the entries after it"""
+        with transaction.atomic():
+            through = cls.latest_through()
+            snapshots = cls.objects.filter(through_entry=through)
+            tail = InventoryEntry.objects.filter(id__gt=through)
+            if schedule_ids is not None:
+                snapshots = snapshots.filter(schedule_id__in=schedule_ids)
+                tail = tail.filter(schedule_id__in=schedule_ids)
+            balances = {
+                (schedule_id, seat_class): available
+                for schedule_id, seat_class, available in snapshots.values_list('schedule_id', 'seat_class', 'available')
+            } if through else {}
+            for key, total in InventoryEntry._totals(tail, 'schedule_id', 'seat_class', 'delta').items():
+                balances[key] = balances.get(key, 0) + total
+        return balances
+    
+    @classmethod
+    def take(cls, keep=2):
+        """
+        Snapshot every pair through the newest settled entry and drop all but the
+        newest `keep` snapshot sets. Returns (through entry id, rows written).
+        """
+        settled = timezone.now() - timedelta(seconds=cls.SETTLE_SECONDS)
+        with immediate_transaction():
+            previous = cls.latest_through()
+            through = InventoryEntry.objects.filter(
+                id__gt=previous, created_at__lte=settled
+            ).aggregate(through=Max('id'))['through']
+            if through is None:
+                return previous, 0
+            balances = cls.balances_through(previous) if previous else {}
+            tail = InventoryEntry.objects.filter(id__gt=previous, id__lte=through)
+            for key, total in InventoryEntry._totals(tail, 'schedule_id', 'seat_class', 'delta').items():
+                balances[key] = balances.get(key, 0) + total
+            cls.objects.bulk_create([
+                cls(schedule_id=schedule_id, seat_class=seat_class, available=available, through_entry=through)
+                for (schedule_id, seat_class), available in balances.items()
+            ], batch_size=1000)
+            kept = list(cls.objects.values_list('through_entry', flat=True).distinct().order_by('-through_entry')[:keep])
+            cls.objects.filter(through_entry__lt=min(kept)).delete()
+        return through, len(balances)
+
 # ==================== User Profile Model ====================
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
@@ -256,6 +916,20 @@ class UserProfile(models.Model):
     
     def __str__(self):
         return f"{self.user.username}'s Profile"
+    
+    @classmethod
+    def record_booking(cls, user, amount):
+        """Count a confirmed booking against the user's profile (call inside the booking transaction)"""
+        if not cls.objects.filter(user=user).update(total_bookings=F('total_bookings') + 1,
+                                                    total_spent=F('total_spent') + amount):
+            cls.objects.create(user=user, total_bookings=1, total_spent=amount)
+    
+    @classmethod
+    def record_cancellation(cls, user, refund_amount):
+        """Undo a booking's count and take the refund off total_spent"""
+        if not cls.objects.filter(user=user).update(total_bookings=F('total_bookings') - 1,
+                                                    total_spent=F('total_spent') - refund_amount):
+            cls.objects.create(user=user)
 
 # ==================== Admin Settings Model ====================
 class AdminSettings(models.Model):
@@ -269,4 +943,93 @@ class AdminSettings(models.Model):
     
     def __str__(self):
         return f"{self.key}"
-    
\ No newline at end of file
+    
+    @classmethod
+    def get_value(cls, key, default=None):
+        """Get a setting value by key"""
+        value = cls.objects.filter(key=key).values_list('value', flat=True).first()
+        return default if value is None else value
+    
+# ==================== Timetable Change Log ====================
+class TimetableChange(models.Model):
+    """
+    Append-only log of Station/Train/Route/Schedule edits. The timetable version is
+    the newest id with no missing ids below it: caches remember the version they were
+    built at and apply changes_since() when it moves.
+    
+    Ids are handed out at insert but rows become visible at commit, so a lower id can
+    show up after a higher one. A gap in the ids therefore holds the version back
+    until it fills, or until the row after it is TIMETABLE_CHANGE_SETTLE_SECONDS
+    old (the missing id was rolled back), so no change is ever skipped.
+    """
+    SAVE = 'SAVE'
+    DELETE = 'DELETE'
+    ACTIONS = [
+        (SAVE, 'Saved'),
+        (DELETE, 'Deleted'),
+    ]
+    
+    model_name = models.CharField(max_length=20)
+    object_id = models.BigIntegerField()
+    action = models.CharField(max_length=10, choices=ACTIONS)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    
+    # Beyond this many pending changes a full reload is cheaper than patching
+    MAX_PATCH_CHANGES = 5000
+    
+    class Meta:
+        ordering = ['id']
+    
+    def __str__(self):
+        return f"v{self.id} {self.action} {self.model_name} {self.object_id}"
+    
+    @classmethod
+    def record(cls, model_name, object_ids, action=SAVE):
+        """Log changed ids; this process re-checks the version once the transaction commits"""
+        from . import timetable
+        
+        cls.objects.bulk_create([
+            cls(model_name=model_name, object_id=object_id, action=action) for object_id in object_ids
+        ])
+        transaction.on_commit(timetable.expire_version_check)
+    
+    @classmethod
+    def current_version(cls, model_name=None):
+        """Latest timetable version (0 before the first change), optionally for one model only"""
+        cutoff = timezone.now() - timedelta(seconds=getattr(settings, 'TIMETABLE_CHANGE_SETTLE_SECONDS', 30))
+        # Gaps below settled rows are final; past them, only contiguous ids count
+        version = cls.objects.filter(created_at__lt=cutoff).aggregate(Max('id'))['id__max'] or 0
+        for change_id in cls.objects.filter(id__gt=version).order_by('id').values_list('id', flat=True):
+            if change_id != version + 1:
+                break
+            version = change_id
+        if model_name:
+            changes = cls.objects.filter(model_name=model_name, id__lte=version)
+            return changes.order_by('-id').values_list('id', flat=True).first() or 0
+        return version
+    
+    @classmethod
+    def changes_since(cls, version):
+        """
+        (latest_version, {model_name: set(ids)}) for changes after `version`, or None
+        when the caller must reload fully (log pruned past `version`, or too many changes).
+        """
+        latest = cls.current_version()
+        rows = list(cls.objects.filter(id__gt=version, id__lte=latest).order_by('id').values_list(
+            'id', 'model_name', 'object_id'
+        )[:cls.MAX_PATCH_CHANGES + 1])
+        if len(rows) > cls.MAX_PATCH_CHANGES:
+            return None
+        if rows and rows[0][0] != version + 1:
+            # A gap means pruned (or rolled back) ids; only reload if the log no longer reaches back
+            if not cls.objects.filter(id__lte=version).exists():
+                return None
+        changed = {}
+        for _, model_name, object_id in rows:
+            changed.setdefault(model_name, set()).add(object_id)
+        return max(latest, version), changed
+    
+    @classmethod
+    def prune(cls, older_than):
+        """Delete entries older than a datetime, always keeping the newest (it carries the version)"""
+        return cls.objects.filter(created_at__lt=older_than, id__lt=cls.current_version()).delete()[0]
@@ -0,0 +1,178 @@
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.utils.crypto import salted_hmac
+
+# ==================== PNR Layout ====================
+# A PNR is 13 Crockford base32 characters of payload plus 1 check character.
+# The 65-bit payload is laid out most-significant first as:
+#
+#   30 bits  seconds since PNR_EPOCH (good until 2059)
+#   35 bits  node id and sequence, encrypted with a keyed permutation:
+#              6 bits  host id (settings.PNR_NODE_ID)
+#             22 bits  process id
+#              7 bits  sequence within the second
+#
+# The seconds fill the first 6 characters, and Crockford's alphabet is in ASCII
+# order, so PNRs sort by issue second and new rows land at the right-hand edge of
+# the pnr index. The rest is unique per live process (a pid is never shared by two
+# running processes on one host) but, being encrypted with a secret key and the
+# second, tells nothing about neighbouring PNRs: they cannot be guessed from a known one.
+# Bookings from before this layout keep their 10-character PNRs.
+
+ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+DECODE = {ch: idx for idx, ch in enumerate(ALPHABET)}
+
+PNR_EPOCH = 1735689600  # 2025-01-01T00:00:00Z
+PAYLOAD_CHARS = 13
+PNR_LENGTH = PAYLOAD_CHARS + 1
+
+TIME_BITS = 30
+HOST_BITS = 6
+PID_BITS = 22  # Linux pids stay below 2**22
+SEQUENCE_BITS = 7
+NODE_BITS = HOST_BITS + PID_BITS
+HIDDEN_BITS = NODE_BITS + SEQUENCE_BITS
+MAX_HOST = (1 << HOST_BITS) - 1
+MAX_PID = (1 << PID_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+# The permutation is a Feistel network on 36 bits; values that land outside the
+# 35-bit field are encrypted again (cycle walking), which keeps it a permutation
+FEISTEL_ROUNDS = 4
+HALF_BITS = (HIDDEN_BITS + 1) // 2
+HALF_MASK = (1 << HALF_BITS) - 1
+KEY_SALT = 'railway_app.pnr'
+
+
+def encode(value, length=PAYLOAD_CHARS):
+    """Encode an integer as fixed-width Crockford base32"""
+    chars = []
+    for _ in range(length):
+        chars.append(ALPHABET[value & 31])
+        value >>= 5
+    return ''.join(reversed(chars))
+
+
+def check_char(payload):
+    """Luhn mod 32 check character; catches single typos and adjacent swaps"""
+    factor = 2
+    total = 0
+    for ch in reversed(payload):
+        addend = factor * DECODE[ch]
+        total += addend // 32 + addend % 32
+        factor = 1 if factor == 2 else 2
+    return ALPHABET[(32 - total % 32) % 32]
+
+
+def is_valid(pnr):
+    """True if pnr is a well-formed PNR from this allocator"""
+    pnr = (pnr or '').upper()
+    if len(pnr) != PNR_LENGTH or any(ch not in DECODE for ch in pnr):
+        return False
+    return check_char(pnr[:-1]) == pnr[-1]
+
+
+# ==================== Keyed Permutation ====================
+def _round_value(second, round_number, half):
+    secret = getattr(settings, 'PNR_SECRET', None) or settings.SECRET_KEY
+    digest = salted_hmac(KEY_SALT, f'{second}:{round_number}:{half}', secret=secret).digest()
+    return int.from_bytes(digest[:4], 'big') & HALF_MASK
+
+
+def _feistel(value, second, inverse=False):
+    left, right = value >> HALF_BITS, value & HALF_MASK
+    if inverse:
+        for round_number in reversed(range(FEISTEL_ROUNDS)):
+            left, right = right ^ _round_value(second, round_number, left), left
+    else:
+        for round_number in range(FEISTEL_ROUNDS):
+            left, right = right, left ^ _round_value(second, round_number, right)
+    return (left << HALF_BITS) | right
+
+
+def permute(value, second, inverse=False):
+    """Encrypt (or decrypt) a HIDDEN_BITS value; the key changes every second"""
+    value = _feistel(value, second, inverse)
+    while value >> HIDDEN_BITS:
+        value = _feistel(value, second, inverse)
+    return value
+
+
+def decode(pnr):
+    """Split a valid PNR into (issued_at_unix_seconds, node_id, sequence)"""
+    value = 0
+    for ch in pnr[:PAYLOAD_CHARS].upper():
+        value = (value << 5) | DECODE[ch]
+    seconds = value >> HIDDEN_BITS
+    hidden = permute(value & ((1 << HIDDEN_BITS) - 1), seconds, inverse=True)
+    return PNR_EPOCH + seconds, hidden >> SEQUENCE_BITS, hidden & MAX_SEQUENCE
+
+
+# ==================== PNR Allocator ====================
+class PNRAllocator:
+    """
+    Time-ordered PNR generator; needs no database round trip.
+
+    The node id is the process id plus PNR_NODE_ID as a host id, so workers on one
+    host (forked or not) never collide; give each host its own PNR_NODE_ID (0-63).
+    Within a worker, up to 128 PNRs are issued per second; bursts beyond that
+    borrow from the next second, so the clock used only ever moves forward.
+    """
+
+    def __init__(self, host_id=None, pid=None):
+        self._lock = threading.Lock()
+        self._host_id = host_id
+        self._pid = pid
+        self._node_id = None
+        self._reset()
+
+    def _reset(self):
+        # Start one second ahead so a restarted worker never reuses its last second
+        self._second = self._now() + 1
+        self._sequence = -1
+
+    @staticmethod
+    def _now():
+        return int(time.time()) - PNR_EPOCH
+
+    @property
+    def node_id(self):
+        if self._node_id is None:
+            host_id = self._host_id
+            if host_id is None:
+                host_id = int(getattr(settings, 'PNR_NODE_ID', None) or 0)
+            pid = os.getpid() if self._pid is None else self._pid
+            self._node_id = ((host_id & MAX_HOST) << PID_BITS) | (pid & MAX_PID)
+        return self._node_id
+
+    def next(self):
+        """Allocate the next PNR"""
+        with self._lock:
+            now = self._now()
+            if now > self._second:
+                self._second = now
+                self._sequence = 0
+            else:
+                self._sequence += 1
+                if self._sequence > MAX_SEQUENCE:
+                    self._second += 1
+                    self._sequence = 0
+            second = self._second
+            hidden = (self.node_id << SEQUENCE_BITS) | self._sequence
+        payload = encode((second << HIDDEN_BITS) | permute(hidden, second))
+        return payload + check_char(payload)
+
+    def after_fork(self):
+        """Forked workers take their own pid as node id and do not continue the parent's sequence"""
+        self._lock = threading.Lock()
+        self._node_id = None
+        self._reset()
+
+
+pnr_allocator = PNRAllocator()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=pnr_allocator.after_fork)
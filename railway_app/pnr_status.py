@@ -0,0 +1,194 @@
+"""
+PNR status lookups for the JSON status API.
+
+Statuses are served from a per-process LRU cache of ready-to-serialize dicts.
+Misses for a whole batch are loaded together: one query for the bookings plus
+one prefetch each for their legs and passengers, then the archive for any PNRs
+not found. The process that changes a booking drops its entry straight away
+(invalidate()); other processes see the change once their entry is older than
+PNR_STATUS_CACHE_SECONDS.
+
+Entries keep the booking's user id, so a lookup only returns the requester's own
+bookings: other PNRs look exactly like unknown ones.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Prefetch
+
+from .pnr import PNR_LENGTH
+
+MAX_BATCH_PNRS = 100
+
+
+class LRUCache:
+    """Thread-safe LRU of at most maxsize entries, each valid for ttl seconds"""
+
+    def __init__(self, maxsize, ttl, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()  # key -> (stored at, value)
+        self._lock = threading.Lock()
+        # Bumped by every delete, so a load that raced an invalidation is not cached
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, keys):
+        """{key: value} for the keys cached and still fresh"""
+        found = {}
+        now = self.clock()
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None and now - entry[0] < self.ttl:
+                    self._entries.move_to_end(key)
+                    found[key] = entry[1]
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def set_many(self, items, generation=None):
+        """Store items, unless something was deleted since `generation` was read"""
+        now = self.clock()
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            for key, value in items.items():
+                self._entries[key] = (now, value)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+            self.generation += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+status_cache = LRUCache(
+    getattr(settings, 'PNR_STATUS_CACHE_SIZE', 10000),
+    getattr(settings, 'PNR_STATUS_CACHE_SECONDS', 30),
+)
+
+
+def normalize(pnr):
+    return (pnr or '').strip().upper()
+
+
+def serialize(booking):
+    """Public status of a booking; contact details and passenger names are left out"""
+    return {
+        'pnr': booking.pnr,
+        'status': booking.status,
+        'journey_date': booking.journey_date.isoformat(),
+        'seat_class': booking.seat_class,
+        'passenger_count': booking.passenger_count,
+        'total_fare': str(booking.total_fare),
+        'cancellation_date': booking.cancellation_date.isoformat() if booking.cancellation_date else None,
+        'refund_amount': str(booking.refund_amount) if booking.refund_amount is not None else None,
+        'legs': [
+            {
+                'sequence': leg.leg_sequence,
+                'train_number': leg.route.train.train_number,
+                'train_name': leg.route.train.train_name,
+                'from': leg.route.source.code,
+                'to': leg.route.destination.code,
+                'departure': str(leg.schedule.departure_time),
+                'arrival': str(leg.schedule.arrival_time),
+                'seat_number': leg.seat_number,
+            }
+            for leg in booking.legs.all()
+        ],
+        'passengers': [
+            {'sequence': p.sequence, 'age': p.age, 'gender': p.gender, 'seat_numbers': p.seat_numbers}
+            for p in booking.passengers.all()
+        ],
+    }
+
+
+def serialize_archived(booking):
+    """serialize() for an ArchivedBooking, so archived PNRs look the same to clients"""
+    return {
+        'pnr': booking.pnr,
+        'status': booking.status,
+        'journey_date': booking.journey_date.isoformat(),
+        'seat_class': booking.seat_class,
+        'passenger_count': booking.passenger_count,
+        'total_fare': str(booking.total_fare),
+        'cancellation_date': booking.cancellation_date.isoformat() if booking.cancellation_date else None,
+        'refund_amount': str(booking.refund_amount) if booking.refund_amount is not None else None,
+        'legs': [
+            {
+                'sequence': leg.leg_sequence,
+                'train_number': leg.train_number,
+                'train_name': leg.train_name,
+                'from': leg.source_code,
+                'to': leg.destination_code,
+                'departure': str(leg.departure_time),
+                'arrival': str(leg.arrival_time),
+                'seat_number': leg.seat_number,
+            }
+            for leg in booking.legs.all()
+        ],
+        'passengers': [
+            {'sequence': p['sequence'], 'age': p['age'], 'gender': p['gender'], 'seat_numbers': p['seat_numbers']}
+            for p in booking.passengers
+        ],
+    }
+
+
+def load_statuses(pnrs):
+    """
+    {pnr: (user id, status)} from the database for the given PNRs (unknown ones are
+    absent). PNRs not in the hot booking tables are looked up in the archive.
+    """
+    from .models import Booking, BookingLeg, Passenger, ArchivedBooking
+
+    bookings = Booking.objects.filter(pnr__in=pnrs).prefetch_related(
+        Prefetch('legs', queryset=BookingLeg.objects.select_related(
+            'schedule', 'route__train', 'route__source', 'route__destination'
+        )),
+        Prefetch('passengers', queryset=Passenger.objects.all()),
+    )
+    statuses = {booking.pnr: (booking.user_id, serialize(booking)) for booking in bookings}
+    archived = [pnr for pnr in pnrs if pnr not in statuses]
+    if archived:
+        for booking in ArchivedBooking.objects.filter(pnr__in=archived).prefetch_related('legs'):
+            statuses[booking.pnr] = (booking.user_id, serialize_archived(booking))
+    return statuses
+
+
+def get_statuses(pnrs, user=None):
+    """
+    {pnr: status or None} for up to MAX_BATCH_PNRS PNRs, cached ones without a query.
+    With a user, bookings of other users map to None as well (admins see every booking).
+    """
+    pnrs = list(dict.fromkeys(normalize(pnr) for pnr in pnrs))
+    found = status_cache.get_many(pnrs)
+    # Anything longer than a PNR cannot exist; skip it rather than query for it
+    missing = [pnr for pnr in pnrs if pnr not in found and 0 < len(pnr) <= PNR_LENGTH]
+    if missing:
+        generation = status_cache.generation
+        loaded = load_statuses(missing)
+        status_cache.set_many(loaded, generation)
+        found.update(loaded)
+    sees_all = user is None or (user.is_staff and user.is_superuser)
+    return {
+        pnr: found[pnr][1] if pnr in found and (sees_all or found[pnr][0] == user.pk) else None
+        for pnr in pnrs
+    }
+
+
+def invalidate(pnr):
+    """Drop a booking's cached status once the current transaction commits"""
+    pnr = normalize(pnr)
+    transaction.on_commit(lambda: status_cache.delete(pnr))
@@ -0,0 +1,82 @@
+"""
+Ranking for search results.
+
+Every option (direct or connecting) is reduced to the same metrics: departure,
+arrival, fare, number of transfers and connection buffer. The objective decides
+the sort key. TopK keeps the best k options in a bounded heap. Candidates fed in
+order of a lower bound on the primary key can stop as soon as that bound can no
+longer beat the k-th best.
+"""
+import heapq
+import itertools
+
+OBJECTIVES = ('arrival', 'duration', 'fare', 'transfers', 'comfort')
+DEFAULT_OBJECTIVE = 'arrival'
+
+# Connections longer than this are all equally comfortable
+COMFORT_BUFFER_MINUTES = 120
+
+
+def sort_key(objective, departure, arrival, fare, transfers=0, buffer_minutes=0):
+    """Sort key for an option; smaller is better. The first element is the primary objective."""
+    if objective == 'duration':
+        return (arrival - departure, arrival, fare)
+    if objective == 'fare':
+        return (fare, arrival)
+    if objective == 'transfers':
+        return (transfers, arrival, fare)
+    if objective == 'comfort':
+        buffer_minutes = buffer_minutes if transfers else COMFORT_BUFFER_MINUTES
+        return (-min(buffer_minutes, COMFORT_BUFFER_MINUTES), arrival, fare)
+    return (arrival, fare)
+
+
+class _Worst:
+    """Heap entry ordered so the worst kept option sits at the root"""
+    __slots__ = ('key', 'item')
+
+    def __init__(self, key, item):
+        self.key = key
+        self.item = item
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+
+class TopK:
+    """Keep the k smallest-keyed items seen, in O(k) memory"""
+
+    def __init__(self, k):
+        self.k = k
+        self.heap = []
+        self.seen = 0
+        self.stopped_early = False
+        self._order = itertools.count()
+
+    def push(self, key, item):
+        self.seen += 1
+        # The insertion counter keeps equal keys in arrival order and never compares items
+        entry = _Worst((key, next(self._order)), item)
+        if len(self.heap) < self.k:
+            heapq.heappush(self.heap, entry)
+        elif entry.key < self.heap[0].key:
+            heapq.heapreplace(self.heap, entry)
+
+    def done(self, primary_lower_bound):
+        """True once nothing whose primary key is >= primary_lower_bound can still get in"""
+        if self.k and len(self.heap) >= self.k and primary_lower_bound > self.heap[0].key[0][0]:
+            self.stopped_early = True
+            return True
+        return False
+
+    def items(self):
+        """Kept items, best first"""
+        return [entry.item for entry in sorted(self.heap, key=lambda entry: entry.key)]
+
+
+def connecting_lower_bound(objective, departure, earliest_arrival, first_fare):
+    """
+    Smallest primary key any connection starting with this first leg can have,
+    given its departure, the earliest possible final arrival and the first-leg fare.
+    """
+    return sort_key(objective, departure, earliest_arrival, first_fare, 1, COMFORT_BUFFER_MINUTES)[0]
@@ -0,0 +1,99 @@
+"""
+Date-specific exceptions to the weekly runs_on pattern.
+
+ScheduleException rows are merged per schedule into sorted, disjoint date
+intervals (one list for suspensions, one for extra runs), so "does schedule S run
+on date D" is a dict lookup and a bisect whatever the number of exceptions across
+the network. The calendar is rebuilt when the schedule exception log version moves.
+"""
+import threading
+from bisect import bisect_right
+
+from . import timetable
+
+
+class IntervalSet:
+    """Union of inclusive date ranges, stored as merged day-ordinal intervals"""
+
+    def __init__(self, ranges):
+        self.starts = []
+        self.ends = []
+        for start, end in sorted((start.toordinal(), end.toordinal()) for start, end in ranges):
+            if self.ends and start <= self.ends[-1] + 1:
+                self.ends[-1] = max(self.ends[-1], end)
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+
+    def __contains__(self, day):
+        ordinal = day.toordinal()
+        i = bisect_right(self.starts, ordinal) - 1
+        return i >= 0 and ordinal <= self.ends[i]
+
+
+# ==================== Service Calendar ====================
+class ServiceCalendar:
+    def __init__(self, exceptions, version=0):
+        """exceptions: iterable of (schedule_id, kind, start_date, end_date)"""
+        from .models import ScheduleException
+
+        self.version = version
+        suspended, extra = {}, {}
+        for schedule_id, kind, start, end in exceptions:
+            ranges = suspended if kind in ScheduleException.SUSPENDING else extra
+            ranges.setdefault(schedule_id, []).append((start, end))
+        self.suspended = {sid: IntervalSet(ranges) for sid, ranges in suspended.items()}
+        self.extra = {sid: IntervalSet(ranges) for sid, ranges in extra.items()}
+
+    @classmethod
+    def from_db(cls, schedule_ids=None):
+        """Calendar of all exceptions, or only those of schedule_ids"""
+        from .models import ScheduleException, TimetableChange
+
+        version = TimetableChange.current_version('scheduleexception')
+        exceptions = ScheduleException.objects.all()
+        if schedule_ids is not None:
+            exceptions = exceptions.filter(schedule_id__in=schedule_ids)
+        return cls(exceptions.values_list('schedule_id', 'kind', 'start_date', 'end_date').iterator(), version)
+
+    def is_suspended(self, schedule_id, day):
+        """True if the schedule is cancelled or diverted on this date"""
+        ranges = self.suspended.get(schedule_id)
+        return ranges is not None and day in ranges
+
+    def runs(self, schedule_id, runs_on, day):
+        """True if the schedule runs on this date: suspensions win, then extra runs, then runs_on"""
+        if self.is_suspended(schedule_id, day):
+            return False
+        ranges = self.extra.get(schedule_id)
+        if ranges is not None and day in ranges:
+            return True
+        return str(day.weekday()) in runs_on
+
+    def extra_on(self, day):
+        """Ids of schedules with an extra run on this date"""
+        return {sid for sid, ranges in self.extra.items() if day in ranges and not self.is_suspended(sid, day)}
+
+
+_lock = threading.Lock()
+_calendar = None
+_checked_version = 0
+
+
+def get_service_calendar():
+    """
+    Process-wide calendar. Other timetable edits only cost a check of the newest
+    exception change; the calendar is rebuilt when that moves.
+    """
+    global _calendar, _checked_version
+    latest = timetable.latest_version()
+    if _calendar is None or _checked_version < latest:
+        with _lock:
+            from .models import TimetableChange
+
+            if _calendar is None:
+                _calendar = ServiceCalendar.from_db()
+            elif _checked_version < latest and TimetableChange.current_version('scheduleexception') > _calendar.version:
+                _calendar = ServiceCalendar.from_db()
+            _checked_version = latest
+    return _calendar
@@ -0,0 +1,122 @@
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from railway_project.sqlite_tuning import apply_sqlite_pragmas
+
+from .models import (Station, Train, Route, Schedule, ScheduleException, AdminSettings, TimetableChange, DatedTrip,
+                     Booking, BookingLeg, Passenger, InventoryEntry)
+from .fares import fare_engine
+from . import pnr_status
+
+# ==================== Fare Table Invalidation ====================
+@receiver([post_save, post_delete], sender=AdminSettings)
+def invalidate_fare_tables(sender, **kwargs):
+    """Rebuild fare tables after fare settings change (route/train edits go through the change log)"""
+    fare_engine.invalidate()
+
+# ==================== Timetable Change Log ====================
+# Bumping the version is what invalidates the timetable snapshot and patches fare
+# tables, in this process and (on their next poll) in every other one.
+@receiver(post_save, sender=Station)
+@receiver(post_save, sender=Train)
+@receiver(post_save, sender=Route)
+@receiver(post_save, sender=ScheduleException)
+def log_timetable_save(sender, instance, **kwargs):
+    """Record a saved station, train, route or schedule exception"""
+    TimetableChange.record(sender._meta.model_name, [instance.pk], TimetableChange.SAVE)
+
+@receiver(pre_save, sender=Schedule)
+def remember_schedule_timetable(sender, instance, update_fields=None, **kwargs):
+    """Note whether the save changes a timetable field (admin seat edits do not)"""
+    fields = [f for f in Schedule.TIMETABLE_FIELDS if update_fields is None or f in update_fields]
+    stored = None
+    if fields and instance.pk is not None:
+        stored = Schedule.objects.filter(pk=instance.pk).values(*fields).first()
+    if not fields:
+        instance._timetable_changed = False
+    elif stored is None:
+        instance._timetable_changed = True
+    else:
+        instance._timetable_changed = any(getattr(instance, f) != stored[f] for f in fields)
+
+@receiver(post_save, sender=Schedule)
+def log_schedule_save(sender, instance, **kwargs):
+    """Record a saved schedule, unless only its seat counters changed"""
+    if getattr(instance, '_timetable_changed', True):
+        TimetableChange.record('schedule', [instance.pk], TimetableChange.SAVE)
+
+@receiver(post_delete, sender=Station)
+@receiver(post_delete, sender=Train)
+@receiver(post_delete, sender=Route)
+@receiver(post_delete, sender=Schedule)
+@receiver(post_delete, sender=ScheduleException)
+def log_timetable_delete(sender, instance, **kwargs):
+    """Record a deleted station, train, route, schedule or exception (cascades send one signal per row)"""
+    TimetableChange.record(sender._meta.model_name, [instance.pk], TimetableChange.DELETE)
+
+# ==================== Dated Trips ====================
+@receiver(post_save, sender=Schedule)
+def refresh_schedule_trips(sender, instance, **kwargs):
+    """Re-expand a saved schedule's upcoming trips"""
+    if getattr(instance, '_timetable_changed', True):
+        DatedTrip.refresh_schedules([instance.pk])
+
+@receiver([post_save, post_delete], sender=ScheduleException)
+def refresh_exception_trips(sender, instance, **kwargs):
+    """Cancellations and extra runs change which trips exist"""
+    # After commit, so a cascade from a deleted schedule does not re-create its trips
+    schedule_id = instance.schedule_id
+    transaction.on_commit(lambda: DatedTrip.refresh_schedules([schedule_id]))
+
+@receiver(post_save, sender=Route)
+def refresh_route_trips(sender, instance, **kwargs):
+    """Route duration and endpoints are copied into trips; re-expand its schedules"""
+    DatedTrip.refresh_schedules(list(instance.schedules.values_list('id', flat=True)))
+
+# ==================== Inventory Ledger ====================
+# Booking, cancellation and hold paths log their own entries; these catch counters
+# set by saving the schedule itself (admin and schedule forms)
+@receiver(pre_save, sender=Schedule)
+def remember_schedule_inventory(sender, instance, update_fields=None, **kwargs):
+    """Keep the stored seat counters being saved, to diff against after the save"""
+    fields = [attr for attr in Schedule.SEAT_FIELDS.values() if update_fields is None or attr in update_fields]
+    if not fields:
+        instance._stored_inventory = None
+        return
+    stored = None
+    if instance.pk is not None:
+        stored = Schedule.objects.filter(pk=instance.pk).values(*fields).first()
+    instance._stored_inventory = stored or dict.fromkeys(fields, 0)
+
+@receiver(post_save, sender=Schedule)
+def log_schedule_inventory(sender, instance, created, **kwargs):
+    """Ledger the counters of a new schedule (OPENING) or an admin's change to them (ADJUST)"""
+    stored = getattr(instance, '_stored_inventory', None)
+    instance._stored_inventory = None
+    if not stored:
+        return
+    reason = InventoryEntry.OPENING if created else InventoryEntry.ADJUST
+    InventoryEntry.record([
+        (instance.pk, seat_class, getattr(instance, attr) - stored[attr], reason, '')
+        for seat_class, attr in Schedule.SEAT_FIELDS.items() if attr in stored
+    ])
+
+# ==================== PNR Status Cache ====================
+# Bulk updates (e.g. cancellation) do not send signals; those callers invalidate directly
+@receiver([post_save, post_delete], sender=Booking)
+def invalidate_booking_status(sender, instance, **kwargs):
+    """Drop the cached status of a saved or deleted booking"""
+    pnr_status.invalidate(instance.pnr)
+
+@receiver([post_save, post_delete], sender=BookingLeg)
+@receiver([post_save, post_delete], sender=Passenger)
+def invalidate_booking_detail_status(sender, instance, **kwargs):
+    """Legs and passengers are part of the status payload"""
+    pnr = Booking.objects.filter(pk=instance.booking_id).values_list('pnr', flat=True).first()
+    if pnr:
+        pnr_status.invalidate(pnr)
+
+# ==================== SQLite Tuning ====================
+connection_created.connect(apply_sqlite_pragmas, dispatch_uid='railway_sqlite_pragmas')
@@ -0,0 +1,64 @@
+// Turns <select data-autocomplete-url> (forms.AutocompleteSelect) into a search box.
+// Options are fetched a page at a time from the lookup endpoint as the user types.
+(function () {
+    function setup(select) {
+        const url = select.dataset.autocompleteUrl;
+        const input = document.createElement('input');
+        const dropdown = document.createElement('div');
+        let query = '';
+        let page = 1;
+        let timer = null;
+
+        input.type = 'text';
+        input.className = select.className;
+        input.placeholder = 'Type to search...';
+        input.value = select.selectedIndex > 0 ? select.options[select.selectedIndex].text : '';
+        dropdown.className = 'list-group mt-1';
+        select.style.display = 'none';
+        select.after(input, dropdown);
+
+        function choose(item) {
+            select.innerHTML = '';
+            select.add(new Option(item.text, item.id, true, true));
+            input.value = item.text;
+            dropdown.innerHTML = '';
+            select.dispatchEvent(new Event('change'));
+        }
+
+        async function load(append) {
+            const response = await fetch(`${url}?q=${encodeURIComponent(query)}&page=${page}`);
+            const data = await response.json();
+            if (!append) {
+                dropdown.innerHTML = '';
+            }
+            dropdown.querySelector('.autocomplete-more')?.remove();
+            data.results.forEach(item => {
+                const button = document.createElement('button');
+                button.type = 'button';
+                button.className = 'list-group-item list-group-item-action';
+                button.textContent = item.text;
+                button.addEventListener('click', () => choose(item));
+                dropdown.appendChild(button);
+            });
+            if (data.has_more) {
+                const more = document.createElement('button');
+                more.type = 'button';
+                more.className = 'list-group-item list-group-item-action text-muted autocomplete-more';
+                more.textContent = 'More...';
+                more.addEventListener('click', () => { page += 1; load(true); });
+                dropdown.appendChild(more);
+            }
+        }
+
+        input.addEventListener('input', () => {
+            clearTimeout(timer);
+            query = input.value;
+            page = 1;
+            timer = setTimeout(() => load(false), 200);
+        });
+    }
+
+    document.addEventListener('DOMContentLoaded', () => {
+        document.querySelectorAll('select[data-autocomplete-url]').forEach(setup);
+    });
+})();
@@ -0,0 +1,87 @@
+"""
+Precomputed station list for the home page search form.
+
+The whole list is serialized once into JSON, plus gzip (and brotli, when the
+optional brotli package is installed) encodings of it, and served as a static
+payload with an ETag. It is rebuilt only when a station changes, that is when
+the newest 'station' entry in the TimetableChange log moves.
+"""
+import gzip
+import hashlib
+import json
+import threading
+
+from . import timetable
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+
+class StationCatalog:
+    def __init__(self, stations, version=0):
+        """stations: iterable of (id, code, name, city), in display order"""
+        self.version = version
+        self.stations = list(stations)
+        self.body = json.dumps(
+            [{'id': sid, 'code': code, 'name': name, 'city': city} for sid, code, name, city in self.stations],
+            separators=(',', ':'),
+        ).encode('utf-8')
+        # Content hash: used as the ETag and as the ?v= cache-busting parameter
+        self.tag = f'stations-{hashlib.sha256(self.body).hexdigest()[:16]}'
+        self.etag = f'"{self.tag}"'
+        self.encoded = {'gzip': gzip.compress(self.body, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            self.encoded['br'] = brotli.compress(self.body)
+
+    @classmethod
+    def from_db(cls):
+        from .models import Station, TimetableChange
+
+        version = TimetableChange.current_version('station')
+        stations = Station.objects.order_by('name').values_list('id', 'code', 'name', 'city')
+        return cls(stations, version)
+
+    def negotiate(self, accept_encoding):
+        """(content encoding or None, body) for an Accept-Encoding header"""
+        accepted = set()
+        for part in accept_encoding.split(','):
+            encoding, _, params = part.partition(';')
+            # "gzip;q=0" means the client refuses gzip
+            quality = params.strip().lower()
+            if quality.startswith('q='):
+                try:
+                    if float(quality[2:]) <= 0:
+                        continue
+                except ValueError:
+                    continue
+            accepted.add(encoding.strip().lower())
+        for encoding in ('br', 'gzip'):
+            if encoding in self.encoded and encoding in accepted:
+                return encoding, self.encoded[encoding]
+        return None, self.body
+
+
+_lock = threading.Lock()
+_catalog = None
+_checked_version = 0
+
+
+def get_station_catalog():
+    """
+    Process-wide catalog. Unrelated timetable edits only cost a check of the
+    newest station change; the payload is rebuilt when that moves.
+    """
+    global _catalog, _checked_version
+    latest = timetable.latest_version()
+    if _catalog is None or _checked_version < latest:
+        with _lock:
+            from .models import TimetableChange
+
+            if _catalog is None:
+                _catalog = StationCatalog.from_db()
+            elif _checked_version < latest and TimetableChange.current_version('station') > _catalog.version:
+                _catalog = StationCatalog.from_db()
+            _checked_version = latest
+    return _catalog
@@ -1,3 +1,1543 @@
-from django.test import TestCase
+import gzip
+import importlib
+import json
+import os
+import random
+import tempfile
+import threading
+import time as time_module
+from datetime import date, time, timedelta
+from unittest import mock
+from decimal import Decimal
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from railway_project import db_router
+from railway_project.sqlite_tuning import sqlite_pragmas
+
+from . import admin as railway_admin, admission, coalesce, geo, lookup, pnr, station_catalog, pnr_status, service_calendar, ticket_tokens, timetable
+from .availability import availability_calendar
+from .fares import CONVENIENCE_FEE, fare_engine
+from .models import (AdminSettings, Station, Train, Route, Schedule, ScheduleException, Booking, DatedTrip, TimetableChange, SeatHold,
+                     InventoryEntry, InventorySnapshot, ArchivedBooking, BookingLeg, Passenger, UserProfile)
+from .ranking import OBJECTIVES, TopK, connecting_lower_bound, sort_key
+from .service_calendar import IntervalSet, ServiceCalendar
+from .timetable import Timetable
+from .views import (create_booking, run_in_search_executor, find_connecting_trains, find_connecting_trains_parallel, find_direct_trains,
+                    service_error)
+
+
+def naive_local(value):
+    """Dated trips give aware timestamps, the weekday search naive local ones"""
+    return timezone.make_naive(value) if timezone.is_aware(value) else value
+
+
+class NetworkMixin:
+    """Small timetable builders shared by the tests below"""
+
+    def station(self, code):
+        return Station.objects.create(code=code, name=f"Station {code}", city=code)
+
+    def schedule(self, number, source, destination, departure, arrival, runs_on='0123456', seats=50, distance=100):
+        train = Train.objects.create(train_number=number, train_name=f"Train {number}")
+        route = Route.objects.create(train=train, source=source, destination=destination, distance=distance,
+                                     base_fare_per_km='1.00')
+        return Schedule.objects.create(route=route, departure_time=departure, arrival_time=arrival,
+                                       runs_on=runs_on, sleeper_available=seats)
+
+    def booking(self, user, journey_date, **fields):
+        fields = {
+            'passenger_name': 'Asha Rao', 'passenger_email': 'asha@example.com', 'passenger_phone': '9000000000',
+            'passenger_age': 30, 'passenger_gender': 'F', 'status': 'CONFIRMED', 'seat_class': 'SLEEPER',
+            'total_fare': '100.00', **fields,
+        }
+        return Booking.objects.create(user=user, journey_date=journey_date, **fields)
+
+
+# ==================== Connecting Search ====================
+@override_settings(SEARCH_PARALLEL_MIN_FIRST_LEGS=0, SEARCH_MAX_DETOUR_RATIO=0)
+class ConnectingSearchTests(NetworkMixin, TestCase):
+    def setUp(self):
+        timetable.invalidate()
+        timetable.expire_version_check()
+        self.addCleanup(timetable.invalidate)
+        self.a, self.b, self.c = self.station('A'), self.station('B'), self.station('C')
+        self.journey_date = timezone.localdate() + timedelta(days=3)
+        weekday = self.journey_date.weekday()
+        # Overnight first leg: reaches B at 01:00 the next day
+        self.schedule('T1', self.a, self.b, time(22, 0), time(1, 0))
+        self.schedule('T2', self.b, self.c, time(9, 0), time(12, 0))
+        # Daytime first leg whose only onward train runs on the journey weekday alone,
+        # so the next morning's departure does not exist
+        self.schedule('T3', self.a, self.b, time(8, 0), time(20, 0))
+        self.schedule('T4', self.b, self.c, time(7, 0), time(8, 0), runs_on=str(weekday))
+
+    def search(self, workers):
+        with self.settings(SEARCH_PARALLEL_WORKERS=workers):
+            if workers:
+                results = find_connecting_trains_parallel(self.a, self.c, self.journey_date, 'SLEEPER')
+                self.assertIsNotNone(results)
+            else:
+                results = find_connecting_trains(self.a, self.c, self.journey_date, 'SLEEPER')
+        return sorted(
+            (r['leg_1']['schedule'].route.train.train_number, r['leg_2']['schedule'].route.train.train_number,
+             r['buffer_minutes'], naive_local(r['total_arrival_time']))
+            for r in results
+        )
+
+    def test_parallel_matches_serial(self):
+        serial = self.search(workers=0)
+        next_day = self.journey_date + timedelta(days=1)
+        self.assertEqual(serial, [
+            ('T1', 'T2', 480, timezone.datetime.combine(next_day, time(12, 0))),
+            ('T3', 'T2', 780, timezone.datetime.combine(next_day, time(12, 0))),
+        ])
+        self.assertEqual(self.search(workers=2), serial)
+
+    def test_parallel_matches_dated_trips(self):
+        DatedTrip.extend(7)
+        self.assertTrue(DatedTrip.covers(self.journey_date))
+        self.assertEqual(self.search(workers=2), self.search(workers=0))
+
+    def test_pool_follows_snapshot(self):
+        serial = self.search(workers=0)
+        old = timetable.get_timetable()
+        self.assertEqual(self.search(workers=2), serial)
+        old_planner = timetable._pool
+        self.assertEqual(old_planner.version, old.version)
+
+        self.schedule('T5', self.a, self.c, time(6, 0), time(7, 0))
+        timetable.expire_version_check()
+        new = timetable.get_timetable()
+        self.assertGreater(new.version, old.version)
+        self.assertEqual(self.search(workers=2), serial)
+        self.assertEqual(timetable._pool.version, new.version)
+        # The old pool was closed, not terminated, and a search still on the old
+        # snapshot plans in-process instead of sending its rows to the new pool
+        self.assertTrue(old_planner.retired)
+        with self.settings(SEARCH_PARALLEL_WORKERS=2):
+            rows = old.first_leg_rows(old.station_index[self.a.id], old.station_index[self.c.id],
+                                      self.journey_date.weekday())
+            available = frozenset(old.schedule_id)
+            expected = old.connecting(rows, old.station_index[self.c.id], self.journey_date.weekday(), 30, available)
+            self.assertEqual(timetable.parallel_connecting(old, rows, old.station_index[self.c.id],
+                                                           self.journey_date.weekday(), 30, available, 2), expected)
+        self.assertEqual(timetable._pool.version, new.version)
+
+    def test_retired_pool_finishes_running_maps(self):
+        tt = timetable.get_timetable()
+        planner = timetable._acquire_pool(tt, 2)
+        timetable.invalidate()
+        self.assertTrue(planner.retired)
+        rows = tt.first_leg_rows(tt.station_index[self.a.id], tt.station_index[self.c.id], self.journey_date.weekday())
+        chunk = (rows, tt.station_index[self.c.id], self.journey_date.weekday(), 30, frozenset(tt.schedule_id),
+                 frozenset())
+        self.assertEqual(len(planner.pool.map(timetable._connecting_chunk, [chunk])[0]), 2)
+        timetable._release_pool(planner)
+        with self.assertRaises(ValueError):
+            planner.pool.map(timetable._connecting_chunk, [chunk])
+
+
+# ==================== Fares ====================
+class FareEngineTests(NetworkMixin, TestCase):
+    def setUp(self):
+        fare_engine.invalidate()
+        timetable.expire_version_check()
+        self.addCleanup(fare_engine.invalidate)
+        a, b = self.station('A'), self.station('B')
+        train = Train.objects.create(train_number='F1', train_name='Fare Express', sleeper_seats=100, ac_first_seats=10)
+        self.route = Route.objects.create(train=train, source=a, destination=b, distance=1200, base_fare_per_km='1.00')
+        self.trip = Schedule.objects.create(route=self.route, departure_time=time(8, 0), arrival_time=time(20, 0),
+                                            sleeper_available=100, ac_first_available=10)
+
+    def set_available(self, seats):
+        Schedule.objects.filter(pk=self.trip.pk).update(sleeper_available=seats)
+        self.trip.refresh_from_db()
+
+    def test_class_and_distance_slabs(self):
+        # 500 km at 1.00, 500 km at 0.90, 200 km at 0.80
+        self.assertEqual(fare_engine.get_fare(self.route.id, 'SLEEPER'), Decimal('1110.00'))
+        self.assertEqual(fare_engine.get_fare(self.route.id, 'AC_FIRST'), Decimal('4440.00'))
+        self.assertEqual(fare_engine.get_fare(self.route.id, 'GENERAL'), Decimal('666.00'))
+        with self.assertRaises(KeyError):
+            fare_engine.get_fare(self.route.id + 1, 'SLEEPER')
+
+    def test_surge_tiers(self):
+        for available, tier, fare in ((100, 0, '1110.00'), (50, 1, '1221.00'), (25, 2, '1387.50'),
+                                      (5, 3, '1665.00')):
+            self.set_available(available)
+            self.assertEqual(fare_engine.surge_tier(self.trip, 'SLEEPER'), tier)
+            self.assertEqual(fare_engine.fare_for_schedule(self.trip, 'SLEEPER'), Decimal(fare))
+        # Seats taken by the booking's own hold count as available
+        self.set_available(49)
+        self.assertEqual(fare_engine.surge_tier(self.trip, 'SLEEPER'), 1)
+        self.assertEqual(fare_engine.surge_tier(self.trip, 'SLEEPER', held=2), 0)
+
+    def test_quote(self):
+        quote = fare_engine.quote([self.trip, self.trip], 'SLEEPER', passengers=2)
+        self.assertEqual(quote['leg_fares'], [Decimal('2220.00')] * 2)
+        self.assertEqual(quote['base_fare'], Decimal('4440.00'))
+        self.assertEqual(quote['gst'], Decimal('222.00'))
+        self.assertEqual(quote['convenience_fee'], CONVENIENCE_FEE)
+        self.assertEqual(quote['total'], Decimal('4440.00') + Decimal('222.00') + CONVENIENCE_FEE)
+
+    def test_settings_and_route_edits_rebuild_tables(self):
+        AdminSettings.objects.create(key='fare_class_multipliers', value=json.dumps({'SLEEPER': '1.50'}))
+        self.assertEqual(fare_engine.get_fare(self.route.id, 'SLEEPER'), Decimal('1665.00'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.route.distance = 100
+            self.route.save()
+        self.assertEqual(fare_engine.get_fare(self.route.id, 'SLEEPER'), Decimal('150.00'))
+
+    @override_settings(CLIENT_RATE_LIMITS={})
+    def test_own_hold_does_not_change_the_fare(self):
+        # One more seat taken moves the schedule from tier 0 to tier 1
+        self.set_available(51)
+        self.client.force_login(User.objects.create_user('traveller', password='pw'))
+        page = self.client.get(reverse('booking'), {'schedule_id': self.trip.id, 'seat_class': 'SLEEPER'})
+        total = page.context['fares_by_class']['SLEEPER']['total']
+        response = self.client.post(reverse('hold_seats'), json.dumps({
+            'schedule_ids': [self.trip.id], 'seat_class': 'SLEEPER',
+        }), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(fare_engine.surge_tier(Schedule.objects.get(pk=self.trip.pk), 'SLEEPER'), 1)
+        # A reload while the hold is live shows the same fare
+        page = self.client.get(reverse('booking'), {'schedule_id': self.trip.id, 'seat_class': 'SLEEPER'})
+        self.assertEqual(page.context['fares_by_class']['SLEEPER']['total'], total)
+
+        response = self.client.post(reverse('booking'), json.dumps({
+            'passenger_name': 'Asha Rao', 'passenger_email': 'asha@example.com', 'passenger_phone': '9000000000',
+            'passenger_age': 30, 'passenger_gender': 'F', 'seat_class': 'SLEEPER',
+            'journey_date': (timezone.localdate() + timedelta(days=3)).isoformat(), 'schedule_ids': [self.trip.id],
+            'total_fare': total,
+        }), content_type='application/json')
+        self.assertEqual(response.json()['status'], 'success')
+        self.assertEqual(Booking.objects.get().total_fare, Decimal(total))
+        self.assertEqual(Schedule.objects.get(pk=self.trip.pk).sleeper_available, 50)
+
+
+# ==================== Ranking ====================
+@override_settings(SEARCH_PARALLEL_WORKERS=0, SEARCH_MAX_DETOUR_RATIO=0)
+class RankingTests(NetworkMixin, TestCase):
+    def options(self, rng, count):
+        """(departure, arrival, fare, transfers, buffer) tuples in minutes and rupees"""
+        options = []
+        for _ in range(count):
+            departure = rng.randrange(0, 1440)
+            options.append((departure, departure + rng.randrange(60, 1800), rng.randrange(100, 3000),
+                            rng.randrange(0, 2), rng.randrange(30, 300)))
+        return options
+
+    def test_top_k_matches_full_sort(self):
+        rng = random.Random(7)
+        options = self.options(rng, 500)
+        for objective in OBJECTIVES:
+            keys = [sort_key(objective, *option) for option in options]
+            for k in (1, 10, 500, 600):
+                top = TopK(k)
+                for key, option in zip(keys, options):
+                    top.push(key, option)
+                self.assertEqual([sort_key(objective, *option) for option in top.items()], sorted(keys)[:k])
+                self.assertEqual(top.seen, len(options))
+
+    def test_equal_keys_keep_arrival_order(self):
+        top = TopK(2)
+        for item in ('first', 'second', 'third'):
+            top.push((1, 1), item)
+        self.assertEqual(top.items(), ['first', 'second'])
+
+    def test_early_stop_keeps_the_best(self):
+        rng = random.Random(11)
+        stopped = set()
+        for objective in OBJECTIVES:
+            # First legs with the connections they lead to; candidates are visited in
+            # order of connecting_lower_bound, as the planner does
+            candidates = []
+            every = []
+            for departure, first_arrival, first_fare, _, _ in self.options(rng, 200):
+                keys = []
+                for _ in range(3):
+                    buffer_minutes = rng.randrange(30, 600)
+                    arrival = first_arrival + buffer_minutes + rng.randrange(30, 600)
+                    keys.append(sort_key(objective, departure, arrival, first_fare + rng.randrange(100, 2000), 1,
+                                         buffer_minutes))
+                every.append(min(keys))
+                bound = connecting_lower_bound(objective, departure, first_arrival + 30, first_fare)
+                self.assertLessEqual(bound, min(keys)[0])
+                candidates.append((bound, min(keys)))
+            candidates.sort(key=lambda candidate: candidate[0])
+            top = TopK(5)
+            for bound, key in candidates:
+                if top.done(bound):
+                    break
+                top.push(key, key)
+            self.assertEqual(top.items(), sorted(every)[:5])
+            if top.stopped_early:
+                stopped.add(objective)
+        # Bounds that are constant (transfers, comfort) can never stop early
+        self.assertEqual(stopped, {'arrival', 'duration', 'fare'})
+
+    def test_connecting_search_limit(self):
+        rng = random.Random(3)
+        a, c = self.station('A'), self.station('C')
+        hubs = [self.station(f'H{i}') for i in range(3)]
+        number = 0
+        for hub in hubs:
+            for _ in range(6):
+                number += 1
+                self.schedule(f'F{number}', a, hub, time(rng.randrange(0, 24), rng.choice((0, 30))),
+                              time(rng.randrange(0, 24), 15), distance=rng.randrange(50, 800))
+                self.schedule(f'S{number}', hub, c, time(rng.randrange(0, 24), rng.choice((0, 30))),
+                              time(rng.randrange(0, 24), 45), distance=rng.randrange(50, 800))
+        journey_date = timezone.localdate() + timedelta(days=3)
+
+        def key(objective, option):
+            departure = timezone.datetime.combine(journey_date, option['leg_1']['schedule'].departure_time)
+            return sort_key(objective, departure, naive_local(option['total_arrival_time']), option['total_fare'],
+                            1, option['buffer_minutes'])
+
+        for objective in OBJECTIVES:
+            full = find_connecting_trains(a, c, journey_date, 'SLEEPER', objective=objective)
+            self.assertEqual(len(full), 18)
+            keys = [key(objective, option) for option in full]
+            self.assertEqual(keys, sorted(keys))
+            top = find_connecting_trains(a, c, journey_date, 'SLEEPER', objective=objective, limit=4)
+            self.assertEqual([key(objective, option) for option in top], keys[:4])
+
+
+# ==================== Station Geography ====================
+class StationIndexTests(NetworkMixin, TestCase):
+    def setUp(self):
+        geo._index = None
+        timetable.expire_version_check()
+        self.addCleanup(setattr, geo, '_index', None)
+
+    def located(self, code, lat, lon):
+        return Station.objects.create(code=code, name=f"Station {code}", city=code, latitude=lat, longitude=lon)
+
+    def test_radius_queries_match_brute_force(self):
+        rng = random.Random(5)
+        stations = [(i, f'S{i}', f'Station {i}', 'City', rng.uniform(17, 21), rng.uniform(71, 75)) for i in range(300)]
+        index = geo.StationIndex(stations)
+        self.assertGreater(len(index.cells), 20)
+        for _ in range(50):
+            lat, lon, radius = rng.uniform(17, 21), rng.uniform(71, 75), rng.choice((1, 20, 60, 150))
+            expected = sorted(
+                (geo.haversine_km(lat, lon, s_lat, s_lon), station_id)
+                for station_id, _, _, _, s_lat, s_lon in stations
+                if geo.haversine_km(lat, lon, s_lat, s_lon) <= radius
+            )
+            self.assertEqual(index.nearby(lat, lon, radius, limit=len(stations)), expected)
+        # Across a cell corner: both stations are in other cells than the query point
+        index = geo.StationIndex([(1, 'N', 'N', 'C', 19.51, 73.01), (2, 'S', 'S', 'C', 19.49, 72.99)])
+        self.assertEqual([station_id for _, station_id in index.nearby(19.5, 73.0, 5)], [1, 2])
+        self.assertEqual(len(index.nearby(19.5, 73.0, 5, limit=1)), 1)
+
+    def test_stations_without_coordinates(self):
+        known = self.located('BCT', 18.97, 72.82)
+        unknown = self.station('XYZ')
+        index = geo.get_station_index()
+        self.assertEqual(list(index.stations), [known.id])
+        self.assertIsNone(index.coords(unknown.id))
+        self.assertIsNone(index.distance_km(known.id, unknown.id))
+        self.assertTrue(index.plausible_via(known.id, unknown.id, known.id, 1.0))
+        with self.settings(SEARCH_MAX_DETOUR_RATIO=1.5):
+            self.assertIsNone(geo.detour_filter(known.id, unknown.id))
+        response = self.client.get(reverse('nearby_stations'), {'station_id': unknown.id})
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(reverse('nearby_stations'), {'city': 'BCT', 'radius_km': 10})
+        self.assertEqual([s['code'] for s in response.json()['stations']], ['BCT'])
+
+    def test_detour_pruning(self):
+        mumbai = self.located('BCT', 18.97, 72.82)
+        delhi = self.located('NDLS', 28.64, 77.22)
+        nagpur = self.located('NGP', 21.15, 79.09)
+        chennai = self.located('MAS', 13.08, 80.27)
+        unknown = self.station('XYZ')
+        with self.settings(SEARCH_MAX_DETOUR_RATIO=1.5):
+            plausible = geo.detour_filter(mumbai.id, delhi.id)
+            self.assertTrue(plausible(nagpur.id))
+            self.assertFalse(plausible(chennai.id))
+            self.assertTrue(plausible(unknown.id))
+        with self.settings(SEARCH_MAX_DETOUR_RATIO=0):
+            self.assertIsNone(geo.detour_filter(mumbai.id, delhi.id))
+
+        for via in (nagpur, chennai):
+            self.schedule(f'{via.code}1', mumbai, via, time(6, 0), time(14, 0))
+            self.schedule(f'{via.code}2', via, delhi, time(18, 0), time(23, 0))
+        journey_date = timezone.localdate() + timedelta(days=3)
+        for ratio, expected in ((0, ['MAS1', 'NGP1']), (1.5, ['NGP1'])):
+            with self.settings(SEARCH_MAX_DETOUR_RATIO=ratio, SEARCH_PARALLEL_WORKERS=0):
+                found = find_connecting_trains(mumbai, delhi, journey_date, 'SLEEPER')
+            self.assertEqual(sorted(r['leg_1']['schedule'].route.train.train_number for r in found), expected)
+
+
+# ==================== Station Catalog ====================
+class StationCatalogTests(NetworkMixin, TestCase):
+    def setUp(self):
+        station_catalog._catalog = None
+        station_catalog._checked_version = 0
+        timetable.expire_version_check()
+        self.addCleanup(setattr, station_catalog, '_catalog', None)
+        self.a, self.b = self.station('A'), self.station('B')
+
+    def get(self, **headers):
+        return self.client.get(reverse('station_list'), headers=headers)
+
+    def test_etag_and_not_modified(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertEqual(response['Cache-Control'], 'public, max-age=0, must-revalidate')
+        self.assertEqual([s['code'] for s in json.loads(response.content)], ['A', 'B'])
+        for if_none_match in (etag, f'"other", {etag}'):
+            response = self.get(if_none_match=if_none_match)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.content, b'')
+            self.assertEqual(response['ETag'], etag)
+        self.assertEqual(self.get(if_none_match='"other"').status_code, 200)
+        # The versioned URL the home page links to is immutable
+        catalog = station_catalog.get_station_catalog()
+        response = self.client.get(reverse('station_list'), {'v': catalog.tag})
+        self.assertIn('immutable', response['Cache-Control'])
+
+    def test_encoding_negotiation(self):
+        catalog = station_catalog.get_station_catalog()
+        response = self.get(accept_encoding='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(gzip.decompress(response.content), catalog.body)
+        for accept_encoding in ('', 'identity', 'gzip;q=0, identity', 'deflate'):
+            response = self.get(accept_encoding=accept_encoding)
+            self.assertFalse(response.has_header('Content-Encoding'), accept_encoding)
+            self.assertEqual(response.content, catalog.body)
+        self.assertEqual(catalog.negotiate('GZIP;q=0.5')[0], 'gzip')
+        expected = 'br' if station_catalog.brotli is not None else 'gzip'
+        self.assertEqual(catalog.negotiate('br, gzip')[0], expected)
+
+    def test_rebuilt_only_on_station_changes(self):
+        catalog = station_catalog.get_station_catalog()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.schedule('T1', self.a, self.b, time(8, 0), time(12, 0))
+        self.assertIs(station_catalog.get_station_catalog(), catalog)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.b.name = 'Renamed'
+            self.b.save()
+        rebuilt = station_catalog.get_station_catalog()
+        self.assertIsNot(rebuilt, catalog)
+        self.assertNotEqual(rebuilt.tag, catalog.tag)
+        self.assertIn(b'Renamed', rebuilt.body)
+        # Warm requests are served from memory
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get().status_code, 200)
+
+
+# ==================== Admin Lookups ====================
+class LookupTests(NetworkMixin, TestCase):
+    def setUp(self):
+        station_catalog._catalog = None
+        station_catalog._checked_version = 0
+        lookup._indexes.clear()
+        timetable.expire_version_check()
+        self.addCleanup(lookup._indexes.clear)
+        self.addCleanup(setattr, station_catalog, '_catalog', None)
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'pw'))
+
+    def get(self, kind, **params):
+        return self.client.get(reverse('lookup', args=[kind]), params)
+
+    def test_search_pages(self):
+        index = lookup.LabelIndex([(n, f"Label {n:02d}") for n in range(1, 8)] + [(99, 'Other')])
+        self.assertEqual(index.search('label', page=1, page_size=3), (
+            [{'id': 1, 'text': 'Label 01'}, {'id': 2, 'text': 'Label 02'}, {'id': 3, 'text': 'Label 03'}], True))
+        results, has_more = index.search(' LABEL ', page=3, page_size=3)
+        self.assertEqual([r['id'] for r in results], [7])
+        self.assertFalse(has_more)
+        # A full last page does not claim more
+        self.assertEqual(len(index.search('label', page=1, page_size=7)[0]), 7)
+        self.assertFalse(index.search('label', page=1, page_size=7)[1])
+        self.assertEqual(index.search('label', page=4, page_size=3), ([], False))
+        self.assertEqual(index.label(99), 'Other')
+
+    def test_lookup_view(self):
+        codes = [f'S{n:02d}' for n in range(lookup.LOOKUP_PAGE_SIZE + 1)]
+        for code in codes:
+            self.station(code)
+        first = json.loads(self.get('station', q='station').content)
+        self.assertEqual([r['text'] for r in first['results']], [f'{code} - Station {code}' for code in codes[:-1]])
+        self.assertTrue(first['has_more'])
+        second = json.loads(self.get('station', q='station', page=2).content)
+        self.assertEqual([r['text'] for r in second['results']], [f'{codes[-1]} - Station {codes[-1]}'])
+        self.assertFalse(second['has_more'])
+        self.assertEqual(json.loads(self.get('station', q='station', page='x').content), first)
+        self.assertEqual(self.get('coach').status_code, 404)
+
+        self.client.force_login(User.objects.create_user('traveller', password='pw'))
+        self.assertEqual(self.get('station').status_code, 302)
+
+    def test_indexes_follow_the_timetable(self):
+        a, b = self.station('A'), self.station('B')
+        stations = lookup.get_lookup_index('station')
+        self.assertEqual(stations.version, station_catalog.get_station_catalog().tag)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.schedule('T1', a, b, time(8, 0), time(12, 0))
+        # Trains and routes rebuild on any timetable change; stations only with the catalog
+        self.assertIs(lookup.get_lookup_index('station'), stations)
+        trains = lookup.get_lookup_index('train')
+        self.assertEqual(trains.search('t1')[0], [{'id': Train.objects.get().id, 'text': 'T1 - Train T1'}])
+        self.assertEqual(lookup.get_lookup_index('route').search('')[0][0]['text'], 'T1: A → B')
+        self.assertIs(lookup.get_lookup_index('train'), trains)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            b.name = 'Renamed'
+            b.save()
+        rebuilt = lookup.get_lookup_index('station')
+        self.assertIsNot(rebuilt, stations)
+        self.assertEqual(rebuilt.version, station_catalog.get_station_catalog().tag)
+        self.assertEqual(rebuilt.label(b.id), 'B - Renamed')
+
+
+# ==================== PNR Allocation ====================
+class PNRTests(TestCase):
+    def test_format_and_check_digit(self):
+        value = pnr.PNRAllocator(host_id=5, pid=1234).next()
+        self.assertEqual(len(value), pnr.PNR_LENGTH)
+        self.assertTrue(pnr.is_valid(value))
+        self.assertTrue(pnr.is_valid(value.lower()))
+        # A single mistyped character or an adjacent swap is caught
+        typo = value[:3] + ('1' if value[3] != '1' else '2') + value[4:]
+        self.assertFalse(pnr.is_valid(typo))
+        swapped = next(value[:i] + value[i + 1] + value[i] + value[i + 2:]
+                       for i in range(len(value) - 1) if value[i] != value[i + 1])
+        self.assertFalse(pnr.is_valid(swapped))
+        self.assertFalse(pnr.is_valid(value[:-1]))
+
+    def test_decode_recovers_node_and_sequence(self):
+        allocator = pnr.PNRAllocator(host_id=5, pid=1234)
+        issued_at, node_id, sequence = pnr.decode(allocator.next())
+        self.assertEqual(node_id, (5 << pnr.PID_BITS) | 1234)
+        self.assertEqual(sequence, 0)
+        self.assertLessEqual(abs(issued_at - time_module.time()), 2)
+
+    def test_unique_and_monotonic(self):
+        # Enough PNRs to overflow the per-second sequence several times
+        values = [pnr.PNRAllocator(pid=pid) for pid in (100, 101)]
+        issued = [allocator.next() for allocator in values for _ in range(1000)]
+        self.assertEqual(len(set(issued)), len(issued))
+        for allocator_values in (issued[:1000], issued[1000:]):
+            # Ordered by issue second (the first six characters), scrambled within it
+            prefixes = [value[:6] for value in allocator_values]
+            self.assertEqual(prefixes, sorted(prefixes))
+            seconds = [pnr.decode(value)[0] for value in allocator_values]
+            self.assertEqual(seconds, sorted(seconds))
+
+    def test_not_enumerable(self):
+        allocator = pnr.PNRAllocator(pid=100)
+        burst = [allocator.next() for _ in range(pnr.MAX_SEQUENCE + 1)]
+        # Consecutive PNRs share the time prefix, but nothing after it predicts the next one
+        self.assertEqual(len({value[6:-1] for value in burst}), len(burst))
+        self.assertGreater(len({value[6] for value in burst}), 8)
+        # Without the key, the same worker, second and sequence give another PNR
+        first = pnr.PNRAllocator(pid=100).next()
+        with self.settings(PNR_SECRET='another key'):
+            other = pnr.PNRAllocator(pid=100).next()
+        if first[:6] == other[:6]:
+            self.assertNotEqual(first[6:], other[6:])
+
+    def test_node_changes_after_fork(self):
+        with self.settings(PNR_NODE_ID='3'):
+            allocator = pnr.PNRAllocator()
+            self.assertEqual(allocator.node_id, (3 << pnr.PID_BITS) | os.getpid())
+            parent_node = allocator.node_id
+            read_fd, write_fd = os.pipe()
+            child = os.fork()
+            if child == 0:
+                try:
+                    allocator.after_fork()
+                    os.write(write_fd, str(allocator.node_id).encode())
+                finally:
+                    os._exit(0)
+            os.close(write_fd)
+            child_node = int(os.read(read_fd, 32))
+            os.close(read_fd)
+            os.waitpid(child, 0)
+        self.assertEqual(child_node, (3 << pnr.PID_BITS) | child)
+        self.assertNotEqual(child_node, parent_node)
+
+
+# ==================== PNR Status API ====================
+@override_settings(CLIENT_RATE_LIMITS={'pnr_status': {'rate': 0.001, 'burst': 3}})
+class PNRStatusAPITests(NetworkMixin, TestCase):
+    def setUp(self):
+        pnr_status.status_cache.clear()
+        self.addCleanup(pnr_status.status_cache.clear)
+        admission._limiters.clear()
+        self.addCleanup(admission._limiters.clear)
+        self.owner = User.objects.create_user('owner', password='pw')
+        self.other = User.objects.create_user('other', password='pw')
+        self.own = self.booking(self.owner, timezone.localdate())
+        self.others = self.booking(self.other, timezone.localdate())
+
+    def test_login_required(self):
+        response = self.client.get(reverse('pnr_status', args=[self.own.pnr]))
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json()['status'], 'error')
+
+    def test_only_own_bookings(self):
+        self.client.force_login(self.owner)
+        response = self.client.get(reverse('pnr_status', args=[self.own.pnr]))
+        self.assertEqual(response.json()['booking']['pnr'], self.own.pnr)
+        # Someone else's PNR is indistinguishable from an unknown one, cached or not
+        self.assertEqual(self.client.get(reverse('pnr_status', args=[self.others.pnr])).status_code, 404)
+        response = self.client.get(reverse('pnr_status_batch'), {'pnrs': f'{self.own.pnr},{self.others.pnr}'})
+        self.assertEqual(response.json()['bookings'], {
+            self.own.pnr: pnr_status.get_statuses([self.own.pnr])[self.own.pnr], self.others.pnr: None,
+        })
+
+    def test_throttled_per_client(self):
+        self.client.force_login(self.owner)
+        url = reverse('pnr_status', args=[self.own.pnr])
+        self.assertEqual([self.client.get(url).status_code for _ in range(4)], [200, 200, 200, 429])
+        # Another client still has its own allowance
+        self.client.force_login(self.other)
+        self.assertEqual(self.client.get(reverse('pnr_status', args=[self.others.pnr])).status_code, 200)
+
+
+# ==================== Service Calendar ====================
+class ServiceCalendarTests(NetworkMixin, TestCase):
+    def setUp(self):
+        service_calendar._calendar = None
+        self.addCleanup(setattr, service_calendar, '_calendar', None)
+        timetable.expire_version_check()
+        self.a, self.b = self.station('A'), self.station('B')
+        self.day = timezone.localdate() + timedelta(days=3)
+        self.daily = self.schedule('T1', self.a, self.b, time(8, 0), time(12, 0))
+        self.weekly = self.schedule('T2', self.a, self.b, time(9, 0), time(13, 0), runs_on=str(self.day.weekday()))
+
+    def exception(self, schedule, kind, start, end=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            return ScheduleException.objects.create(schedule=schedule, kind=kind, start_date=start,
+                                                    end_date=end or start)
+
+    def direct(self, day):
+        return sorted(o['schedule'].route.train.train_number for o in find_direct_trains(self.a, self.b, day, 'SLEEPER'))
+
+    def test_interval_set_merges_ranges(self):
+        d = date(2026, 1, 1)
+        ranges = IntervalSet([(d, d + timedelta(days=2)), (d + timedelta(days=3), d + timedelta(days=4)),
+                              (d + timedelta(days=10), d + timedelta(days=10)), (d + timedelta(days=1), d)])
+        self.assertEqual(len(ranges.starts), 2)
+        self.assertIn(d + timedelta(days=4), ranges)
+        self.assertNotIn(d + timedelta(days=5), ranges)
+        self.assertIn(d + timedelta(days=10), ranges)
+        self.assertNotIn(d - timedelta(days=1), ranges)
+
+    def test_suspensions_win_over_extra_runs(self):
+        next_day = self.day + timedelta(days=1)
+        calendar = ServiceCalendar([
+            (self.weekly.id, ScheduleException.EXTRA, next_day, next_day + timedelta(days=1)),
+            (self.weekly.id, ScheduleException.DIVERTED, next_day + timedelta(days=1), next_day + timedelta(days=1)),
+            (self.daily.id, ScheduleException.CANCELLED, self.day, self.day),
+        ])
+        runs = self.weekly.runs_on
+        self.assertTrue(calendar.runs(self.weekly.id, runs, self.day))
+        self.assertTrue(calendar.runs(self.weekly.id, runs, next_day))
+        self.assertFalse(calendar.runs(self.weekly.id, runs, next_day + timedelta(days=1)))
+        self.assertFalse(calendar.runs(self.daily.id, self.daily.runs_on, self.day))
+        self.assertEqual(calendar.extra_on(next_day), {self.weekly.id})
+        self.assertEqual(calendar.extra_on(next_day + timedelta(days=1)), set())
+
+    def test_booking_path_follows_exceptions(self):
+        next_day = self.day + timedelta(days=1)
+        self.assertEqual(self.direct(self.day), ['T1', 'T2'])
+        self.exception(self.daily, ScheduleException.CANCELLED, self.day)
+        self.exception(self.weekly, ScheduleException.EXTRA, next_day)
+        self.assertEqual(self.direct(self.day), ['T2'])
+        self.assertEqual(self.direct(next_day), ['T1', 'T2'])
+        self.assertIn('does not run', service_error([self.daily], self.day.isoformat()))
+        self.assertIsNone(service_error([self.weekly], next_day.isoformat()))
+
+    def test_dated_trips_follow_exceptions(self):
+        DatedTrip.extend(7)
+        self.exception(self.daily, ScheduleException.CANCELLED, self.day)
+        self.assertTrue(DatedTrip.covers(self.day))
+        self.assertEqual(self.direct(self.day), ['T2'])
+        self.assertFalse(DatedTrip.objects.filter(schedule=self.daily, service_date=self.day).exists())
+        self.assertTrue(DatedTrip.objects.filter(schedule=self.daily, service_date=self.day + timedelta(days=1)).exists())
+
+
+# ==================== Availability Calendar ====================
+class AvailabilityCalendarTests(NetworkMixin, TestCase):
+    def test_follows_service_calendar(self):
+        a, b = self.station('A'), self.station('B')
+        start = timezone.localdate() + timedelta(days=1)
+        weekday = start.weekday()
+        daily = self.schedule('T1', a, b, time(8, 0), time(12, 0), seats=50)
+        weekly = self.schedule('T2', a, b, time(9, 0), time(13, 0), runs_on=str(weekday), seats=30)
+        ScheduleException.objects.create(schedule=daily, kind=ScheduleException.CANCELLED,
+                                         start_date=start + timedelta(days=1), end_date=start + timedelta(days=2))
+        ScheduleException.objects.create(schedule=weekly, kind=ScheduleException.EXTRA,
+                                         start_date=start + timedelta(days=2), end_date=start + timedelta(days=2))
+        ScheduleException.objects.create(schedule=weekly, kind=ScheduleException.DIVERTED,
+                                         start_date=start + timedelta(days=7), end_date=start + timedelta(days=7))
+
+        days = availability_calendar(a, b, 'SLEEPER', start, 9, calendar=ServiceCalendar.from_db())
+        self.assertEqual([(day['available_seats'], day['trains']) for day in days], [
+            (80, 2),  # both run
+            (0, 0),   # daily train cancelled
+            (30, 1),  # daily train cancelled, extra weekly run
+            (50, 1), (50, 1), (50, 1), (50, 1),
+            (50, 1),  # weekly run diverted
+            (50, 1),
+        ])
+        self.assertEqual(days[0]['date'], start.isoformat())
+
+
+# ==================== Timetable Version ====================
+class TimetableVersionTests(NetworkMixin, TestCase):
+    def setUp(self):
+        timetable.invalidate()
+        timetable.expire_version_check()
+        fare_engine.invalidate()
+        self.addCleanup(timetable.invalidate)
+        self.addCleanup(fare_engine.invalidate)
+        self.a, self.b = self.station('A'), self.station('B')
+        self.trip = self.schedule('T1', self.a, self.b, time(8, 0), time(12, 0))
+
+    def change(self, change_id):
+        return TimetableChange.objects.create(id=change_id, model_name='route', object_id=change_id)
+
+    def test_late_commit_is_not_skipped(self):
+        base = TimetableChange.current_version()
+        # base + 1 is still uncommitted when base + 2 becomes visible
+        self.change(base + 2)
+        self.assertEqual(TimetableChange.current_version(), base)
+        self.assertEqual(TimetableChange.changes_since(base), (base, {}))
+        self.change(base + 1)
+        self.assertEqual(TimetableChange.current_version(), base + 2)
+        self.assertEqual(TimetableChange.changes_since(base), (base + 2, {'route': {base + 1, base + 2}}))
+
+    def test_rolled_back_gap_settles(self):
+        base = TimetableChange.current_version()
+        self.change(base + 2)
+        self.assertEqual(TimetableChange.current_version(), base)
+        TimetableChange.objects.filter(id=base + 2).update(created_at=timezone.now() - timedelta(minutes=5))
+        self.assertEqual(TimetableChange.current_version(), base + 2)
+        self.assertEqual(TimetableChange.current_version('route'), base + 2)
+
+    def test_edits_reach_snapshot_and_fares(self):
+        row = timetable.get_timetable().schedule_id.index(self.trip.id)
+        self.assertEqual(timetable.get_timetable().dep_min[row], 8 * 60)
+        fare = fare_engine.fare_for_schedule(self.trip, 'SLEEPER')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.trip.departure_time = time(9, 30)
+            self.trip.save()
+            self.trip.route.base_fare_per_km = '2.00'
+            self.trip.route.save()
+
+        snapshot = timetable.get_timetable()
+        self.assertEqual(snapshot.version, TimetableChange.current_version())
+        self.assertEqual(snapshot.dep_min[snapshot.schedule_id.index(self.trip.id)], 9 * 60 + 30)
+        self.assertEqual(fare_engine.fare_for_schedule(self.trip, 'SLEEPER'), fare * 2)
+
+    def columns(self, tt):
+        return {name: list(getattr(tt, name)) for name in Timetable.COLUMNS + Timetable.STATION_COLUMNS}
+
+    def test_snapshot_is_patched(self):
+        c = self.station('C')
+        other = self.schedule('T2', self.b, c, time(14, 0), time(18, 0))
+        before = timetable.get_timetable()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.trip.runs_on = '012'
+            self.trip.save()
+            other.route.train.train_name = 'Renamed'
+            other.route.train.save()
+            self.schedule('T3', c, self.a, time(20, 0), time(23, 0))
+        patched = timetable.get_timetable()
+        self.assertIsNot(patched, before)
+        fresh = Timetable.from_db()
+        self.assertEqual(patched.version, fresh.version)
+        self.assertEqual(self.columns(patched), self.columns(fresh))
+        row = patched.schedule_id.index(other.id)
+        self.assertEqual(patched.train_label(row), ('T2', 'Renamed'))
+
+    def test_changes_outside_the_snapshot_keep_it(self):
+        before = timetable.get_timetable()
+        version = TimetableChange.current_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            # An admin seat edit is not a timetable change
+            self.trip.sleeper_available = 10
+            self.trip.save()
+        self.assertEqual(TimetableChange.current_version(), version)
+        with self.captureOnCommitCallbacks(execute=True):
+            ScheduleException.objects.create(schedule=self.trip, start_date=timezone.localdate(),
+                                             end_date=timezone.localdate(), kind=ScheduleException.CANCELLED)
+        self.assertGreater(TimetableChange.current_version(), version)
+        # The exception only advances the checked version: same snapshot, same pool
+        self.assertIs(timetable.get_timetable(), before)
+        self.assertEqual(timetable._checked_version, TimetableChange.current_version())
+
+
+# ==================== Timetable Snapshot File ====================
+class TimetableSnapshotFileTests(NetworkMixin, TestCase):
+    def setUp(self):
+        timetable.invalidate()
+        timetable.expire_version_check()
+        self.addCleanup(timetable.invalidate)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'timetable.bin')
+        self.a, self.b, self.c = self.station('A'), self.station('B'), self.station('Ç')
+        self.schedule('T1', self.a, self.b, time(22, 0), time(1, 0))
+        self.schedule('T2', self.b, self.c, time(9, 0), time(12, 0), runs_on='135')
+        Train.objects.filter(train_number='T2').update(train_name='Dakshin Exprèss')
+
+    def assertSameSnapshot(self, first, second):
+        for name in Timetable.COLUMNS + Timetable.STATION_COLUMNS:
+            self.assertEqual(list(getattr(first, name)), list(getattr(second, name)), name)
+        self.assertEqual(first.version, second.version)
+        self.assertEqual(first.station_index, second.station_index)
+        self.assertEqual([first.station_label(i) for i in range(len(first.station_ids))],
+                         [second.station_label(i) for i in range(len(second.station_ids))])
+        self.assertEqual([first.train_label(r) for r in range(len(first))],
+                         [second.train_label(r) for r in range(len(second))])
+
+    def test_round_trip(self):
+        built = Timetable.from_db()
+        built.save(self.path)
+        loaded = Timetable.load(self.path)
+        self.assertSameSnapshot(loaded, built)
+        self.assertIn(('Ç', 'Station Ç'), [loaded.station_label(i) for i in range(len(loaded.station_ids))])
+        a, c = loaded.station_index[self.a.id], loaded.station_index[self.c.id]
+        rows = loaded.first_leg_rows(a, c, 0)
+        available = frozenset(loaded.schedule_id)
+        self.assertEqual(loaded.connecting(rows, c, 0, 30, available), built.connecting(rows, c, 0, 30, available))
+
+    def test_corrupt_files_are_rejected(self):
+        Timetable.from_db().save(self.path)
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        header = Timetable._HEADER.size
+        for corrupt in (b'', b'RTTB', b'XXXX' + data[4:], data[:header + 7] + b'\x09' + data[header + 8:],
+                        data[:len(data) // 2], data[:4] + b'\x01' + data[5:]):
+            with open(self.path, 'wb') as f:
+                f.write(corrupt)
+            with self.assertRaises(ValueError):
+                Timetable.load(self.path)
+            with self.settings(TIMETABLE_SNAPSHOT_PATH=self.path):
+                timetable.invalidate()
+                self.assertSameSnapshot(timetable.get_timetable(), Timetable.from_db())
+
+    def test_stale_file_is_brought_up_to_date(self):
+        Timetable.from_db().save(self.path)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.schedule('T3', self.c, self.a, time(6, 0), time(9, 0))
+        with self.settings(TIMETABLE_SNAPSHOT_PATH=self.path):
+            snapshot = timetable.get_timetable()
+            self.assertSameSnapshot(snapshot, Timetable.from_db())
+
+            # With the log pruned past the file's version, the snapshot comes from the DB
+            timetable.invalidate()
+            stale = Timetable.load(self.path).version
+            with self.captureOnCommitCallbacks(execute=True):
+                self.schedule('T4', self.c, self.b, time(6, 0), time(9, 0))
+            TimetableChange.objects.filter(id__lte=stale + 1).delete()
+            # Pruning only ever removes old rows, so the gap it leaves is settled
+            TimetableChange.objects.update(created_at=timezone.now() - timedelta(hours=1))
+            self.assertIsNone(TimetableChange.changes_since(stale))
+            self.assertSameSnapshot(timetable.get_timetable(), Timetable.from_db())
+
+
+# ==================== Ticket Tokens ====================
+class TicketTokenTests(TestCase):
+    def claims(self, **fields):
+        return ticket_tokens.TicketClaims(**{
+            'pnr': 'ABC123', 'journey_date': date(2026, 1, 15), 'seat_class': 'SLEEPER', 'passenger_count': 2,
+            'legs': (ticket_tokens.TicketLeg('12001', 'NDLS', 'BPL', '1A'),), **fields,
+        })
+
+    def test_round_trip(self):
+        claims = self.claims()
+        self.assertEqual(ticket_tokens.verify(ticket_tokens.sign(claims)), claims)
+
+    def test_separators_in_fields_cannot_forge_claims(self):
+        # Under a joined encoding these two encoded to the same bytes
+        plain = self.claims(seat_class='SLEEPER', passenger_count=2)
+        forged = self.claims(seat_class='SLEEPER|2|12001:NDLS:BPL:1A;', passenger_count=2)
+        self.assertNotEqual(ticket_tokens.encode_claims(plain), ticket_tokens.encode_claims(forged))
+        self.assertEqual(ticket_tokens.verify(ticket_tokens.sign(forged)), forged)
+
+    def test_tampered_and_revoked_tokens_are_rejected(self):
+        token = ticket_tokens.sign(self.claims())
+        version, key_id, payload, signature = token.split('.')
+        other = ticket_tokens.sign(self.claims(passenger_count=9)).split('.')[2]
+        with self.assertRaisesMessage(ticket_tokens.InvalidTicket, 'bad signature'):
+            ticket_tokens.verify('.'.join([version, key_id, other, signature]))
+        with self.assertRaisesMessage(ticket_tokens.InvalidTicket, 'ticket cancelled'):
+            ticket_tokens.verify(token, revoked=ticket_tokens.RevocationList(['ABC123']))
+        with self.assertRaises(ticket_tokens.InvalidTicket):
+            ticket_tokens.verify(token, on_date=date(2026, 1, 16))
+
+    def test_signing_key_is_never_secret_key(self):
+        with self.settings(TICKET_SIGNING_KEYS={'k1': None}):
+            derived = ticket_tokens.signing_keys()['k1']
+            self.assertNotEqual(derived, settings.SECRET_KEY)
+            token = ticket_tokens.sign(self.claims(), key_id='k1')
+            with self.assertRaises(ticket_tokens.InvalidTicket):
+                ticket_tokens.verify(token, keys={'k1': settings.SECRET_KEY})
+        with self.settings(TICKET_SIGNING_KEYS={'k1': None, 'k2': 'dedicated'}):
+            keys = ticket_tokens.signing_keys()
+            self.assertEqual(keys, {'k1': derived, 'k2': 'dedicated'})
+
+
+# ==================== Ticket Revocations ====================
+class TicketRevocationTests(NetworkMixin, TestCase):
+    def test_late_committed_cancellation_is_synced(self):
+        revoked = ticket_tokens.RevocationList()
+        revoked.merge(ticket_tokens.revoked_since())
+        previous_sync = timezone.datetime.fromisoformat(revoked.synced_at)
+        # Stamped before that sync, but only committed after it
+        booking = self.booking(None, timezone.localdate(), status='CANCELLED',
+                               cancellation_date=previous_sync - timedelta(seconds=5))
+        revoked.merge(ticket_tokens.revoked_since(previous_sync))
+        self.assertIn(booking.pnr, revoked)
+
+
+# ==================== Seat Holds ====================
+class SeatHoldTests(NetworkMixin, TestCase):
+    def setUp(self):
+        self.a, self.b, self.c = self.station('A'), self.station('B'), self.station('C')
+        self.first = self.schedule('T1', self.a, self.b, time(8, 0), time(12, 0), seats=5)
+        self.second = self.schedule('T2', self.b, self.c, time(14, 0), time(18, 0), seats=1)
+        self.legs = [self.first, self.second]
+
+    def seats(self):
+        return [Schedule.objects.get(pk=s.pk).sleeper_available for s in self.legs]
+
+    def test_place_and_release(self):
+        token = SeatHold.place(self.legs, 'SLEEPER')
+        self.assertEqual(self.seats(), [4, 0])
+        self.assertEqual(SeatHold.objects.filter(hold_token=token).count(), 2)
+        SeatHold.release(token)
+        self.assertEqual(self.seats(), [5, 1])
+        self.assertFalse(SeatHold.objects.exists())
+        self.assertEqual(InventoryEntry.reconcile(), [])
+
+    def test_full_leg_holds_nothing(self):
+        self.assertIsNone(SeatHold.place(self.legs, 'SLEEPER', seats=2))
+        self.assertEqual(self.seats(), [5, 1])
+        self.assertEqual(self.first.sleeper_available, 5)
+        self.assertFalse(SeatHold.objects.exists())
+
+    def test_consume_matching_hold(self):
+        token = SeatHold.place(self.legs, 'SLEEPER')
+        self.assertFalse(SeatHold.consume(token, [self.first], 'SLEEPER'))
+        self.assertTrue(SeatHold.consume(token, self.legs, 'SLEEPER', pnr='PNR1'))
+        self.assertEqual(self.seats(), [4, 0])
+        self.assertFalse(SeatHold.objects.exists())
+        self.assertFalse(SeatHold.consume(token, self.legs, 'SLEEPER'))
+
+    def test_expired_holds_are_released(self):
+        live = SeatHold.place([self.first], 'SLEEPER')
+        SeatHold.place(self.legs, 'SLEEPER', ttl_seconds=0)
+        self.assertEqual(self.seats(), [3, 0])
+        self.assertEqual(SeatHold.release_expired(), 2)
+        self.assertEqual(self.seats(), [4, 1])
+        self.assertEqual(list(SeatHold.objects.values_list('hold_token', flat=True)), [live])
+
+    def test_booking_page_holds_nothing(self):
+        response = self.client.get(reverse('booking'), {'schedule_id': self.first.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(SeatHold.objects.exists())
+
+    def hold(self, legs, **fields):
+        return self.client.post(reverse('hold_seats'), json.dumps({
+            'schedule_ids': [s.id for s in legs], 'seat_class': 'SLEEPER', **fields,
+        }), content_type='application/json')
+
+    @override_settings(SEAT_HOLD_MAX_PER_USER=1, CLIENT_RATE_LIMITS={})
+    def test_hold_api(self):
+        self.assertEqual(self.hold(self.legs).status_code, 401)
+        user = User.objects.create_user('holder', password='pw')
+        self.client.force_login(user)
+        self.assertEqual(self.hold(self.legs).json()['status'], 'success')
+        # A new hold replaces the session's previous one
+        self.assertEqual(self.hold([self.first]).status_code, 200)
+        self.assertEqual(self.seats(), [4, 1])
+        self.assertEqual(SeatHold.objects.get().hold_token, self.client.session['seat_hold'])
+        # Holds from another session count towards the user's cap
+        SeatHold.objects.update(hold_token='other-session')
+        self.assertEqual(self.hold([self.second]).status_code, 429)
+        self.assertEqual(self.seats(), [4, 1])
+
+    @override_settings(CLIENT_RATE_LIMITS={})
+    def test_group_booking_uses_multi_seat_hold(self):
+        self.client.force_login(User.objects.create_user('holder', password='pw'))
+        self.assertEqual(self.hold([self.first], seats=0).status_code, 400)
+        self.assertEqual(self.hold([self.first], seats=3).json()['seats'], 3)
+        self.assertEqual(self.seats(), [2, 1])
+        response = self.client.post(reverse('group_booking'), json.dumps({
+            'passenger_email': 'asha@example.com', 'passenger_phone': '9000000000', 'seat_class': 'SLEEPER',
+            'journey_date': (timezone.localdate() + timedelta(days=3)).isoformat(), 'schedule_ids': [self.first.id],
+            'passengers': [{'name': f'Passenger {i}', 'age': 30, 'gender': 'F', 'seat_numbers': [f'{i}A']}
+                           for i in range(3)],
+        }), content_type='application/json')
+        self.assertEqual(response.json()['status'], 'success')
+        # The held seats were booked, not taken a second time
+        self.assertEqual(self.seats(), [2, 1])
+        self.assertFalse(SeatHold.objects.exists())
+        self.assertEqual(InventoryEntry.reconcile(), [])
+
+    @override_settings(CLIENT_RATE_LIMITS={'seat_hold': {'rate': 0.001, 'burst': 2}})
+    def test_hold_api_is_throttled(self):
+        admission._limiters.clear()
+        self.addCleanup(admission._limiters.clear)
+        self.client.force_login(User.objects.create_user('holder', password='pw'))
+        self.assertEqual([self.hold([self.first]).status_code for _ in range(3)], [200, 200, 429])
+
+
+# ==================== Admission Control ====================
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class AdmissionControlTests(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def room(self, rate=1, burst=1, max_queue=3, idle_seconds=30, admit_seconds=60):
+        return admission.WaitingRoom(admission.TokenBucket(rate, burst, clock=self.clock), max_queue,
+                                     idle_seconds, admit_seconds, clock=self.clock)
+
+    def test_token_bucket_refills_up_to_burst(self):
+        bucket = admission.TokenBucket(2, 3, clock=self.clock)
+        self.assertEqual([bucket.try_acquire() for _ in range(4)], [True, True, True, False])
+        self.clock.now += 0.5
+        self.assertEqual([bucket.try_acquire() for _ in range(2)], [True, False])
+        self.clock.now += 60
+        self.assertEqual(sum(bucket.try_acquire() for _ in range(5)), 3)
+
+    def test_fifo_admission(self):
+        room = self.room()
+        self.assertEqual(room.enter(), (True, None))
+        tickets = [room.enter()[1] for _ in range(3)]
+        self.assertEqual([room.poll(t.id) for t in tickets], [(room.WAITING, n) for n in (1, 2, 3)])
+        self.assertEqual(room.enter(), (False, None))
+        # The freed token goes to the head of the queue, not to a newcomer
+        self.clock.now += 1
+        admitted, newcomer = room.enter()
+        self.assertFalse(admitted)
+        self.assertEqual([room.poll(t.id) for t in tickets + [newcomer]],
+                         [(room.ADMITTED, 0), (room.WAITING, 1), (room.WAITING, 2), (room.WAITING, 3)])
+        self.clock.now += 1
+        self.assertEqual([room.poll(t.id)[0] for t in tickets], [room.ADMITTED] * 2 + [room.WAITING])
+        self.assertEqual(room.poll(newcomer.id), (room.WAITING, 2))
+
+    def test_idle_tickets_are_dropped(self):
+        room = self.room(idle_seconds=10)
+        room.enter()
+        idle, active = room.enter()[1], room.enter()[1]
+        self.clock.now += 0.5
+        room.poll(active.id)
+        # The head stopped polling: the next token skips it
+        self.clock.now += 10
+        self.assertEqual(room.poll(active.id), (room.ADMITTED, 0))
+        self.assertEqual(room.poll(idle.id), (room.UNKNOWN, None))
+
+    def test_admitted_ticket_is_single_use(self):
+        room = self.room(admit_seconds=5)
+        room.enter()
+        first, second = room.enter()[1], room.enter()[1]
+        self.assertFalse(room.use(first.id))
+        self.clock.now += 1
+        self.assertEqual(room.poll(first.id), (room.ADMITTED, 0))
+        self.clock.now += 1
+        self.assertEqual(room.poll(second.id), (room.ADMITTED, 0))
+        self.assertTrue(room.use(first.id))
+        self.assertFalse(room.use(first.id))
+        self.assertEqual(room.poll(first.id), (room.UNKNOWN, None))
+        # Admissions not redeemed in time lapse
+        self.clock.now += 6
+        self.assertFalse(room.use(second.id))
+        self.assertFalse(room.use('made-up'))
+
+    @override_settings(ADMISSION_CONTROL={'booking': {'rate': 1, 'max_active': 1, 'max_wait': 0}})
+    def test_decorator_responses(self):
+        room = self.room(max_queue=1)
+        admission._rooms['booking'] = room
+        admission._slots['booking'] = threading.BoundedSemaphore(1)
+        self.addCleanup(admission._rooms.clear)
+        self.addCleanup(admission._slots.clear)
+        view = admission.admission_control('booking')(lambda request: HttpResponse('booked'))
+        factory = RequestFactory()
+
+        self.assertEqual(view(factory.get('/')).status_code, 200)
+        self.assertEqual(view(factory.post('/')).content, b'booked')
+        queued = view(factory.post('/'))
+        self.assertEqual(queued.status_code, 429)
+        body = json.loads(queued.content)
+        self.assertEqual((body['status'], body['position']), ('queued', 1))
+        self.assertEqual(body['poll_url'], reverse('waiting_room', args=['booking', body['ticket']]))
+        self.assertEqual(queued['Retry-After'], '1')
+
+        full = view(factory.post('/'))
+        self.assertEqual(full.status_code, 429)
+        self.assertEqual(json.loads(full.content)['status'], 'error')
+        self.assertEqual(full['Retry-After'], str(admission.MAX_RETRY_SECONDS))
+
+        self.clock.now += 1
+        self.assertEqual(room.poll(body['ticket'])[0], room.ADMITTED)
+        admitted = factory.post('/', headers={admission.TICKET_HEADER: body['ticket']})
+        self.assertEqual(view(admitted).content, b'booked')
+        # The ticket was spent; re-sending it queues again
+        resent = factory.post('/', headers={admission.TICKET_HEADER: body['ticket']})
+        self.assertEqual(json.loads(view(resent).content)['status'], 'queued')
+
+        # Every max_active slot busy: the admitted request gives up after max_wait
+        admission._slots['booking'].acquire()
+        self.clock.now += 10
+        room.waiting.clear()
+        self.assertEqual(view(factory.post('/')).status_code, 503)
+
+
+# ==================== Group Booking ====================
+@override_settings(ADMISSION_CONTROL={})
+class GroupBookingTests(NetworkMixin, TestCase):
+    def setUp(self):
+        a, b, c = self.station('A'), self.station('B'), self.station('C')
+        self.legs = [self.schedule('T1', a, b, time(8, 0), time(12, 0), seats=10),
+                     self.schedule('T2', b, c, time(14, 0), time(18, 0), seats=2)]
+        self.client.force_login(User.objects.create_user('leader', password='pw'))
+
+    def seats(self):
+        return [Schedule.objects.get(pk=s.pk).sleeper_available for s in self.legs]
+
+    def book(self, count, legs=None):
+        return self.client.post(reverse('group_booking'), json.dumps({
+            'passenger_email': 'asha@example.com', 'passenger_phone': '9000000000', 'seat_class': 'SLEEPER',
+            'journey_date': (timezone.localdate() + timedelta(days=3)).isoformat(),
+            'schedule_ids': [s.id for s in legs or self.legs],
+            'passengers': [{'name': f'Passenger {i}', 'age': 30 + i, 'gender': 'MF'[i % 2],
+                            'seat_numbers': [f'{i}A', f'{i}B']} for i in range(count)],
+        }), content_type='application/json')
+
+    def test_passenger_count_limit(self):
+        self.assertEqual(self.book(0).status_code, 400)
+        self.assertEqual(self.book(7).status_code, 400)
+        AdminSettings.objects.create(key='max_group_size', value='1')
+        response = self.book(2)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('1 to 1', response.json()['error'])
+        self.assertEqual(self.seats(), [10, 2])
+
+    def test_one_pnr_for_the_group(self):
+        response = self.book(2)
+        self.assertEqual(response.json()['status'], 'success')
+        self.assertEqual(response.json()['passenger_count'], 2)
+        # Every leg gives up one seat per passenger
+        self.assertEqual(self.seats(), [8, 0])
+        booking = Booking.objects.get()
+        self.assertEqual(booking.pnr, response.json()['pnr'])
+        self.assertEqual(booking.passenger_name, 'Passenger 0')
+        self.assertEqual(list(booking.passengers.values_list('name', 'gender', 'seat_numbers', 'sequence')), [
+            ('Passenger 0', 'M', '0A,0B', 1), ('Passenger 1', 'F', '1A,1B', 2),
+        ])
+        self.assertEqual(list(booking.legs.values_list('schedule_id', 'seat_number', 'leg_sequence')),
+                         [(self.legs[0].id, '0A', 1), (self.legs[1].id, '0B', 2)])
+        self.assertEqual(InventoryEntry.reconcile(), [])
+
+    def test_full_leg_rolls_back(self):
+        response = self.book(3)
+        self.assertEqual(response.json()['status'], 'error')
+        self.assertIn('T2', response.json()['error'])
+        # The first leg's seats were given back with the rest of the transaction
+        self.assertEqual(self.seats(), [10, 2])
+        self.assertFalse(Booking.objects.exists())
+        self.assertFalse(BookingLeg.objects.exists())
+        self.assertFalse(Passenger.objects.exists())
+        self.assertEqual(InventoryEntry.reconcile(), [])
+
+
+# ==================== My Bookings ====================
+class MyBookingsTests(NetworkMixin, TestCase):
+    def setUp(self):
+        a, b = self.station('A'), self.station('B')
+        self.trip = self.schedule('T1', a, b, time(8, 0), time(12, 0))
+        self.user = User.objects.create_user('traveller', password='pw')
+        self.client.force_login(self.user)
+
+    def book(self, fare='100.00'):
+        quote = {'leg_fares': [Decimal(fare)], 'total': Decimal(fare)}
+        return create_booking(self.user, {'email': 'asha@example.com', 'phone': '9000000000'},
+                              [{'name': 'Asha Rao', 'age': 30, 'gender': 'F', 'seat_numbers': ['1A']}],
+                              'SLEEPER', timezone.localdate() + timedelta(days=3), [self.trip], quote)
+
+    def profile(self):
+        return UserProfile.objects.get(user=self.user)
+
+    def test_pagination(self):
+        for _ in range(12):
+            self.book()
+        pages = []
+        for page in (1, 2):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse('my_bookings'), {'page': page})
+            pages.append(len(queries))
+            self.assertEqual(len(response.context['bookings']), 10 if page == 1 else 2)
+        # Legs are prefetched: the query count does not grow with the page
+        self.assertEqual(pages[0], pages[1])
+        self.assertEqual(response.context['page_obj'].paginator.count, 12)
+        # Out-of-range pages show the last one
+        response = self.client.get(reverse('my_bookings'), {'page': 99})
+        self.assertEqual(response.context['page_obj'].number, 2)
+
+    def test_counters_follow_bookings_and_cancellations(self):
+        first = self.book('100.00')
+        self.book('250.00')
+        self.assertEqual((self.profile().total_bookings, self.profile().total_spent), (2, Decimal('350.00')))
+        for _ in range(2):
+            # A repeated submit cancels (and refunds) only once
+            self.client.post(reverse('cancel_booking', args=[first.pnr]))
+        self.assertEqual((self.profile().total_bookings, self.profile().total_spent), (1, Decimal('260.00')))
+
+    def test_backfill(self):
+        backfill = importlib.import_module('railway_app.migrations.0004_backfill_profile_counters')
+        self.booking(self.user, timezone.localdate(), total_fare='100.00')
+        self.booking(self.user, timezone.localdate(), total_fare='40.00')
+        self.booking(self.user, timezone.localdate(), total_fare='200.00', status='CANCELLED', refund_amount='180.00')
+        other = User.objects.create_user('other', password='pw')
+        self.booking(other, timezone.localdate(), total_fare='70.00', status='CANCELLED', refund_amount='63.00')
+        self.booking(None, timezone.localdate(), total_fare='500.00')
+        backfill.backfill_profile_counters(apps, None)
+        # Cancelled bookings keep the 10% that was not refunded
+        self.assertEqual((self.profile().total_bookings, self.profile().total_spent), (2, Decimal('160.00')))
+        profile = UserProfile.objects.get(user=other)
+        self.assertEqual((profile.total_bookings, profile.total_spent), (0, Decimal('7.00')))
+        self.assertEqual(UserProfile.objects.count(), 2)
+
+
+# ==================== Inventory Ledger ====================
+class InventoryLedgerTests(NetworkMixin, TestCase):
+    def setUp(self):
+        pnr_status.status_cache.clear()
+        self.addCleanup(pnr_status.status_cache.clear)
+        a, b = self.station('A'), self.station('B')
+        self.schedule_ = self.schedule('T1', a, b, time(8, 0), time(12, 0), seats=10)
+        self.user = User.objects.create_user('traveller', password='pw')
+
+    def seats(self):
+        return Schedule.objects.get(pk=self.schedule_.pk).sleeper_available
+
+    def book(self, count=1):
+        passengers = [{'name': f'Passenger {i}', 'age': 30, 'gender': 'F', 'seat_numbers': [f'{i}A']}
+                      for i in range(count)]
+        quote = fare_engine.quote([self.schedule_], 'SLEEPER', passengers=count)
+        return create_booking(self.user, {'email': 'asha@example.com', 'phone': '9000000000'}, passengers,
+                              'SLEEPER', timezone.localdate() + timedelta(days=3), [self.schedule_], quote)
+
+    def test_every_counter_change_is_ledgered(self):
+        booking = self.book(2)
+        token = SeatHold.place([self.schedule_], 'SLEEPER')
+        SeatHold.release(token)
+        schedule = Schedule.objects.get(pk=self.schedule_.pk)
+        schedule.sleeper_available += 5
+        schedule.save()
+        self.client.force_login(self.user)
+        self.client.post(reverse('cancel_booking', args=[booking.pnr]))
+
+        self.assertEqual(self.seats(), 15)
+        reasons = list(InventoryEntry.objects.filter(schedule=self.schedule_).values_list('reason', 'delta'))
+        self.assertEqual(reasons, [
+            (InventoryEntry.OPENING, 10), (InventoryEntry.BOOK, -2), (InventoryEntry.HOLD, -1),
+            (InventoryEntry.RELEASE, 1), (InventoryEntry.ADJUST, 5), (InventoryEntry.CANCEL, 2),
+        ])
+        self.assertEqual(InventoryEntry.reconcile(), [])
+
+    def test_drift_is_found_and_repaired(self):
+        self.book(3)
+        # A bulk update bypasses the ledger
+        Schedule.objects.filter(pk=self.schedule_.pk).update(sleeper_available=9)
+        self.assertEqual(InventoryEntry.reconcile(), [(self.schedule_.pk, 'SLEEPER', 9, 7, 7)])
+        InventoryEntry.reconcile(repair=True)
+        self.assertEqual(self.seats(), 7)
+        self.assertEqual(InventoryEntry.reconcile(), [])
+
+    def test_snapshot_balances(self):
+        self.book(2)
+        # Entries inside the settle window are left to the tail
+        self.assertEqual(InventorySnapshot.take(), (0, 0))
+        settled = timezone.now() - timedelta(seconds=InventorySnapshot.SETTLE_SECONDS + 1)
+        InventoryEntry.objects.update(created_at=settled)
+        through, rows = InventorySnapshot.take()
+        self.assertEqual(through, InventoryEntry.objects.latest('id').id)
+        # Only pairs with entries (zero opening balances are not ledgered)
+        self.assertEqual(rows, 1)
+        self.assertEqual(InventorySnapshot.balances_through(through)[(self.schedule_.pk, 'SLEEPER')], 8)
+
+        # Later entries are added from the tail on top of the snapshot
+        SeatHold.place([self.schedule_], 'SLEEPER', seats=3)
+        self.assertEqual(InventorySnapshot.balances()[(self.schedule_.pk, 'SLEEPER')], self.seats())
+        self.assertEqual(InventorySnapshot.balances([self.schedule_.pk])[(self.schedule_.pk, 'SLEEPER')], 5)
+        self.assertEqual(InventoryEntry.reconcile(), [])
+
+    def test_old_snapshot_sets_are_dropped(self):
+        for _ in range(3):
+            self.book()
+            InventoryEntry.objects.update(created_at=timezone.now() - timedelta(hours=1))
+            InventorySnapshot.take(keep=2)
+        self.assertEqual(InventorySnapshot.objects.values('through_entry').distinct().count(), 2)
+        self.assertEqual(InventorySnapshot.balances()[(self.schedule_.pk, 'SLEEPER')], self.seats())
+
+
+# ==================== Booking Archive ====================
+class BookingArchiveTests(NetworkMixin, TestCase):
+    def setUp(self):
+        pnr_status.status_cache.clear()
+        self.addCleanup(pnr_status.status_cache.clear)
+        a, b, c = self.station('A'), self.station('B'), self.station('C')
+        self.legs = [self.schedule('T1', a, b, time(8, 0), time(12, 0)), self.schedule('T2', b, c, time(14, 0), time(18, 0))]
+        self.user = User.objects.create_user('traveller', password='pw')
+        passengers = [
+            {'name': 'Asha Rao', 'age': 30, 'gender': 'F', 'seat_numbers': ['1A', '2A']},
+            {'name': 'Ravi Rao', 'age': 32, 'gender': 'M', 'seat_numbers': ['1B', '2B']},
+        ]
+        quote = fare_engine.quote(self.legs, 'SLEEPER', passengers=2)
+        self.booking = create_booking(self.user, {'email': 'asha@example.com', 'phone': '9000000000'}, passengers,
+                                      'SLEEPER', timezone.localdate() - timedelta(days=200), self.legs, quote)
+
+    def archive(self):
+        return ArchivedBooking.archive_before(timezone.localdate() - timedelta(days=180))
+
+    def test_round_trip(self):
+        pnr = self.booking.pnr
+        status = pnr_status.get_statuses([pnr])[pnr]
+        claims = ticket_tokens.booking_claims(self.booking)
+        pnr_status.status_cache.clear()
+
+        self.assertEqual(self.archive(), 1)
+        self.assertFalse(Booking.objects.exists())
+        archived = ArchivedBooking.objects.get(pnr=pnr)
+        self.assertEqual(archived.legs.count(), 2)
+        self.assertEqual([p.name for p in archived.passenger_list()], ['Asha Rao', 'Ravi Rao'])
+        self.assertEqual(pnr_status.get_statuses([pnr])[pnr], status)
+        self.assertEqual(ticket_tokens.booking_claims(archived), claims)
+        # Archived seats still count against the schedules
+        self.assertEqual(InventoryEntry.reconcile(), [])
+        self.assertEqual(self.archive(), 0)
+
+    def test_recent_bookings_stay(self):
+        Booking.objects.update(journey_date=timezone.localdate())
+        self.assertEqual(self.archive(), 0)
+        self.assertFalse(ArchivedBooking.objects.exists())
+
+    def test_archived_ticket_pages(self):
+        pnr = self.booking.pnr
+        for archived in (False, True):
+            if archived:
+                self.archive()
+            response = self.client.get(reverse('confirmation'), {'pnr': pnr})
+            self.assertContains(response, 'Ravi Rao')
+            self.assertEqual(self.client.get(reverse('download_ticket', args=[pnr])).status_code, 200)
+        response = self.client.get(reverse('confirmation'), {'pnr': pnr})
+        self.assertContains(response, 'T1')
+        self.assertContains(response, 'Ravi Rao')
+        response = self.client.get(reverse('download_ticket', args=[pnr]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertEqual(self.client.get(reverse('download_ticket', args=['NOSUCHPNR'])).status_code, 404)
+
+
+# ==================== Search Coalescing ====================
+class CoalesceFileTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def files(self):
+        return sorted(os.listdir(self.directory))
+
+    def age(self, name, seconds):
+        path = os.path.join(self.directory, name)
+        old = time_module.time() - seconds
+        os.utime(path, (old, old))
+
+    def test_idle_lock_files_are_swept(self):
+        with self.settings(SEARCH_COALESCE_DIR=self.directory, SEARCH_COALESCE_MAX_AGE_SECONDS=60):
+            self.assertEqual(coalesce.shared_call(('search', 1), lambda: {'ok': 1}), {'ok': 1})
+            self.assertEqual(coalesce.shared_call(('search', 2), lambda: {'ok': 2}), {'ok': 2})
+        idle, fresh = self.files()
+        self.age(idle, 120)
+        self.assertEqual(coalesce.sweep(self.directory, 60), 1)
+        self.assertEqual(self.files(), [fresh])
+
+    def test_held_lock_files_are_kept(self):
+        with self.settings(SEARCH_COALESCE_DIR=self.directory):
+            coalesce.shared_call(('search', 1), lambda: [])
+        name, = self.files()
+        self.age(name, 120)
+        with open(os.path.join(self.directory, name), 'a+') as f:
+            coalesce.fcntl.flock(f.fileno(), coalesce.fcntl.LOCK_EX)
+            self.assertEqual(coalesce.sweep(self.directory, 60), 0)
+        self.assertEqual(self.files(), [name])
+
+    def test_leaders_sweep(self):
+        with self.settings(SEARCH_COALESCE_DIR=self.directory, SEARCH_COALESCE_MAX_AGE_SECONDS=0):
+            self.assertEqual(coalesce.shared_call(('search', 1), lambda: [1]), [1])
+        # Past max age as soon as it is written, the leader's own file goes too
+        self.assertEqual(self.files(), [])
+
+
+# ==================== SQLite Tuning ====================
+class SQLitePragmaTests(TestCase):
+    def test_wal_is_opt_in(self):
+        with self.settings(SQLITE_WAL=False):
+            self.assertNotIn('journal_mode', sqlite_pragmas())
+        with self.settings(SQLITE_WAL=True):
+            pragmas = sqlite_pragmas()
+            self.assertEqual(list(pragmas)[:2], ['journal_mode', 'synchronous'])
+            self.assertEqual(pragmas['journal_mode'], 'WAL')
+        with self.settings(SQLITE_WAL=True, SQLITE_PRAGMAS={}):
+            self.assertEqual(sqlite_pragmas(), {})
+
+
+# ==================== Database Routing ====================
+@mock.patch('railway_project.db_router.replica_available', return_value=True)
+class DatabaseRouterTests(TestCase):
+    router = db_router.PrimaryReplicaRouter()
+
+    def read_alias(self):
+        return self.router.db_for_read(Station)
+
+    def test_routing_decision(self, replica_available):
+        self.assertEqual(self.read_alias(), 'default')
+        with db_router.replica_scope():
+            self.assertEqual(self.read_alias(), 'replica')
+            # Archived bookings never go to the replica
+            self.assertEqual(self.router.db_for_read(ArchivedBooking), db_router.archive_alias())
+            with db_router.primary_scope():
+                self.assertEqual(self.read_alias(), 'default')
+                self.router.db_for_write(SeatHold)
+            # Housekeeping writes in a primary scope do not pin the request
+            self.assertEqual(self.read_alias(), 'replica')
+            self.assertEqual(self.router.db_for_write(Booking), 'default')
+            # After its own write, the request reads its writes from the primary
+            self.assertEqual(self.read_alias(), 'default')
+        self.assertFalse(self.router.allow_migrate('replica', 'railway_app', 'station'))
+        self.assertTrue(self.router.allow_migrate('default', 'railway_app', 'station'))
+
+    def test_sticky_cookie_after_write(self, replica_available):
+        seen = []
+
+        def view(request, write=False):
+            with db_router.replica_scope():
+                if write:
+                    self.router.db_for_write(Booking)
+                seen.append(self.read_alias())
+            return HttpResponse()
+
+        factory = RequestFactory()
+        response = db_router.StickyPrimaryMiddleware(view)(factory.get('/'))
+        self.assertNotIn(db_router.STICKY_COOKIE, response.cookies)
+        response = db_router.StickyPrimaryMiddleware(lambda request: view(request, write=True))(factory.post('/'))
+        cookie = response.cookies[db_router.STICKY_COOKIE]
+        self.assertEqual(cookie['max-age'], settings.REPLICA_STICKY_SECONDS)
+        self.assertGreater(float(cookie.value), time_module.time())
+
+        # The client's next requests stay on the primary until the window ends
+        request = factory.get('/')
+        request.COOKIES[db_router.STICKY_COOKIE] = cookie.value
+        db_router.StickyPrimaryMiddleware(view)(request)
+        request = factory.get('/')
+        request.COOKIES[db_router.STICKY_COOKIE] = str(time_module.time() - 1)
+        db_router.StickyPrimaryMiddleware(view)(request)
+        self.assertEqual(seen, ['replica', 'default', 'default', 'replica'])
+
+    @override_settings(SEARCH_EXECUTOR_WORKERS=2)
+    def test_scope_reaches_search_executor(self, replica_available):
+        async def search():
+            with db_router.replica_scope():
+                return await run_in_search_executor(self.read_alias)
+
+        self.assertEqual(async_to_sync(search)(), 'replica')
+        self.assertEqual(async_to_sync(run_in_search_executor)(self.read_alias), 'default')
+
+
+# ==================== Admin ====================
+class AdminChangelistTests(NetworkMixin, TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'pw'))
+        self.a, self.b = self.station('A'), self.station('B')
+
+    def changelist(self, model, **params):
+        return self.client.get(reverse(f'admin:railway_app_{model}_changelist'), params)
+
+    def test_changelist_queries_are_bounded(self):
+        self.schedule('T1', self.a, self.b, time(8, 0), time(12, 0))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.changelist('schedule').status_code, 200)
+        for number in range(2, 12):
+            self.schedule(f'T{number}', self.a, self.b, time(8, 0), time(12, 0))
+        # Related rows come from select_related, not one query per schedule
+        with self.assertNumQueries(len(queries)):
+            response = self.changelist('schedule')
+        self.assertEqual(len(response.context['cl'].result_list), 11)
+
+    def test_input_filter(self):
+        self.schedule('T1', self.a, self.b, time(8, 0), time(12, 0))
+        self.schedule('T2', self.b, self.a, time(14, 0), time(18, 0))
+        response = self.changelist('schedule', train_number='t2')
+        self.assertEqual([s.route.train.train_number for s in response.context['cl'].result_list], ['T2'])
+        response = self.changelist('route', source_code='b', destination_code='A')
+        self.assertEqual([r.train.train_number for r in response.context['cl'].result_list], ['T2'])
+
+    def test_estimated_count_on_large_unfiltered_tables(self):
+        user = User.objects.create_user('traveller', password='pw')
+        for _ in range(3):
+            self.booking(user, timezone.localdate())
+        queryset = Booking.objects.order_by('pk')
+        top = queryset.last().pk
+        Booking.objects.filter(pk__lt=top).delete()
+        with mock.patch.object(railway_admin, 'ESTIMATED_COUNT_THRESHOLD', 1):
+            # Unfiltered: highest id on SQLite instead of COUNT(*)
+            self.assertEqual(railway_admin.EstimatedCountPaginator(queryset, 25).count, top)
+            filtered = queryset.filter(status='CONFIRMED')
+            self.assertEqual(railway_admin.EstimatedCountPaginator(filtered, 25).count, 1)
+        self.assertEqual(railway_admin.EstimatedCountPaginator(queryset, 25).count, 1)
+
+    def test_bulk_actions_log_timetable_changes(self):
+        schedules = [self.schedule(f'T{n}', self.a, self.b, time(8, 0), time(12, 0)) for n in range(3)]
+        ids = [schedule.id for schedule in schedules[:2]]
+        TimetableChange.objects.all().delete()
+        url = reverse('admin:railway_app_schedule_changelist')
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            response = self.client.post(url, {'action': 'deactivate_selected', '_selected_action': ids})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(list(Schedule.objects.filter(is_active=False).order_by('id').values_list('id', flat=True)), ids)
+        changes = TimetableChange.objects.values_list('model_name', 'object_id', 'action')
+        self.assertEqual(sorted(changes), [('schedule', id_, TimetableChange.SAVE) for id_ in ids])
+
+        TimetableChange.objects.all().delete()
+        train_ids = [schedules[2].route.train_id]
+        self.client.post(reverse('admin:railway_app_train_changelist'),
+                         {'action': 'deactivate_selected', '_selected_action': train_ids})
+        self.client.post(reverse('admin:railway_app_train_changelist'),
+                         {'action': 'activate_selected', '_selected_action': train_ids})
+        self.assertTrue(Train.objects.get(pk=train_ids[0]).is_active)
+        self.assertEqual(list(TimetableChange.objects.values_list('model_name', 'object_id')),
+                         [('train', train_ids[0])] * 2)
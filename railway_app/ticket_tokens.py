@@ -0,0 +1,188 @@
+"""
+Signed ticket tokens that checkers verify offline.
+
+A token is "T2.<key id>.<payload>.<signature>", with the payload (PNR, journey
+date, class, passenger count and a [train, from, to, seat] entry per leg, as
+compact sorted-key JSON, so no field value can pass for a separator) and a
+truncated HMAC-SHA256 of it, both base64url-encoded. Verifying needs only the
+signing keys (TICKET_SIGNING_KEYS) and a revocation list of cancelled PNRs; no
+database access. The key id lets keys rotate while old tickets still verify.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+from collections import namedtuple
+from datetime import datetime
+
+from django.conf import settings
+from django.utils.crypto import salted_hmac
+
+VERSION = 'T2'
+KEY_SALT = 'railway_app.ticket_tokens'
+SIGNATURE_BYTES = 16
+
+TicketClaims = namedtuple('TicketClaims', 'pnr journey_date seat_class passenger_count legs')
+TicketLeg = namedtuple('TicketLeg', 'train_number source destination seat_number')
+
+
+class InvalidTicket(Exception):
+    """Raised by verify() with the reason a token is not a valid ticket"""
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def _mac(key, message):
+    return hmac.new(key.encode('utf-8'), message, hashlib.sha256).digest()[:SIGNATURE_BYTES]
+
+
+def signing_keys():
+    """TICKET_SIGNING_KEYS, with keys left unset derived from SECRET_KEY per key id"""
+    return {
+        key_id: key or salted_hmac(KEY_SALT, key_id).hexdigest()
+        for key_id, key in settings.TICKET_SIGNING_KEYS.items()
+    }
+
+
+# ==================== Signing ====================
+def encode_claims(claims):
+    return json.dumps({
+        'pnr': claims.pnr,
+        'date': claims.journey_date.isoformat(),
+        'class': claims.seat_class,
+        'count': claims.passenger_count,
+        'legs': [list(leg) for leg in claims.legs],
+    }, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def decode_claims(payload):
+    data = json.loads(payload.decode('utf-8'))
+    if not isinstance(data['count'], int) or not all(isinstance(leg, list) and len(leg) == 4 for leg in data['legs']):
+        raise ValueError('bad claims')
+    return TicketClaims(
+        data['pnr'],
+        datetime.strptime(data['date'], '%Y-%m-%d').date(),
+        data['class'],
+        data['count'],
+        tuple(TicketLeg(*map(str, leg)) for leg in data['legs']),
+    )
+
+
+def sign(claims, key_id=None):
+    """Token for the claims, signed with key_id (default TICKET_SIGNING_KEY_ID)"""
+    key_id = key_id or settings.TICKET_SIGNING_KEY_ID
+    payload = _b64encode(encode_claims(claims))
+    message = f'{VERSION}.{key_id}.{payload}'
+    return f'{message}.{_b64encode(_mac(signing_keys()[key_id], message.encode("ascii")))}'
+
+
+def booking_claims(booking):
+    """Claims for a booking (reads its legs with their routes), or for an ArchivedBooking"""
+    from .models import ArchivedBooking
+
+    if isinstance(booking, ArchivedBooking):
+        legs = tuple(
+            TicketLeg(leg.train_number, leg.source_code, leg.destination_code, leg.seat_number)
+            for leg in booking.legs.all()
+        )
+    else:
+        legs = tuple(
+            TicketLeg(leg.route.train.train_number, leg.route.source.code, leg.route.destination.code,
+                      leg.seat_number)
+            for leg in booking.legs.all()
+        )
+    return TicketClaims(booking.pnr, booking.journey_date, booking.seat_class, booking.passenger_count, legs)
+
+
+def ticket_token(booking):
+    return sign(booking_claims(booking))
+
+
+# ==================== Verification ====================
+class RevocationList:
+    """Cancelled PNRs, as synced from api/tickets/revoked/ or export_revoked_tickets"""
+
+    def __init__(self, pnrs=(), synced_at=None):
+        self.pnrs = set(pnrs)
+        self.synced_at = synced_at
+
+    def __contains__(self, pnr):
+        return pnr in self.pnrs
+
+    def merge(self, data):
+        """Add a sync response ({'synced_at': ..., 'pnrs': [...]})"""
+        self.pnrs.update(data['pnrs'])
+        self.synced_at = data['synced_at']
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(data['pnrs'], data.get('synced_at'))
+
+    def save(self, path):
+        """Write the list atomically, so checkers never read a half-written file"""
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'synced_at': self.synced_at, 'pnrs': sorted(self.pnrs)}, f)
+        os.replace(tmp_path, path)
+
+
+def verify(token, keys=None, revoked=None, on_date=None):
+    """
+    Claims of a valid token; raises InvalidTicket otherwise. With on_date, a ticket
+    for another journey date is rejected as well.
+    """
+    keys = signing_keys() if keys is None else keys
+    try:
+        version, key_id, payload, signature = token.strip().split('.')
+    except ValueError:
+        raise InvalidTicket('malformed token')
+    if version != VERSION:
+        raise InvalidTicket(f'unsupported token version {version}')
+    key = keys.get(key_id)
+    if key is None:
+        raise InvalidTicket(f'unknown signing key {key_id}')
+    try:
+        expected = _mac(key, f'{version}.{key_id}.{payload}'.encode('ascii'))
+        if not hmac.compare_digest(expected, _b64decode(signature)):
+            raise InvalidTicket('bad signature')
+        claims = decode_claims(_b64decode(payload))
+    except (ValueError, TypeError, KeyError, UnicodeError):
+        raise InvalidTicket('malformed token')
+    if revoked is not None and claims.pnr in revoked:
+        raise InvalidTicket('ticket cancelled')
+    if on_date is not None and claims.journey_date != on_date:
+        raise InvalidTicket(f'ticket is for {claims.journey_date.isoformat()}')
+    return claims
+
+
+def revoked_since(since=None):
+    """
+    Sync payload of PNRs cancelled after `since` (an aware datetime), for checkers.
+
+    A cancellation is stamped before its transaction commits, so it can become
+    visible after a sync that already passed its timestamp. Each sync therefore
+    re-reads the last TICKET_REVOCATION_OVERLAP_SECONDS before `since` as well;
+    checkers merge the PNRs into a set, so repeats are harmless.
+    """
+    from datetime import timedelta
+    from django.utils import timezone
+    from .models import Booking
+
+    synced_at = timezone.now()
+    cancelled = Booking.objects.filter(status='CANCELLED', cancellation_date__isnull=False)
+    if since is not None:
+        overlap = timedelta(seconds=getattr(settings, 'TICKET_REVOCATION_OVERLAP_SECONDS', 300))
+        cancelled = cancelled.filter(cancellation_date__gt=since - overlap)
+    return {
+        'synced_at': synced_at.isoformat(),
+        'pnrs': list(cancelled.order_by('cancellation_date').values_list('pnr', flat=True)),
+    }
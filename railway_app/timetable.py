@@ -0,0 +1,560 @@
+"""
+Read-only, array-backed timetable snapshot and the connecting-train planner
+that runs on it.
+
+Schedules are stored column-wise in int32 arrays sorted by source station, with
+CSR-style offsets (out_start) so "departures from station X" is a slice. Arrays
+rather than lists of objects keep the snapshot compact and, because their pages
+are never touched by refcounting, let forked pool workers share the parent's
+copy instead of duplicating it.
+
+The snapshot can also be compiled to a versioned binary file (compile_timetable)
+laid out as the same int32 columns plus a string table. Timetable.load() maps it
+read-only, so a worker starts without touching the ORM and every worker on the
+host shares one copy of the pages through the OS page cache. Snapshots carry the
+TimetableChange version they were built at; when it moves, a new snapshot is built
+from the old one plus the changed rows (patched()).
+"""
+import mmap
+import multiprocessing
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+from array import array
+
+from django.conf import settings
+from django.db.models import Q
+
+MINUTES_PER_DAY = 24 * 60
+
+
+# ==================== Timetable Snapshot ====================
+class Timetable:
+    COLUMNS = ('schedule_id', 'route_id', 'train_id', 'src', 'dst', 'dep_min', 'arr_min', 'weekdays', 'distance',
+               'fare_paise')
+    # Per-station columns, and per-row references into the string table
+    STATION_COLUMNS = ('station_ids', 'station_code', 'station_name', 'out_start')
+    LABEL_COLUMNS = ('train_number', 'train_name')
+
+    def __init__(self, station_ids, rows, station_labels=None, train_labels=None, version=0):
+        """
+        station_ids: iterable of Station ids.
+        rows: iterables of (schedule_id, route_id, train_id, source_id, destination_id,
+              dep_min, arr_min, weekday_mask, distance, fare_paise) for active schedules.
+        station_labels / train_labels: optional {id: (code, name)} / {id: (number, name)}.
+        version: timetable version (TimetableChange) the rows were read at.
+        """
+        self.version = version
+        self.station_ids = array('i', station_ids)
+        self.station_index = {sid: idx for idx, sid in enumerate(self.station_ids)}
+        self.strings = ['']
+        interned = {'': 0}
+
+        def intern(text):
+            if text not in interned:
+                interned[text] = len(self.strings)
+                self.strings.append(text)
+            return interned[text]
+
+        station_labels = station_labels or {}
+        train_labels = train_labels or {}
+        self.station_code = array('i', (intern(station_labels.get(sid, ('', ''))[0]) for sid in self.station_ids))
+        self.station_name = array('i', (intern(station_labels.get(sid, ('', ''))[1]) for sid in self.station_ids))
+
+        ordered = sorted(
+            ((self.station_index[r[3]], r[8], r[1], r[5], r) for r in rows),
+            key=lambda item: item[:4],
+        )
+        for name in self.COLUMNS + self.LABEL_COLUMNS:
+            setattr(self, name, array('i'))
+        for src, _, _, _, r in ordered:
+            self.schedule_id.append(r[0])
+            self.route_id.append(r[1])
+            self.train_id.append(r[2])
+            self.src.append(src)
+            self.dst.append(self.station_index[r[4]])
+            self.dep_min.append(r[5])
+            self.arr_min.append(r[6])
+            self.weekdays.append(r[7])
+            self.distance.append(r[8])
+            self.fare_paise.append(r[9])
+            number, train_name = train_labels.get(r[2], ('', ''))
+            self.train_number.append(intern(number))
+            self.train_name.append(intern(train_name))
+
+        # out_start[i]:out_start[i + 1] are the rows departing station index i
+        self.out_start = array('i', [0] * (len(self.station_ids) + 1))
+        for src in self.src:
+            self.out_start[src + 1] += 1
+        for idx in range(len(self.station_ids)):
+            self.out_start[idx + 1] += self.out_start[idx]
+
+    def __len__(self):
+        return len(self.schedule_id)
+
+    def station_label(self, station_idx):
+        """(code, name) of a station index"""
+        return self.strings[self.station_code[station_idx]], self.strings[self.station_name[station_idx]]
+
+    def train_label(self, row):
+        """(train number, train name) of a row"""
+        return self.strings[self.train_number[row]], self.strings[self.train_name[row]]
+
+    @staticmethod
+    def _schedule_rows(schedules):
+        """Snapshot rows for the active schedules in a Schedule queryset"""
+        schedules = schedules.filter(is_active=True, route__is_active=True).exclude(runs_on='').values_list(
+            'id', 'route_id', 'route__train_id', 'route__source_id', 'route__destination_id',
+            'departure_time', 'arrival_time', 'runs_on', 'route__distance', 'route__base_fare_per_km',
+        )
+        return [
+            (sid, rid, tid, src, dst,
+             dep.hour * 60 + dep.minute, arr.hour * 60 + arr.minute, weekday_mask(runs_on), distance,
+             int(round(distance * per_km * 100)))
+            for sid, rid, tid, src, dst, dep, arr, runs_on, distance, per_km in schedules.iterator()
+        ]
+
+    @staticmethod
+    def _station_labels():
+        from .models import Station
+
+        stations = Station.objects.order_by('id').values_list('id', 'code', 'name')
+        return {sid: (code, name) for sid, code, name in stations}
+
+    @classmethod
+    def from_db(cls):
+        """Snapshot active stations, routes and schedules"""
+        from .models import Train, Schedule, TimetableChange
+
+        # Read the version first: a change committed mid-build is picked up by the next check
+        version = TimetableChange.current_version()
+        station_labels = cls._station_labels()
+        train_labels = {tid: (number, name) for tid, number, name in
+                        Train.objects.values_list('id', 'train_number', 'train_name')}
+        rows = cls._schedule_rows(Schedule.objects.all())
+        return cls(list(station_labels), rows, station_labels, train_labels, version)
+
+    # Change log models the snapshot is built from (schedule exceptions are applied per search)
+    SOURCE_MODELS = ('station', 'train', 'route', 'schedule')
+
+    def patched(self, changed, version):
+        """
+        New snapshot at `version` with the schedules touched by `changed` (changes_since()
+        ids per model) re-read from the DB; the other rows are copied from this one.
+        """
+        from .models import Train, Schedule
+
+        schedule_ids = changed.get('schedule', set())
+        route_ids = changed.get('route', set())
+        train_ids = changed.get('train', set())
+        if 'station' in changed:
+            station_labels = self._station_labels()
+        else:
+            station_labels = {sid: self.station_label(idx) for idx, sid in enumerate(self.station_ids)}
+        train_labels = {}
+        rows = []
+        for r in range(len(self)):
+            if (self.schedule_id[r] in schedule_ids or self.route_id[r] in route_ids
+                    or self.train_id[r] in train_ids):
+                continue
+            rows.append((self.schedule_id[r], self.route_id[r], self.train_id[r], self.station_ids[self.src[r]],
+                         self.station_ids[self.dst[r]], self.dep_min[r], self.arr_min[r], self.weekdays[r],
+                         self.distance[r], self.fare_paise[r]))
+            train_labels[self.train_id[r]] = self.train_label(r)
+        fresh = self._schedule_rows(Schedule.objects.filter(
+            Q(id__in=schedule_ids) | Q(route_id__in=route_ids) | Q(route__train_id__in=train_ids)
+        ))
+        rows += [row for row in fresh if row[3] in station_labels and row[4] in station_labels]
+        wanted = {row[2] for row in fresh} - train_labels.keys()
+        train_labels.update((tid, (number, name)) for tid, number, name in
+                            Train.objects.filter(id__in=wanted).values_list('id', 'train_number', 'train_name'))
+        return type(self)(list(station_labels), rows, station_labels, train_labels, version)
+
+    # ==================== Binary Snapshot ====================
+    # Layout: header, section directory, then 8-byte aligned sections. Every section
+    # but 'strblob' is little-endian int32; 'stroff' holds string offsets into 'strblob'.
+    MAGIC = b'RTTB'
+    FORMAT_VERSION = 2
+    _HEADER = struct.Struct('<4sIIQ')     # magic, format version, section count, timetable version
+    _SECTION = struct.Struct('<12sQQ')    # name, byte offset, byte length
+
+    def save(self, path):
+        """Write the snapshot atomically (readers mapping the old file keep their copy)"""
+        blobs = [text.encode('utf-8') for text in self.strings]
+        offsets = array('i', [0])
+        for blob in blobs:
+            offsets.append(offsets[-1] + len(blob))
+        sections = [(name, getattr(self, name)) for name in self.STATION_COLUMNS + self.COLUMNS + self.LABEL_COLUMNS]
+        sections += [('stroff', offsets), ('strblob', b''.join(blobs))]
+
+        payloads = []
+        for name, data in sections:
+            if isinstance(data, array) and sys.byteorder != 'little':
+                data = array('i', data)
+                data.byteswap()
+            payloads.append((name, bytes(data)))
+
+        position = self._HEADER.size + self._SECTION.size * len(payloads)
+        directory = []
+        for name, payload in payloads:
+            position += -position % 8
+            directory.append((name, position, len(payload)))
+            position += len(payload)
+
+        directory_dir = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory_dir, prefix='.timetable-')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                out.write(self._HEADER.pack(self.MAGIC, self.FORMAT_VERSION, len(payloads), self.version))
+                for name, offset, length in directory:
+                    out.write(self._SECTION.pack(name.encode('ascii'), offset, length))
+                for (name, offset, _), (_, payload) in zip(directory, payloads):
+                    out.write(b'\0' * (offset - out.tell()))
+                    out.write(payload)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        """
+        Map a compiled snapshot read-only; columns are views onto the shared pages.
+        Raises ValueError for a file that is not a complete snapshot of this format.
+        """
+        with open(path, 'rb') as f:
+            try:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise ValueError(f"{path} is empty")
+        try:
+            magic, version, count, timetable_version = cls._HEADER.unpack_from(mapped, 0)
+            if magic != cls.MAGIC:
+                raise ValueError(f"{path} is not a timetable snapshot")
+            if version != cls.FORMAT_VERSION:
+                raise ValueError(f"{path} has snapshot format {version}, expected {cls.FORMAT_VERSION}")
+
+            view = memoryview(mapped)
+            sections = {}
+            for i in range(count):
+                name, offset, length = cls._SECTION.unpack_from(mapped, cls._HEADER.size + i * cls._SECTION.size)
+                if offset + length > len(mapped):
+                    raise ValueError(f"{path} is truncated")
+                sections[name.rstrip(b'\0').decode('ascii')] = view[offset:offset + length]
+
+            def column(name):
+                if sys.byteorder == 'little':
+                    return sections[name].cast('i')
+                # Big-endian hosts pay for a private, byte-swapped copy
+                data = array('i', sections[name].tobytes())
+                data.byteswap()
+                return data
+
+            tt = cls.__new__(cls)
+            tt.version = timetable_version
+            for name in cls.STATION_COLUMNS + cls.COLUMNS + cls.LABEL_COLUMNS:
+                setattr(tt, name, column(name))
+            tt.strings = StringTable(column('stroff'), sections['strblob'])
+        except (struct.error, KeyError, TypeError, UnicodeDecodeError) as e:
+            raise ValueError(f"{path} is not a valid timetable snapshot: {e!r}")
+        stations, rows = len(tt.station_ids), len(tt.schedule_id)
+        if (any(len(getattr(tt, name)) != stations for name in cls.STATION_COLUMNS[:-1])
+                or len(tt.out_start) != stations + 1
+                or any(len(getattr(tt, name)) != rows for name in cls.COLUMNS + cls.LABEL_COLUMNS)):
+            raise ValueError(f"{path} has columns of inconsistent length")
+        tt.station_index = {sid: idx for idx, sid in enumerate(tt.station_ids)}
+        tt._mapped = mapped
+        return tt
+
+    def departures(self, station_idx):
+        return range(self.out_start[station_idx], self.out_start[station_idx + 1])
+
+    def first_leg_rows(self, source_idx, dest_idx, weekday):
+        """Rows leaving the source on this weekday towards any station but the destination"""
+        bit = 1 << weekday
+        return [r for r in self.departures(source_idx) if self.weekdays[r] & bit and self.dst[r] != dest_idx]
+
+    def connecting(self, first_rows, dest_idx, weekday, min_buffer, available, suspended=frozenset()):
+        """
+        For each first-leg row, pick the second leg into dest_idx with the earliest
+        arrival (same rules as views.schedule_legs). Only schedule ids in `available`
+        are considered, and none in `suspended`, a set of (schedule_id, day offset
+        from the journey date) pairs. Returns (first_id, second_id, buffer_minutes,
+        arrival_minutes_from_journey_midnight) tuples.
+        """
+        schedule_id, dst, dep_min, arr_min, weekdays = (
+            self.schedule_id, self.dst, self.dep_min, self.arr_min, self.weekdays
+        )
+        results = []
+        for r in first_rows:
+            if schedule_id[r] not in available:
+                continue
+            # Overnight first legs arrive the next day
+            first_arrival = arr_min[r]
+            if first_arrival <= dep_min[r]:
+                first_arrival += MINUTES_PER_DAY
+            arrival_day = first_arrival // MINUTES_PER_DAY * MINUTES_PER_DAY
+            best = None
+            for s in self.departures(dst[r]):
+                if dst[s] != dest_idx or schedule_id[s] not in available:
+                    continue
+                # The next departure after the first leg arrives
+                second_departure = arrival_day + dep_min[s]
+                if second_departure <= first_arrival:
+                    second_departure += MINUTES_PER_DAY
+                day_offset = second_departure // MINUTES_PER_DAY
+                if not weekdays[s] & (1 << ((weekday + day_offset) % 7)):
+                    continue
+                if (schedule_id[s], day_offset) in suspended:
+                    continue
+                buffer_minutes = second_departure - first_arrival
+                if buffer_minutes < min_buffer:
+                    continue
+                second_arrival = second_departure - dep_min[s] + arr_min[s]
+                if second_arrival <= second_departure:
+                    second_arrival += MINUTES_PER_DAY
+                if best is None or second_arrival < best[3]:
+                    best = (schedule_id[r], schedule_id[s], buffer_minutes, second_arrival)
+            if best:
+                results.append(best)
+        return results
+
+
+class StringTable:
+    """Read-only string table over an offsets column and a UTF-8 blob"""
+
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        return bytes(self.blob[self.offsets[index]:self.offsets[index + 1]]).decode('utf-8')
+
+
+def weekday_mask(runs_on):
+    """'0246' -> bitmask with bits 0, 2, 4, 6 set"""
+    mask = 0
+    for ch in runs_on:
+        if ch.isdigit() and int(ch) < 7:
+            mask |= 1 << int(ch)
+    return mask
+
+
+# ==================== Version Polling ====================
+# Every cache built from the timetable (this snapshot, fare tables) records the
+# TimetableChange version it was built at. latest_version() asks the database at
+# most once per TIMETABLE_VERSION_POLL_SECONDS per process, so "has it moved?" is
+# usually a clock read.
+_version_seen = 0
+_version_checked_at = None
+
+
+def latest_version():
+    """Newest timetable version, re-read from the DB at most once per poll interval"""
+    global _version_seen, _version_checked_at
+    now = time.monotonic()
+    interval = getattr(settings, 'TIMETABLE_VERSION_POLL_SECONDS', 2)
+    if _version_checked_at is None or now - _version_checked_at >= interval:
+        from .models import TimetableChange
+
+        _version_seen = TimetableChange.current_version()
+        _version_checked_at = now
+    return _version_seen
+
+
+def expire_version_check():
+    """Make the next latest_version() call hit the DB (after this process commits a change)"""
+    global _version_checked_at
+    _version_checked_at = None
+
+
+# ==================== Shared Snapshot ====================
+# _timetable is replaced, never changed in place, so a search keeps a consistent
+# snapshot; _checked_version is the newest version it is known to be current for
+_lock = threading.Lock()
+_timetable = None
+_checked_version = 0
+_pool = None
+
+
+def snapshot_path():
+    return getattr(settings, 'TIMETABLE_SNAPSHOT_PATH', None)
+
+
+def _updated(tt, version):
+    """(snapshot, version) with the changes after `version` applied to `tt`"""
+    from .models import TimetableChange
+
+    changes = TimetableChange.changes_since(version)
+    if changes is None:
+        tt = Timetable.from_db()
+        return tt, tt.version
+    version, changed = changes
+    if any(model_name in changed for model_name in Timetable.SOURCE_MODELS):
+        tt = tt.patched(changed, version)
+    return tt, version
+
+
+def get_timetable():
+    """
+    Process-wide timetable snapshot. It starts from the compiled file (or the DB)
+    and, when the timetable version moves, the changed schedules are patched in
+    under _lock by one thread; changes that do not touch the snapshot (schedule
+    exceptions) only advance the checked version.
+    """
+    global _timetable, _checked_version
+    tt = _timetable
+    if tt is None or _checked_version < latest_version():
+        with _lock:
+            if _timetable is None:
+                loaded = None
+                path = snapshot_path()
+                if path and os.path.exists(path):
+                    try:
+                        loaded = Timetable.load(path)
+                    except (OSError, ValueError):
+                        pass  # Unreadable or corrupt: build from the DB; compile_timetable rewrites it
+                if loaded is None:
+                    loaded = Timetable.from_db()
+                _timetable, _checked_version = _updated(loaded, loaded.version)
+            elif _checked_version < latest_version():
+                _timetable, _checked_version = _updated(_timetable, _checked_version)
+            tt = _timetable
+    return tt
+
+
+def compile_snapshot(path=None):
+    """Build the timetable from the DB and write it to `path` (default TIMETABLE_SNAPSHOT_PATH)"""
+    tt = Timetable.from_db()
+    tt.save(path or snapshot_path())
+    return tt
+
+
+def invalidate():
+    """Drop the snapshot and retire the worker pool forked from it"""
+    global _timetable, _checked_version, _pool
+    with _lock:
+        _timetable = None
+        _checked_version = 0
+        retired, _pool = _pool, None
+        idle = retired is not None and retired.retire()
+    if idle:
+        retired.close()
+
+
+# ==================== Parallel Planner ====================
+def parallel_workers():
+    """Configured pool size; 0 when parallel search is off or fork is unavailable"""
+    workers = getattr(settings, 'SEARCH_PARALLEL_WORKERS', 0)
+    if workers <= 0 or 'fork' not in multiprocessing.get_all_start_methods():
+        return 0
+    return workers
+
+
+class PlannerPool:
+    """
+    Process pool forked for one timetable snapshot (its version). Searches hold it
+    while their map runs; a retired pool is closed and joined once the last of them
+    is done, so a map is never cut off by a timetable change.
+    """
+
+    def __init__(self, timetable, workers):
+        self.version = timetable.version
+        self.workers = workers
+        self.users = 0
+        self.retired = False
+        # With fork, initargs reach the workers by inheritance (not pickling), and a
+        # replacement worker forked later still gets this snapshot
+        self.pool = multiprocessing.get_context('fork').Pool(
+            processes=workers, initializer=_init_worker, initargs=(timetable,)
+        )
+
+    def retire(self):
+        """Mark retired (caller holds _lock); True if idle, so the caller must close() it"""
+        self.retired = True
+        return self.users == 0
+
+    def close(self):
+        """Let the workers finish their tasks and exit"""
+        self.pool.close()
+        self.pool.join()
+
+
+def _acquire_pool(timetable, workers):
+    """
+    The pool forked from `timetable`, forking it (and retiring the previous pool)
+    when needed. None if the caller's snapshot is older than the current pool's.
+    """
+    global _pool
+    idle = None
+    with _lock:
+        if _pool is not None and timetable.version < _pool.version:
+            return None
+        if _pool is None or _pool.version != timetable.version or _pool.workers != workers:
+            if _pool is not None and _pool.retire():
+                idle = _pool
+            _pool = PlannerPool(timetable, workers)
+        _pool.users += 1
+        planner = _pool
+    if idle is not None:
+        idle.close()
+    return planner
+
+
+def _release_pool(planner):
+    with _lock:
+        planner.users -= 1
+        idle = planner.retired and planner.users == 0
+    if idle:
+        planner.close()
+
+
+_worker_timetable = None
+
+
+def _init_worker(timetable):
+    global _worker_timetable
+    _worker_timetable = timetable
+
+
+def _connecting_chunk(args):
+    # Runs in a forked worker: the snapshot its pool was forked for, shared copy-on-write
+    first_rows, dest_idx, weekday, min_buffer, available, suspended = args
+    return _worker_timetable.connecting(first_rows, dest_idx, weekday, min_buffer, available, suspended)
+
+
+def parallel_connecting(timetable, first_rows, dest_idx, weekday, min_buffer, available, workers,
+                        suspended=frozenset()):
+    """
+    Split first-leg rows across the pool and merge in earliest-arrival order. Row
+    indices are into `timetable`, so only its own pool may run them; a caller still
+    on an older snapshot than the pool's plans in-process.
+    """
+    planner = _acquire_pool(timetable, workers)
+    if planner is None:
+        results = timetable.connecting(first_rows, dest_idx, weekday, min_buffer, available, suspended)
+    else:
+        chunk_size = max(1, -(-len(first_rows) // (workers * 4)))
+        chunks = [
+            (first_rows[i:i + chunk_size], dest_idx, weekday, min_buffer, available, suspended)
+            for i in range(0, len(first_rows), chunk_size)
+        ]
+        results = []
+        try:
+            for part in planner.pool.map(_connecting_chunk, chunks):
+                results.extend(part)
+        finally:
+            _release_pool(planner)
+    results.sort(key=lambda option: option[3])
+    return results
+
+
+if hasattr(os, 'register_at_fork'):
+    # A forked child must not reuse (or close) its parent's pool
+    os.register_at_fork(after_in_child=lambda: globals().update(_pool=None, _lock=threading.Lock()))
@@ -7,12 +7,22 @@ urlpatterns = [
     path('', views.home, name='home'),
     path('search/', views.search_trains, name='search_trains'),
     path('search-results/', views.search_results, name='search_results'),
+    path('api/availability-calendar/', views.availability_calendar, name='availability_calendar'),
     path('booking/', views.booking, name='booking'),
+    path('api/bookings/group/', views.group_booking, name='group_booking'),
+    path('api/holds/', views.hold_seats, name='hold_seats'),
+    path('api/waiting-room/<str:room>/<str:ticket>/', views.waiting_room, name='waiting_room'),
     path('confirmation/', views.confirmation, name='confirmation'),
     path('download-ticket/<str:pnr>/', views.download_ticket, name='download_ticket'),
+    path('api/pnr/', views.pnr_status_batch, name='pnr_status_batch'),
+    path('api/pnr/<str:pnr>/', views.pnr_status_detail, name='pnr_status'),
+    path('api/tickets/revoked/', views.ticket_revocations, name='ticket_revocations'),
 
     # Autocomplete
     path('api/stations/', views.station_autocomplete, name='station_autocomplete'),
+    path('api/stations/nearby/', views.nearby_stations, name='nearby_stations'),
+    path('api/stations/all/', views.station_list, name='station_list'),
+    path('api/lookup/<str:kind>/', views.lookup, name='lookup'),
 
     # User views
     path('my-bookings/', views.my_bookings, name='my_bookings'),
@@ -1,30 +1,222 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
 from django.http import JsonResponse, FileResponse, HttpResponse
 from django.views.decorators.http import require_http_methods, require_POST
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.auth.models import User
-from django.db.models import Q, Sum, Count
+from django.db.models import Q, Sum, Count, Prefetch
+from django.core.paginator import Paginator
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.core.mail import send_mail
+from django.conf import settings
+from django.db import close_old_connections
+from asgiref.sync import sync_to_async
 from datetime import datetime, timedelta
-import json, uuid
+from concurrent.futures import ThreadPoolExecutor
+import asyncio, contextvars, functools, json, uuid
+from bisect import bisect_left
 from decimal import Decimal
 from reportlab.lib.pagesizes import letter
 from reportlab.lib import colors
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageBreak
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
+from reportlab.graphics.shapes import Drawing
+from reportlab.graphics.barcode.qr import QrCodeWidget
 from io import BytesIO
 
-from .models import Station, Train, Route, Schedule, Booking, BookingLeg, UserProfile
+from railway_project.db_router import primary_scope, replica_reads
+from railway_project.sqlite_tuning import immediate_transaction
+
+from .models import Station, Train, Route, Schedule, Booking, BookingLeg, Passenger, UserProfile, SeatHold, AdminSettings, DatedTrip, ArchivedBooking
+from .fares import fare_engine, SEAT_CLASSES
+from .availability import availability_calendar as build_availability_calendar, MAX_CALENDAR_DAYS
+from .ranking import OBJECTIVES, DEFAULT_OBJECTIVE, TopK, sort_key, connecting_lower_bound
+from .geo import get_station_index, detour_filter, MAX_NEARBY_RADIUS_KM
+from .station_catalog import get_station_catalog
+from .service_calendar import get_service_calendar
+from .coalesce import search_flights, shared_call
+from .admission import admission_control, rate_limit, get_waiting_room, WaitingRoom
+from . import pnr_status, ticket_tokens
+from .lookup import get_lookup_index, BUILDERS as LOOKUP_KINDS
+from . import timetable
 
 # ==================== HELPER FUNCTIONS ====================
 
+# Bounded pool for CPU/DB-heavy search planning, so slow searches queue here
+# instead of occupying the event loop or every worker thread
+_search_executor = None
+
+def get_search_executor():
+    global _search_executor
+    if _search_executor is None:
+        _search_executor = ThreadPoolExecutor(
+            max_workers=settings.SEARCH_EXECUTOR_WORKERS, thread_name_prefix='search'
+        )
+    return _search_executor
+
+def _run_with_db(func, *args):
+    # Executor threads outlive requests, so manage their DB connections explicitly
+    close_old_connections()
+    try:
+        return func(*args)
+    finally:
+        close_old_connections()
+
+async def run_in_search_executor(func, *args, coalesce_key=None):
+    """
+    Run a blocking search function on the search executor, bounded by
+    SEARCH_TIMEOUT_SECONDS. With SEARCH_EXECUTOR_WORKERS = 0 it runs on Django's
+    shared sync thread instead (useful under TestCase transactions).
+    
+    Calls with the same coalesce_key that overlap share one computation (see
+    coalesce.py); the result must then be read-only and JSON-serializable.
+    """
+    if settings.SEARCH_EXECUTOR_WORKERS <= 0:
+        return await asyncio.wait_for(sync_to_async(func)(*args), timeout=settings.SEARCH_TIMEOUT_SECONDS)
+    # Copy the context so database routing (replica reads) carries over to the worker thread
+    context = contextvars.copy_context()
+    if coalesce_key is None or not settings.SEARCH_COALESCE:
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(get_search_executor(), context.run, _run_with_db, func, *args)
+        return await asyncio.wait_for(future, timeout=settings.SEARCH_TIMEOUT_SECONDS)
+    
+    future, _ = search_flights.submit(coalesce_key, lambda: get_search_executor().submit(
+        context.run, _run_with_db, shared_call, coalesce_key, func, *args
+    ))
+    # Shielded: one caller timing out must not cancel the computation the others wait on
+    return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout=settings.SEARCH_TIMEOUT_SECONDS)
+
+class SeatsUnavailable(Exception):
+    """Raised inside a booking transaction when a leg has no seats left"""
+
+# Expired holds released per request by the lazy sweep on read paths
+LAZY_HOLD_SWEEP_BATCH = 100
+
+# Largest group allowed on one PNR unless overridden by AdminSettings max_group_size
+DEFAULT_MAX_GROUP_SIZE = 6
+
+def max_group_size():
+    try:
+        return int(AdminSettings.get_value('max_group_size', DEFAULT_MAX_GROUP_SIZE))
+    except ValueError:
+        return DEFAULT_MAX_GROUP_SIZE
+
+# Later legs of a connection may leave up to this many days after the journey date
+CONNECTION_SPAN_DAYS = 2
+
+def service_error(schedules, journey_date):
+    """
+    Why the legs cannot be booked for journey_date (a 'YYYY-MM-DD' string), or None.
+    The first leg must run on the date, later legs within CONNECTION_SPAN_DAYS of it.
+    """
+    try:
+        journey_date = datetime.strptime(str(journey_date), '%Y-%m-%d').date()
+    except ValueError:
+        return 'Invalid journey date format'
+    calendar = get_service_calendar()
+    for idx, schedule in enumerate(schedules):
+        days = [journey_date + timedelta(days=n) for n in range(CONNECTION_SPAN_DAYS + 1 if idx else 1)]
+        if not any(calendar.runs(schedule.id, schedule.runs_on, day) for day in days):
+            return f'Train {schedule.route.train.train_number} does not run on {journey_date.strftime("%d-%m-%Y")}'
+    return None
+
+def own_held_seats(request, schedules, seat_class, seats=1):
+    """Seats the session's hold took on these legs, if booking `seats` of them would consume it"""
+    return seats if SeatHold.covers(request.session.get('seat_hold'), schedules, seat_class, seats) else 0
+
+def create_booking(user, contact, passengers, seat_class, journey_date, schedules, quote, hold_token=None):
+    """
+    Book every passenger on every leg in one transaction.
+    
+    Inventory is decremented once per leg by the number of passengers (or taken
+    from a matching seat hold); legs and passengers are written with bulk_create.
+    Raises SeatsUnavailable if any leg cannot take the whole group.
+    """
+    count = len(passengers)
+    lead = passengers[0]
+    user = user if user is not None and user.is_authenticated else None
+    
+    # Allocated up front so the inventory ledger entries can reference it
+    pnr = Booking.generate_pnr()
+    
+    with immediate_transaction():
+        # Seats already taken out of inventory by a matching live hold
+        if not SeatHold.consume(hold_token, schedules, seat_class, count, pnr=pnr):
+            SeatHold.release(hold_token)
+            for schedule in schedules:
+                if not schedule.reduce_available_seats(seat_class, count, reference=pnr):
+                    raise SeatsUnavailable(f'Not enough {seat_class} seats left on train {schedule.route.train.train_number}')
+        
+        booking_obj = Booking.objects.create(
+            pnr=pnr,
+            user=user,
+            passenger_name=lead['name'],
+            passenger_email=contact['email'],
+            passenger_phone=contact['phone'],
+            passenger_age=lead['age'],
+            passenger_gender=lead['gender'],
+            passenger_count=count,
+            seat_class=seat_class,
+            journey_date=journey_date,
+            total_fare=quote['total'],
+            status='CONFIRMED'
+        )
+        
+        # One leg row per train; seat_number records the lead passenger's seat
+        lead_seats = lead.get('seat_numbers', [])
+        BookingLeg.objects.bulk_create([
+            BookingLeg(
+                booking=booking_obj,
+                schedule=schedule,
+                route_id=schedule.route_id,
+                seat_number=lead_seats[idx] if idx < len(lead_seats) else '',
+                leg_fare=quote['leg_fares'][idx],
+                leg_sequence=idx + 1
+            )
+            for idx, schedule in enumerate(schedules)
+        ])
+        Passenger.objects.bulk_create([
+            Passenger(
+                booking=booking_obj,
+                name=p['name'],
+                age=p['age'],
+                gender=p['gender'],
+                seat_numbers=','.join(p.get('seat_numbers', [])),
+                sequence=idx + 1
+            )
+            for idx, p in enumerate(passengers)
+        ])
+        
+        if user is not None:
+            UserProfile.record_booking(user, booking_obj.total_fare)
+    
+    return booking_obj
+
+def journey_times(journey_date, schedule):
+    """Departure and arrival datetimes of a schedule run starting on journey_date"""
+    departure = datetime.combine(journey_date, schedule.departure_time)
+    arrival = datetime.combine(journey_date, schedule.arrival_time)
+    if arrival <= departure:
+        arrival += timedelta(days=1)
+    return departure, arrival
+
+def rank_direct_trains(direct_options, journey_date, objective):
+    """Order direct options best-first for the objective"""
+    def key(option):
+        departure, arrival = journey_times(journey_date, option['schedule'])
+        return sort_key(objective, departure, arrival, option['fare'])
+    return sorted(direct_options, key=key)
+
 def find_direct_trains(source_station, dest_station, journey_date, seat_class):
     """Find direct trains with available seats"""
-    weekday = journey_date.weekday()
+    if DatedTrip.covers(journey_date):
+        return find_direct_trips(source_station, dest_station, journey_date, seat_class)
+    
+    calendar = get_service_calendar()
     
     routes = Route.objects.filter(
         source=source_station,
@@ -38,10 +230,10 @@ def find_direct_trains(source_station, dest_station, journey_date, seat_class):
         schedules = Schedule.objects.filter(
             route=route,
             is_active=True
-        ).exclude(runs_on__exact='')
+        )
         
         for schedule in schedules:
-            if str(weekday) not in schedule.runs_on:
+            if not calendar.runs(schedule.id, schedule.runs_on, journey_date):
                 continue
             
             available = schedule.get_available_seats(seat_class)
@@ -51,119 +243,329 @@ def find_direct_trains(source_station, dest_station, journey_date, seat_class):
                     'schedule': schedule,
                     'route': route,
                     'available_seats': available,
-                    'fare': Decimal(str(route.calculated_fare)),
+                    'fare': fare_engine.fare_for_schedule(schedule, seat_class),
                     'duration': f"{route.duration_hours}h {route.duration_minutes}m",
                 })
     
     return direct_options
 
-def find_connecting_trains(source_station, dest_station, journey_date, seat_class, min_buffer=30):
-    """Find 2-leg connecting routes with optimal second leg selection based on earliest arrival"""
-    weekday = journey_date.weekday()
-    connecting_options = []
+def find_direct_trips(source_station, dest_station, journey_date, seat_class):
+    """find_direct_trains as one range scan on the dated trip table"""
+    day_start = timezone.make_aware(datetime.combine(journey_date, datetime.min.time()))
+    trips = DatedTrip.objects.select_related(
+        'schedule__route__train', 'schedule__route__source', 'schedule__route__destination'
+    ).filter(
+        origin=source_station,
+        departure_ts__gte=day_start,
+        departure_ts__lt=day_start + timedelta(days=1),
+        destination=dest_station,
+        schedule__is_active=True,
+        schedule__route__is_active=True,
+    )
+    
+    direct_options = []
+    for trip in trips:
+        schedule = trip.schedule
+        route = schedule.route
+        available = schedule.get_available_seats(seat_class)
+        if available > 0:
+            direct_options.append({
+                'type': 'direct',
+                'schedule': schedule,
+                'route': route,
+                'available_seats': available,
+                'fare': fare_engine.fare_for_schedule(schedule, seat_class),
+                'duration': f"{route.duration_hours}h {route.duration_minutes}m",
+            })
+    return direct_options
 
-    # Find all intermediate stations
-    intermediate_routes = Route.objects.filter(
-        source=source_station,
-        is_active=True
-    ).exclude(destination=dest_station)
+def connecting_option(first, second, seat_class, buffer_minutes, total_arrival_time, total_fare=None):
+    """Result dict for a 2-leg journey"""
+    if total_fare is None:
+        total_fare = fare_engine.fare_for_schedule(first, seat_class) + fare_engine.fare_for_schedule(second, seat_class)
+    return {
+        'type': 'connecting',
+        'leg_1': {
+            'schedule': first,
+            'route': first.route,
+            'available_seats': first.get_available_seats(seat_class),
+        },
+        'leg_2': {
+            'schedule': second,
+            'route': second.route,
+            'available_seats': second.get_available_seats(seat_class),
+        },
+        'buffer_minutes': buffer_minutes,
+        'total_fare': total_fare,
+        'total_distance': first.route.distance + second.route.distance,
+        'total_arrival_time': total_arrival_time,
+    }
 
-    for first_leg_route in intermediate_routes:
-        intermediate_station = first_leg_route.destination
+# Search pagination: results per page by default, the largest page a client may ask
+# for, and how deep into the ranking pages may go (bounds the top-k heap)
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 50
+SEARCH_MAX_RESULTS = 200
 
-        # Find second leg routes
-        second_leg_routes = Route.objects.filter(
-            source=intermediate_station,
-            destination=dest_station,
-            is_active=True
-        )
+def search_page(data):
+    """(page, page_size) from a search request, clamped to the server-side limits"""
+    page_size = min(max(int(data.get('page_size') or SEARCH_PAGE_SIZE), 1), SEARCH_MAX_PAGE_SIZE)
+    max_page = max(SEARCH_MAX_RESULTS // page_size, 1)
+    page = min(max(int(data.get('page') or 1), 1), max_page)
+    return page, page_size
 
-        first_schedules = Schedule.objects.filter(
-            route=first_leg_route,
-            is_active=True
-        ).exclude(runs_on__exact='')
+# Objectives for which the earliest-arriving second leg is also the best one
+TIMETABLE_OBJECTIVES = ('arrival', 'duration', 'transfers')
 
-        for first_schedule in first_schedules:
-            if str(weekday) not in first_schedule.runs_on:
-                continue
+def find_connecting_trains_parallel(source_station, dest_station, journey_date, seat_class, min_buffer=30,
+                                    objective=DEFAULT_OBJECTIVE, limit=None):
+    """
+    Connecting search on the timetable snapshot, split across the process pool.
+    Returns None when parallel mode is off, the source is too small to benefit,
+    the objective needs live fares (fare, comfort), or extra runs (which the weekly
+    snapshot does not know about) operate around the journey date.
+    """
+    workers = timetable.parallel_workers()
+    if not workers or objective not in TIMETABLE_OBJECTIVES:
+        return None
+    tt = timetable.get_timetable()
+    source_idx = tt.station_index.get(source_station.id)
+    dest_idx = tt.station_index.get(dest_station.id)
+    if source_idx is None or dest_idx is None:
+        return None
+    calendar = get_service_calendar()
+    # Overnight first legs can make the second leg leave up to two days later
+    days = [journey_date + timedelta(days=offset) for offset in range(CONNECTION_SPAN_DAYS + 1)]
+    if any(calendar.extra_on(day) for day in days):
+        return None
+    weekday = journey_date.weekday()
+    first_rows = [
+        r for r in tt.first_leg_rows(source_idx, dest_idx, weekday)
+        if not calendar.is_suspended(tt.schedule_id[r], journey_date)
+    ]
+    plausible = detour_filter(source_station.id, dest_station.id)
+    if plausible:
+        first_rows = [r for r in first_rows if plausible(tt.station_ids[tt.dst[r]])]
+    if len(first_rows) < settings.SEARCH_PARALLEL_MIN_FIRST_LEGS:
+        return None
+    
+    # Seat availability changes constantly, so it is read fresh (one query) rather than snapshotted
+    seat_field = Schedule.SEAT_FIELDS.get(seat_class, 'sleeper_available')
+    available = frozenset(Schedule.objects.filter(
+        Q(route__source=source_station) | Q(route__destination=dest_station),
+        **{f'{seat_field}__gt': 0}
+    ).values_list('id', flat=True))
+    # Workers check second legs against the day they actually leave
+    suspended = frozenset(
+        (schedule_id, offset) for schedule_id in available for offset, day in enumerate(days)
+        if calendar.is_suspended(schedule_id, day)
+    )
+    
+    matches = timetable.parallel_connecting(tt, first_rows, dest_idx, weekday, min_buffer, available, workers,
+                                            suspended)
+    
+    # Rank the compact tuples and only load schedules for the ones that are kept
+    departures = {tt.schedule_id[r]: tt.dep_min[r] for r in first_rows}
+    top = TopK(limit if limit is not None else len(matches))
+    for match in matches:
+        first_id, _, _, arrival_minutes = match
+        # Fares are not in the snapshot; ties on the objective keep arrival order
+        top.push(sort_key(objective, departures[first_id], arrival_minutes, 0), match)
+    matches = top.items()
+    
+    ids = {sid for first_id, second_id, _, _ in matches for sid in (first_id, second_id)}
+    schedules = Schedule.objects.select_related(
+        'route__train', 'route__source', 'route__destination'
+    ).in_bulk(ids)
+    journey_start = datetime.combine(journey_date, datetime.min.time())
+    
+    return [
+        connecting_option(schedules[first_id], schedules[second_id], seat_class, buffer_minutes,
+                          journey_start + timedelta(minutes=arrival_minutes))
+        for first_id, second_id, buffer_minutes, arrival_minutes in matches
+    ]
 
-            first_available = first_schedule.get_available_seats(seat_class)
-            if first_available == 0:
+def find_connecting_trains(source_station, dest_station, journey_date, seat_class, min_buffer=30,
+                           objective=DEFAULT_OBJECTIVE, limit=None):
+    """
+    Find 2-leg connecting routes. Each first leg is paired with its best second leg
+    under `objective`; with `limit`, only the best `limit` journeys are built.
+    """
+    # Large hubs go to the process-pool planner when it is enabled
+    parallel = find_connecting_trains_parallel(
+        source_station, dest_station, journey_date, seat_class, min_buffer, objective, limit
+    )
+    if parallel is not None:
+        return parallel
+    
+    seat_field = Schedule.SEAT_FIELDS.get(seat_class)
+    if seat_field is None:
+        return []
+    
+    if DatedTrip.covers(journey_date):
+        first_legs, second_legs = dated_trip_legs(source_station, dest_station, journey_date, seat_field, min_buffer)
+    else:
+        first_legs, second_legs = schedule_legs(source_station, dest_station, journey_date, seat_field)
+    
+    fares = {}
+    def fare(schedule):
+        if schedule.id not in fares:
+            fares[schedule.id] = fare_engine.fare_for_schedule(schedule, seat_class)
+        return fares[schedule.id]
+    
+    # Visit first legs from the most promising down, so the top-k can stop early
+    candidates = []
+    for first, first_departure, first_arrival in first_legs:
+        bound = connecting_lower_bound(
+            objective, first_departure, first_arrival + timedelta(minutes=min_buffer), fare(first)
+        )
+        candidates.append((bound, first_departure, first_arrival, first))
+    candidates.sort(key=lambda candidate: candidate[0])
+    
+    top = TopK(limit if limit is not None else len(candidates))
+    for bound, first_departure, first_arrival, first in candidates:
+        if top.done(bound):
+            break
+        
+        # For this first leg, find the best second leg under the objective
+        best = None
+        for second, second_departure, second_arrival in second_legs(first, first_arrival):
+            buffer_minutes = int((second_departure - first_arrival).total_seconds() // 60)
+            if buffer_minutes < min_buffer:
                 continue
+            
+            total_fare = fare(first) + fare(second)
+            key = sort_key(objective, first_departure, second_arrival, total_fare, 1, buffer_minutes)
+            if best is None or key < best[0]:
+                best = (key, second, buffer_minutes, second_arrival, total_fare)
+        
+        if best:
+            key, second, buffer_minutes, second_arrival, total_fare = best
+            top.push(key, (first, second, buffer_minutes, second_arrival, total_fare))
+    
+    return [
+        connecting_option(first, second, seat_class, buffer_minutes, second_arrival, total_fare)
+        for first, second, buffer_minutes, second_arrival, total_fare in top.items()
+    ]
 
-            # For this first leg, find the best second leg (earliest arrival at destination)
-            best_second_leg = None
-            earliest_arrival = None
-
-            for second_leg_route in second_leg_routes:
-                second_schedules = Schedule.objects.filter(
-                    route=second_leg_route,
-                    is_active=True
-                ).exclude(runs_on__exact='')
-
-                for second_schedule in second_schedules:
-                    if str(weekday) not in second_schedule.runs_on:
-                        continue
-
-                    second_available = second_schedule.get_available_seats(seat_class)
-                    if second_available == 0:
-                        continue
-
-                    # Calculate connection timing
-                    first_arrival = datetime.combine(journey_date, first_schedule.arrival_time)
-                    second_departure = datetime.combine(journey_date, second_schedule.departure_time)
-
-                    if second_departure <= first_arrival:
-                        second_departure += timedelta(days=1)
-
-                    buffer_minutes = (second_departure - first_arrival).total_seconds() / 60
-
-                    if buffer_minutes >= min_buffer:
-                        # Calculate total arrival time at destination
-                        second_arrival = datetime.combine(journey_date, second_schedule.arrival_time)
-                        if second_arrival <= second_departure:
-                            second_arrival += timedelta(days=1)
-
-                        # Check if this is the earliest arrival
-                        if earliest_arrival is None or second_arrival < earliest_arrival:
-                            earliest_arrival = second_arrival
-                            best_second_leg = {
-                                'schedule': second_schedule,
-                                'route': second_leg_route,
-                                'available_seats': second_available,
-                                'buffer_minutes': int(buffer_minutes),
-                                'arrival_time': second_arrival,
-                            }
-
-            # If we found a valid second leg, add the connecting option
-            if best_second_leg:
-                total_fare = Decimal(str(first_leg_route.calculated_fare + best_second_leg['route'].calculated_fare))
-
-                connecting_options.append({
-                    'type': 'connecting',
-                    'leg_1': {
-                        'schedule': first_schedule,
-                        'route': first_leg_route,
-                        'available_seats': first_available,
-                    },
-                    'leg_2': {
-                        'schedule': best_second_leg['schedule'],
-                        'route': best_second_leg['route'],
-                        'available_seats': best_second_leg['available_seats'],
-                    },
-                    'buffer_minutes': best_second_leg['buffer_minutes'],
-                    'total_fare': total_fare,
-                    'total_distance': first_leg_route.distance + best_second_leg['route'].distance,
-                    'total_arrival_time': best_second_leg['arrival_time'],
-                })
+def schedule_legs(source_station, dest_station, journey_date, seat_field):
+    """
+    Connection legs from schedules running on the journey date by their weekly pattern
+    and exceptions (used beyond the dated trip horizon). Returns ([(first, departure, arrival)], second_legs) where
+    second_legs(first, first_arrival) yields (second, departure, arrival).
+    """
+    calendar = get_service_calendar()
+    # Both legs in two queries: active, with seats in the class
+    legs = Schedule.objects.select_related(
+        'route__train', 'route__source', 'route__destination'
+    ).filter(
+        is_active=True,
+        route__is_active=True,
+        **{f'{seat_field}__gt': 0}
+    )
+    first_schedules = [
+        first for first in legs.filter(
+            Q(runs_on__contains=str(journey_date.weekday())) | Q(id__in=calendar.extra_on(journey_date)),
+            route__source=source_station,
+        ).exclude(route__destination=dest_station)
+        if calendar.runs(first.id, first.runs_on, journey_date)
+    ]
+    plausible = detour_filter(source_station.id, dest_station.id)
+    if plausible:
+        # Skip intermediates that are geographically implausible detours
+        first_schedules = [first for first in first_schedules if plausible(first.route.destination_id)]
+    second_by_station = {}
+    for second in legs.filter(
+        route__destination=dest_station,
+        route__source_id__in={first.route.destination_id for first in first_schedules},
+    ):
+        second_by_station.setdefault(second.route.source_id, []).append(second)
+    
+    first_legs = [
+        (first, *journey_times(journey_date, first))
+        for first in first_schedules if first.route.destination_id in second_by_station
+    ]
+    
+    def second_legs(first, first_arrival):
+        for second in second_by_station[first.route.destination_id]:
+            # The next departure after the first leg arrives (overnight first legs arrive the next day)
+            second_departure, second_arrival = journey_times(first_arrival.date(), second)
+            if second_departure <= first_arrival:
+                second_departure, second_arrival = journey_times(first_arrival.date() + timedelta(days=1), second)
+            if calendar.runs(second.id, second.runs_on, second_departure.date()):
+                yield second, second_departure, second_arrival
+    
+    return first_legs, second_legs
 
-    # Sort connecting options by earliest total arrival time
-    connecting_options.sort(key=lambda x: x['total_arrival_time'])
+def dated_trip_legs(source_station, dest_station, journey_date, seat_field, min_buffer):
+    """
+    Connection legs from the dated trip table: two range scans on (origin, departure_ts).
+    Timestamps are absolute, so overnight and multi-day legs and next-day connections
+    (which must run on the next day's weekday) come out right. Same shape as schedule_legs.
+    """
+    day_start = timezone.make_aware(datetime.combine(journey_date, datetime.min.time()))
+    trips = DatedTrip.objects.select_related(
+        'schedule__route__train', 'schedule__route__source', 'schedule__route__destination'
+    ).filter(
+        schedule__is_active=True,
+        schedule__route__is_active=True,
+        **{f'schedule__{seat_field}__gt': 0}
+    )
+    first_trips = list(trips.filter(
+        origin=source_station,
+        departure_ts__gte=day_start,
+        departure_ts__lt=day_start + timedelta(days=1),
+    ).exclude(destination=dest_station))
+    plausible = detour_filter(source_station.id, dest_station.id)
+    if plausible:
+        # Skip intermediates that are geographically implausible detours
+        first_trips = [trip for trip in first_trips if plausible(trip.destination_id)]
+    if not first_trips:
+        return [], None
+    
+    # Second legs may leave up to a day after the latest first-leg arrival
+    earliest = min(trip.arrival_ts for trip in first_trips) + timedelta(minutes=min_buffer)
+    latest = max(trip.arrival_ts for trip in first_trips) + timedelta(days=1)
+    second_by_station = {}
+    for trip in trips.filter(
+        destination=dest_station,
+        origin_id__in={trip.destination_id for trip in first_trips},
+        departure_ts__gte=earliest,
+        departure_ts__lt=latest,
+    ).order_by('departure_ts'):
+        second_by_station.setdefault(trip.origin_id, []).append(trip)
+    departures_by_station = {
+        station_id: [trip.departure_ts for trip in station_trips]
+        for station_id, station_trips in second_by_station.items()
+    }
+    
+    first_legs = [
+        (trip.schedule, trip.departure_ts, trip.arrival_ts)
+        for trip in first_trips if trip.destination_id in second_by_station
+    ]
+    
+    def second_legs(first, first_arrival):
+        station_id = first.route.destination_id
+        station_trips = second_by_station[station_id]
+        departures = departures_by_station[station_id]
+        # Only trips leaving within a day of this arrival, like the weekday search
+        lo = bisect_left(departures, first_arrival + timedelta(minutes=min_buffer))
+        hi = bisect_left(departures, first_arrival + timedelta(days=1))
+        for trip in station_trips[lo:hi]:
+            yield trip.schedule, trip.departure_ts, trip.arrival_ts
+    
+    return first_legs, second_legs
 
-    return connecting_options
+def find_ticket_booking(pnr):
+    """(booking, archived) for a PNR, looked up in the archive when not in the hot tables; 404 otherwise"""
+    booking = Booking.objects.filter(pnr=pnr).first()
+    if booking is not None:
+        return booking, False
+    return get_object_or_404(ArchivedBooking.objects.prefetch_related('legs'), pnr=pnr), True
 
 def generate_ticket_pdf(booking):
-    """Generate PDF ticket"""
+    """Generate PDF ticket (for a Booking or an ArchivedBooking)"""
+    archived = isinstance(booking, ArchivedBooking)
     buffer = BytesIO()
     doc = SimpleDocTemplate(buffer, pagesize=letter)
     story = []
@@ -185,12 +587,16 @@ def generate_ticket_pdf(booking):
     
     # Passenger Info
     story.append(Paragraph("<b>Passenger Details</b>", styles['Heading3']))
-    pass_data = [
-        ['Name:', booking.passenger_name],
-        ['Age/Gender:', f"{booking.passenger_age} / {booking.get_passenger_gender_display()}"],
-        ['Email:', booking.passenger_email],
-    ]
-    story.append(Table(pass_data, colWidths=[1.5*inch, 4*inch]))
+    pass_data = [['#', 'Name', 'Age/Gender', 'Seats']]
+    for passenger in booking.passenger_list() if archived else booking.passengers.all():
+        pass_data.append([
+            passenger.sequence,
+            passenger.name,
+            f"{passenger.age} / {passenger.get_gender_display()}",
+            passenger.seat_numbers,
+        ])
+    story.append(Table(pass_data, colWidths=[0.5*inch, 3*inch, 1.5*inch, 1.5*inch]))
+    story.append(Paragraph(f"Contact: {booking.passenger_email} / {booking.passenger_phone}", styles['Normal']))
     story.append(Spacer(1, 0.2*inch))
     
     # Journey Details
@@ -198,12 +604,20 @@ def generate_ticket_pdf(booking):
     journey_data = [['Train', 'From', 'To', 'Depart', 'Arrive', 'Class', 'Seat', 'Fare']]
     
     for leg in booking.legs.all():
+        # Archived legs keep the train, stations and times as booked
+        if archived:
+            train_number, source, destination = leg.train_number, leg.source_code, leg.destination_code
+            departure, arrival = leg.departure_time, leg.arrival_time
+        else:
+            train_number, source, destination = (leg.route.train.train_number, leg.route.source.code,
+                                                  leg.route.destination.code)
+            departure, arrival = leg.schedule.departure_time, leg.schedule.arrival_time
         journey_data.append([
-            leg.route.train.train_number,
-            leg.route.source.code,
-            leg.route.destination.code,
-            leg.schedule.departure_time.strftime('%H:%M'),
-            leg.schedule.arrival_time.strftime('%H:%M'),
+            train_number,
+            source,
+            destination,
+            departure.strftime('%H:%M'),
+            arrival.strftime('%H:%M'),
             booking.get_seat_class_display(),
             leg.seat_number,
             f"₹{leg.leg_fare}"
@@ -214,6 +628,19 @@ def generate_ticket_pdf(booking):
     
     # Total Fare
     story.append(Paragraph(f"<b>Total Fare: ₹{booking.total_fare}</b>", styles['Heading2']))
+    story.append(Spacer(1, 0.2*inch))
+    
+    # Signed ticket token, checked offline by scanning the QR code (see ticket_tokens)
+    token = ticket_tokens.ticket_token(booking)
+    qr = QrCodeWidget(token, barLevel='M')
+    x1, y1, x2, y2 = qr.getBounds()
+    size = 1.8*inch
+    qr_drawing = Drawing(size, size, transform=[size / (x2 - x1), 0, 0, size / (y2 - y1), 0, 0])
+    qr_drawing.add(qr)
+    story.append(qr_drawing)
+    # The token has no spaces; CJK wrapping breaks it anywhere instead of overflowing the page
+    token_style = ParagraphStyle('TicketToken', parent=styles['Normal'], fontName='Courier', fontSize=7, wordWrap='CJK')
+    story.append(Paragraph(token, token_style))
     
     doc.build(story)
     buffer.seek(0)
@@ -222,14 +649,100 @@ def generate_ticket_pdf(booking):
 # ==================== PASSENGER VIEWS ====================
 
 def home(request):
-    """Home page with search form"""
-    stations = Station.objects.all().order_by('name')
-    context = {'stations': stations}
+    """Home page with search form (the station list is fetched lazily from station_list)"""
+    catalog = get_station_catalog()
+    context = {'stations_url': f"{reverse('station_list')}?v={catalog.tag}"}
     return render(request, 'home.html', context)
 
+def plan_search(source, destination, journey_date, seat_class, include_connecting,
+                objective=DEFAULT_OBJECTIVE, page=1, page_size=SEARCH_PAGE_SIZE):
+    """
+    Blocking search planner; runs on the search executor and returns the JSON payload.
+    Both result lists are ranked by `objective` and paginated; connecting journeys
+    beyond the requested page are never built.
+    """
+    # Return seats from abandoned holds before reading availability; on the primary,
+    # outside the replica reads of the search itself
+    with primary_scope():
+        SeatHold.release_expired(batch_size=LAZY_HOLD_SWEEP_BATCH)
+    offset = (page - 1) * page_size
+    
+    # Find direct trains
+    direct = rank_direct_trains(
+        find_direct_trains(source, destination, journey_date, seat_class), journey_date, objective
+    )
+    direct_has_more = len(direct) > offset + page_size
+    direct = direct[offset:offset + page_size]
+    
+    # Find connecting trains - only for authenticated users; one extra tells whether a next page exists
+    connecting = []
+    if include_connecting:
+        connecting = find_connecting_trains(
+            source, destination, journey_date, seat_class, objective=objective, limit=offset + page_size + 1
+        )
+    connecting_has_more = len(connecting) > offset + page_size
+    connecting = connecting[offset:offset + page_size]
+    
+    # Serialize response
+    direct_serialized = []
+    for train in direct:
+        direct_serialized.append({
+            'id': train['schedule'].id,
+            'train_number': train['route'].train.train_number,
+            'train_name': train['route'].train.train_name,
+            'from': train['route'].source.code,
+            'to': train['route'].destination.code,
+            'departure': str(train['schedule'].departure_time),
+            'arrival': str(train['schedule'].arrival_time),
+            'duration': train['duration'],
+            'distance': train['route'].distance,
+            'available_seats': train['available_seats'],
+            'fare': float(train['fare']),
+            'schedule_id': train['schedule'].id,
+            'route_id': train['route'].id,
+        })
+
+    connecting_serialized = []
+    for conn in connecting:
+        connecting_serialized.append({
+            'leg_1_schedule': conn['leg_1']['schedule'].id,
+            'leg_1_train': conn['leg_1']['route'].train.train_number,
+            'leg_1_from': conn['leg_1']['route'].source.code,
+            'leg_1_to': conn['leg_1']['route'].destination.code,
+            'leg_1_departure': str(conn['leg_1']['schedule'].departure_time),
+            'leg_1_arrival': str(conn['leg_1']['schedule'].arrival_time),
+            'leg_1_available': conn['leg_1']['available_seats'],
+
+            'leg_2_schedule': conn['leg_2']['schedule'].id,
+            'leg_2_train': conn['leg_2']['route'].train.train_number,
+            'leg_2_from': conn['leg_2']['route'].source.code,
+            'leg_2_to': conn['leg_2']['route'].destination.code,
+            'leg_2_departure': str(conn['leg_2']['schedule'].departure_time),
+            'leg_2_arrival': str(conn['leg_2']['schedule'].arrival_time),
+            'leg_2_available': conn['leg_2']['available_seats'],
+
+            'buffer_minutes': conn['buffer_minutes'],
+            'total_fare': float(conn['total_fare']),
+            'total_distance': conn['total_distance'],
+        })
+
+    return {
+        'status': 'success',
+        'sort': objective,
+        'page': page,
+        'page_size': page_size,
+        'direct_count': len(direct),
+        'connecting_count': len(connecting),
+        'direct_has_more': direct_has_more,
+        'connecting_has_more': connecting_has_more,
+        'direct_trains': direct_serialized,
+        'connecting_trains': connecting_serialized,
+    }
+
+@replica_reads
 @require_http_methods(["GET", "POST"])
-def search_trains(request):
-    """AJAX endpoint for train search"""
+async def search_trains(request):
+    """AJAX endpoint for train search (async; planning runs on the bounded search executor)"""
     if request.method == 'POST':
         data = json.loads(request.body)
 
@@ -237,10 +750,18 @@ def search_trains(request):
         dest_id = data.get('destination_id')
         journey_date_str = data.get('journey_date')
         seat_class = data.get('seat_class', 'SLEEPER')
+        objective = data.get('sort') or DEFAULT_OBJECTIVE
+
+        if objective not in OBJECTIVES:
+            return JsonResponse({
+                'status': 'error',
+                'error': f"sort must be one of: {', '.join(OBJECTIVES)}"
+            }, status=400)
 
         try:
-            source = Station.objects.get(id=source_id)
-            destination = Station.objects.get(id=dest_id)
+            page, page_size = search_page(data)
+            source = await Station.objects.aget(id=source_id)
+            destination = await Station.objects.aget(id=dest_id)
             journey_date = datetime.strptime(journey_date_str, '%Y-%m-%d').date()
 
             # Check if date is in future
@@ -250,64 +771,21 @@ def search_trains(request):
                     'status': 'error'
                 })
 
-            # Find direct trains
-            direct = find_direct_trains(source, destination, journey_date, seat_class)
-
-            # Find connecting trains - only for authenticated users
-            connecting = []
-            if request.user.is_authenticated:
-                connecting = find_connecting_trains(source, destination, journey_date, seat_class)
-            
-            # Serialize response
-            direct_serialized = []
-            for train in direct:
-                direct_serialized.append({
-                    'id': train['schedule'].id,
-                    'train_number': train['route'].train.train_number,
-                    'train_name': train['route'].train.train_name,
-                    'from': train['route'].source.code,
-                    'to': train['route'].destination.code,
-                    'departure': str(train['schedule'].departure_time),
-                    'arrival': str(train['schedule'].arrival_time),
-                    'duration': train['duration'],
-                    'distance': train['route'].distance,
-                    'available_seats': train['available_seats'],
-                    'fare': float(train['fare']),
-                    'schedule_id': train['schedule'].id,
-                    'route_id': train['route'].id,
-                })
-            
-            connecting_serialized = []
-            for conn in connecting:
-                connecting_serialized.append({
-                    'leg_1_schedule': conn['leg_1']['schedule'].id,
-                    'leg_1_train': conn['leg_1']['route'].train.train_number,
-                    'leg_1_from': conn['leg_1']['route'].source.code,
-                    'leg_1_to': conn['leg_1']['route'].destination.code,
-                    'leg_1_departure': str(conn['leg_1']['schedule'].departure_time),
-                    'leg_1_arrival': str(conn['leg_1']['schedule'].arrival_time),
-                    'leg_1_available': conn['leg_1']['available_seats'],
-                    
-                    'leg_2_schedule': conn['leg_2']['schedule'].id,
-                    'leg_2_train': conn['leg_2']['route'].train.train_number,
-                    'leg_2_from': conn['leg_2']['route'].source.code,
-                    'leg_2_to': conn['leg_2']['route'].destination.code,
-                    'leg_2_departure': str(conn['leg_2']['schedule'].departure_time),
-                    'leg_2_arrival': str(conn['leg_2']['schedule'].arrival_time),
-                    'leg_2_available': conn['leg_2']['available_seats'],
-                    
-                    'buffer_minutes': conn['buffer_minutes'],
-                    'total_fare': float(conn['total_fare']),
-                    'total_distance': conn['total_distance'],
-                })
-            
+            user = await request.auser()
+            # Identical searches (same pair, date, class, auth tier and page) share one run
+            coalesce_key = ('search', source.id, destination.id, journey_date.isoformat(), seat_class,
+                            user.is_authenticated, objective, page, page_size)
+            result = await run_in_search_executor(
+                plan_search, source, destination, journey_date, seat_class, user.is_authenticated,
+                objective, page, page_size, coalesce_key=coalesce_key
+            )
+            return JsonResponse(result)
+        
+        except asyncio.TimeoutError:
             return JsonResponse({
-                'status': 'success',
-                'direct_count': len(direct),
-                'connecting_count': len(connecting),
-                'direct_trains': direct_serialized,
-                'connecting_trains': connecting_serialized,
-            })
+                'status': 'error',
+                'error': 'Search is taking too long, please try again'
+            }, status=504)
         
         except Exception as e:
             return JsonResponse({
@@ -315,7 +793,52 @@ def search_trains(request):
                 'error': str(e)
             })
 
+@require_http_methods(["GET"])
+@replica_reads
+def availability_calendar(request):
+    """
+    JSON API: per-day direct-train availability for a station pair.
+    
+    Query: source_id, destination_id, seat_class, start (YYYY-MM-DD, default today),
+    days (default 60, at most MAX_CALENDAR_DAYS).
+    """
+    try:
+        seat_class = request.GET.get('seat_class', 'SLEEPER')
+        today = timezone.now().date()
+        start = request.GET.get('start')
+        start_date = datetime.strptime(start, '%Y-%m-%d').date() if start else today
+        days = int(request.GET.get('days', 60))
+        source = Station.objects.get(id=request.GET.get('source_id'))
+        destination = Station.objects.get(id=request.GET.get('destination_id'))
+    except (ValueError, TypeError, Station.DoesNotExist) as e:
+        return JsonResponse({'status': 'error', 'error': f'Invalid request: {e}'}, status=400)
+    
+    if seat_class not in SEAT_CLASSES:
+        return JsonResponse({'status': 'error', 'error': 'Unknown seat class'}, status=400)
+    if start_date < today:
+        return JsonResponse({'status': 'error', 'error': 'Start date cannot be in the past'}, status=400)
+    if not 1 <= days <= MAX_CALENDAR_DAYS:
+        return JsonResponse({'status': 'error', 'error': f'days must be between 1 and {MAX_CALENDAR_DAYS}'}, status=400)
+    
+    return JsonResponse({
+        'status': 'success',
+        'source': source.code,
+        'destination': destination.code,
+        'seat_class': seat_class,
+        'calendar': build_availability_calendar(source, destination, seat_class, start_date, days),
+    })
+
+def api_login_required(view):
+    """login_required for JSON endpoints: a 401 error instead of a redirect to the login page"""
+    @functools.wraps(view)
+    def wrapped(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'status': 'error', 'error': 'Login required'}, status=401)
+        return view(request, *args, **kwargs)
+    return wrapped
+
 @require_http_methods(["GET", "POST"])
+@admission_control('booking')
 def booking(request):
     """Booking page"""
     if request.method == 'GET':
@@ -326,11 +849,10 @@ def booking(request):
         
         # Fetch schedule and route
         schedule = get_object_or_404(Schedule, id=schedule_id)
-        route = get_object_or_404(Route, id=route_id)
+        route = get_object_or_404(Route, id=route_id) if route_id else schedule.route
         
         schedules = [schedule]
         routes = [route]
-        total_fare = route.calculated_fare
         is_connecting = False
         
         if leg_2_schedule_id:
@@ -338,15 +860,27 @@ def booking(request):
             leg_2_route = leg_2_schedule.route
             schedules.append(leg_2_schedule)
             routes.append(leg_2_route)
-            total_fare += leg_2_route.calculated_fare
             is_connecting = True
         
+        # Server-side quotes for every class so the page can switch classes
+        fares_by_class = {}
+        for cls in SEAT_CLASSES:
+            quote = fare_engine.quote(schedules, cls, held=own_held_seats(request, schedules, cls))
+            fares_by_class[cls] = {
+                'base_fare': str(quote['base_fare']),
+                'gst': str(quote['gst']),
+                'convenience_fee': str(quote['convenience_fee']),
+                'total': str(quote['total']),
+            }
+        
         context = {
             'schedules': schedules,
             'routes': routes,
             'seat_class': seat_class,
-            'total_fare': total_fare,
+            'total_fare': fares_by_class.get(seat_class, fares_by_class['SLEEPER'])['base_fare'],
+            'fares_by_class': fares_by_class,
             'is_connecting': is_connecting,
+            'hold_minutes': SeatHold.ttl_seconds() // 60,
         }
         return render(request, 'booking.html', context)
     
@@ -362,39 +896,31 @@ def booking(request):
         journey_date = data.get('journey_date')
         schedule_ids = data.get('schedule_ids', [])
         seat_numbers = data.get('seat_numbers', [])
-        total_fare = Decimal(str(data.get('total_fare')))
+        client_total = data.get('total_fare')
         
         try:
-            # Create booking
-            booking_obj = Booking.objects.create(
-                passenger_name=passenger_name,
-                passenger_email=passenger_email,
-                passenger_phone=passenger_phone,
-                passenger_age=passenger_age,
-                passenger_gender=passenger_gender,
-                seat_class=seat_class,
-                journey_date=journey_date,
-                total_fare=total_fare,
-                status='CONFIRMED'
-            )
+            schedules = [Schedule.objects.get(id=schedule_id) for schedule_id in schedule_ids]
+            error = service_error(schedules, journey_date)
+            if error:
+                return JsonResponse({'status': 'error', 'error': error})
             
-            # Create booking legs and reduce seat availability
-            for idx, schedule_id in enumerate(schedule_ids):
-                schedule = Schedule.objects.get(id=schedule_id)
-                route = schedule.route
-                
-                # Create booking leg
-                BookingLeg.objects.create(
-                    booking=booking_obj,
-                    schedule=schedule,
-                    route=route,
-                    seat_number=seat_numbers[idx],
-                    leg_fare=Decimal(str(route.calculated_fare)),
-                    leg_sequence=idx + 1
-                )
-                
-                # Reduce available seats
-                schedule.reduce_available_seats(seat_class)
+            # Price the journey server-side; the client total is only checked
+            quote = fare_engine.quote(schedules, seat_class, held=own_held_seats(request, schedules, seat_class))
+            total_fare = quote['total']
+            if client_total is not None and Decimal(str(client_total)) != total_fare:
+                return JsonResponse({
+                    'status': 'error',
+                    'error': f'Fare has changed to ₹{total_fare}. Please review and confirm again.',
+                    'total_fare': str(total_fare),
+                })
+            
+            booking_obj = create_booking(
+                request.user,
+                {'email': passenger_email, 'phone': passenger_phone},
+                [{'name': passenger_name, 'age': passenger_age, 'gender': passenger_gender, 'seat_numbers': seat_numbers}],
+                seat_class, journey_date, schedules, quote,
+                hold_token=request.session.pop('seat_hold', None),
+            )
             
             # Send confirmation email
             send_booking_confirmation(booking_obj)
@@ -411,6 +937,141 @@ def booking(request):
                 'error': str(e)
             })
 
+@require_POST
+@api_login_required
+@rate_limit('seat_hold')
+def hold_seats(request):
+    """
+    JSON API: hold seats on the given legs while the booking form is filled in.
+    
+    Body: schedule_ids, seat_class, optional seats (default 1, up to max_group_size;
+    a group booking uses the hold when seats matches its passenger count). One hold
+    per session (a new one replaces it), and at most SEAT_HOLD_MAX_PER_USER live
+    holds per user.
+    """
+    try:
+        data = json.loads(request.body)
+        seat_class = data.get('seat_class')
+        schedule_ids = [int(i) for i in data.get('schedule_ids', [])]
+        seats = int(data.get('seats', 1))
+    except (ValueError, TypeError, AttributeError) as e:
+        return JsonResponse({'status': 'error', 'error': f'Invalid request: {e}'}, status=400)
+    if seat_class not in SEAT_CLASSES or not schedule_ids:
+        return JsonResponse({'status': 'error', 'error': 'seat_class and schedule_ids are required'}, status=400)
+    limit = max_group_size()
+    if not 1 <= seats <= limit:
+        return JsonResponse({'status': 'error', 'error': f'A hold needs 1 to {limit} seats'}, status=400)
+    
+    schedules = list(Schedule.objects.filter(id__in=schedule_ids, is_active=True))
+    schedules.sort(key=lambda sc: schedule_ids.index(sc.id))
+    if len(schedules) != len(schedule_ids):
+        return JsonResponse({'status': 'error', 'error': 'Unknown or inactive schedule'}, status=400)
+    
+    SeatHold.release_expired(batch_size=LAZY_HOLD_SWEEP_BATCH)
+    SeatHold.release(request.session.pop('seat_hold', None))
+    if SeatHold.live_count(request.user) >= settings.SEAT_HOLD_MAX_PER_USER:
+        return JsonResponse({
+            'status': 'error',
+            'error': 'You already have seats held for other journeys; book or let them expire first'
+        }, status=429)
+    hold_token = SeatHold.place(schedules, seat_class, seats, user=request.user)
+    if hold_token is None:
+        return JsonResponse({'status': 'error', 'error': 'Seats could not be held for this journey'}, status=409)
+    request.session['seat_hold'] = hold_token
+    return JsonResponse({'status': 'success', 'seats': seats, 'hold_minutes': SeatHold.ttl_seconds() // 60})
+
+@require_POST
+@admission_control('booking')
+def group_booking(request):
+    """
+    JSON API: book up to max_group_size passengers on one PNR.
+    
+    Body: passenger_email, passenger_phone, seat_class, journey_date, schedule_ids,
+    passengers=[{name, age, gender, seat_numbers: [per leg]}], optional total_fare.
+    """
+    try:
+        data = json.loads(request.body)
+        seat_class = data.get('seat_class')
+        schedule_ids = [int(i) for i in data.get('schedule_ids', [])]
+        passengers = [
+            {
+                'name': p['name'].strip(),
+                'age': int(p['age']),
+                'gender': p['gender'],
+                'seat_numbers': [str(n).strip().upper() for n in p.get('seat_numbers', [])],
+            }
+            for p in data.get('passengers', [])
+        ]
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        return JsonResponse({'status': 'error', 'error': f'Invalid request: {e}'}, status=400)
+    
+    limit = max_group_size()
+    if not passengers or len(passengers) > limit:
+        return JsonResponse({'status': 'error', 'error': f'A group booking needs 1 to {limit} passengers'}, status=400)
+    if seat_class not in SEAT_CLASSES or not schedule_ids:
+        return JsonResponse({'status': 'error', 'error': 'seat_class and schedule_ids are required'}, status=400)
+    if any(not p['name'] or not 1 <= p['age'] <= 120 or p['gender'] not in dict(Booking.GENDER_CHOICES) for p in passengers):
+        return JsonResponse({'status': 'error', 'error': 'Every passenger needs a name, an age of 1-120 and a gender'}, status=400)
+    
+    try:
+        schedules = list(Schedule.objects.filter(id__in=schedule_ids, is_active=True))
+        schedules.sort(key=lambda sc: schedule_ids.index(sc.id))
+        if len(schedules) != len(schedule_ids):
+            return JsonResponse({'status': 'error', 'error': 'Unknown or inactive schedule'}, status=400)
+        error = service_error(schedules, data.get('journey_date'))
+        if error:
+            return JsonResponse({'status': 'error', 'error': error}, status=400)
+        
+        quote = fare_engine.quote(schedules, seat_class, passengers=len(passengers),
+                                  held=own_held_seats(request, schedules, seat_class, len(passengers)))
+        client_total = data.get('total_fare')
+        if client_total is not None and Decimal(str(client_total)) != quote['total']:
+            return JsonResponse({
+                'status': 'error',
+                'error': f"Fare has changed to ₹{quote['total']}. Please review and confirm again.",
+                'total_fare': str(quote['total']),
+            })
+        
+        booking_obj = create_booking(
+            request.user,
+            {'email': data.get('passenger_email'), 'phone': data.get('passenger_phone')},
+            passengers, seat_class, data.get('journey_date'), schedules, quote,
+            hold_token=request.session.pop('seat_hold', None),
+        )
+        send_booking_confirmation(booking_obj)
+        
+        return JsonResponse({
+            'status': 'success',
+            'pnr': booking_obj.pnr,
+            'passenger_count': booking_obj.passenger_count,
+            'total_fare': str(booking_obj.total_fare),
+            'message': 'Booking confirmed successfully!'
+        })
+    
+    except Exception as e:
+        return JsonResponse({
+            'status': 'error',
+            'error': str(e)
+        })
+
+@require_http_methods(["GET"])
+def waiting_room(request, room, ticket):
+    """JSON API: poll an admission ticket handed out by a busy booking endpoint"""
+    if room not in settings.ADMISSION_CONTROL:
+        return JsonResponse({'status': 'error', 'error': 'Unknown waiting room'}, status=404)
+    waiting = get_waiting_room(room)
+    state, position = waiting.poll(ticket)
+    if state == WaitingRoom.UNKNOWN:
+        return JsonResponse({'status': 'error', 'error': 'Your place in the queue has expired, please submit again'},
+                            status=404)
+    if state == WaitingRoom.ADMITTED:
+        return JsonResponse({'status': 'admitted', 'ticket': ticket})
+    return JsonResponse({
+        'status': 'waiting',
+        'position': position,
+        'retry_after': waiting.retry_after(position),
+    })
+
 def send_booking_confirmation(booking):
     """Send booking confirmation email"""
     subject = f"Booking Confirmed - PNR: {booking.pnr}"
@@ -421,6 +1082,7 @@ Your ticket has been successfully booked!
 
 PNR: {booking.pnr}
 Journey Date: {booking.journey_date}
+Passengers: {booking.passenger_count}
 Seat Class: {booking.get_seat_class_display()}
 Total Fare: ₹{booking.total_fare}
 
@@ -438,19 +1100,30 @@ Railway Ticket Management
 def confirmation(request):
     """Confirmation page"""
     pnr = request.GET.get('pnr')
-    booking = get_object_or_404(Booking, pnr=pnr)
-    context = {'booking': booking}
+    booking, archived = find_ticket_booking(pnr)
+    passengers = booking.passenger_list() if archived else booking.passengers.all()
+    context = {'booking': booking, 'archived': archived, 'passengers': passengers}
     return render(request, 'confirmation.html', context)
 
 def search_results(request):
     """Search results page"""
     return render(request, 'search_results.html')
 
+# Bookings shown per page on My Bookings
+MY_BOOKINGS_PAGE_SIZE = 10
+
 @login_required
 def my_bookings(request):
-    """User's bookings page"""
-    bookings = Booking.objects.filter(user=request.user)
-    context = {'bookings': bookings}
+    """User's bookings page (paginated; legs prefetched so query count is fixed per page)"""
+    legs = BookingLeg.objects.select_related(
+        'schedule', 'route__train', 'route__source', 'route__destination'
+    )
+    bookings = Booking.objects.filter(user=request.user).prefetch_related(Prefetch('legs', queryset=legs))
+    page = Paginator(bookings, MY_BOOKINGS_PAGE_SIZE).get_page(request.GET.get('page'))
+    profile = UserProfile.objects.filter(user=request.user).first()
+    # Long-past journeys are in the archive; only counted here (PNR status still finds them)
+    archived_count = ArchivedBooking.objects.filter(user_id=request.user.id).count()
+    context = {'bookings': page.object_list, 'page_obj': page, 'profile': profile, 'archived_count': archived_count}
     return render(request, 'my_bookings.html', context)
 
 @login_required
@@ -462,43 +1135,133 @@ def cancel_booking(request, pnr):
         return redirect('home')
     
     if request.method == 'POST':
-        if booking.status == 'CONFIRMED':
-            booking.status = 'CANCELLED'
-            booking.cancellation_date = timezone.now()
-            booking.refund_amount = booking.total_fare * Decimal('0.9')  # 90% refund
-            booking.save()
-            
-            # Restore seat availability
-            for leg in booking.legs.all():
-                leg.schedule.available_seats += 1
-                leg.schedule.save()
+        refund_amount = (booking.total_fare * Decimal('0.9')).quantize(Decimal('0.01'))  # 90% refund
+        with immediate_transaction():
+            # Conditional update so a double submit cancels (and refunds) only once
+            cancelled = Booking.objects.filter(pk=booking.pk, status='CONFIRMED').update(
+                status='CANCELLED',
+                cancellation_date=timezone.now(),
+                refund_amount=refund_amount,
+            )
+            if cancelled:
+                # update() sends no signal; drop the cached PNR status explicitly
+                pnr_status.invalidate(booking.pnr)
+                # Restore seat availability for every passenger on each leg
+                for leg in booking.legs.select_related('schedule'):
+                    leg.schedule.restore_available_seats(booking.seat_class, booking.passenger_count,
+                                                         reference=booking.pnr)
+                if booking.user_id:
+                    UserProfile.record_cancellation(booking.user, refund_amount)
         
         return redirect('my_bookings')
     
     context = {'booking': booking}
     return render(request, 'cancel_booking.html', context)
 
+@require_http_methods(["GET"])
+@api_login_required
+@rate_limit('pnr_status')
+def pnr_status_detail(request, pnr):
+    """JSON API: status of one of the user's PNRs"""
+    status = pnr_status.get_statuses([pnr], user=request.user)[pnr_status.normalize(pnr)]
+    if status is None:
+        return JsonResponse({'status': 'error', 'error': 'PNR not found'}, status=404)
+    return JsonResponse({'status': 'success', 'booking': status})
+
+@require_http_methods(["GET"])
+@api_login_required
+@rate_limit('pnr_status')
+def pnr_status_batch(request):
+    """JSON API: statuses of up to MAX_BATCH_PNRS of the user's PNRs given as ?pnrs=A,B,C; others map to null"""
+    pnrs = [pnr for pnr in request.GET.get('pnrs', '').split(',') if pnr.strip()]
+    if not pnrs:
+        return JsonResponse({'status': 'error', 'error': 'pnrs is required'}, status=400)
+    if len(pnrs) > pnr_status.MAX_BATCH_PNRS:
+        return JsonResponse({'status': 'error', 'error': f'At most {pnr_status.MAX_BATCH_PNRS} PNRs per request'},
+                            status=400)
+    return JsonResponse({'status': 'success', 'bookings': pnr_status.get_statuses(pnrs, user=request.user)})
+
 @require_http_methods(["GET"])
 def download_ticket(request, pnr):
     """Download ticket as PDF"""
-    booking = get_object_or_404(Booking, pnr=pnr)
+    booking, _ = find_ticket_booking(pnr)
     
     pdf_buffer = generate_ticket_pdf(booking)
     response = FileResponse(pdf_buffer, content_type='application/pdf')
     response['Content-Disposition'] = f'attachment; filename="ticket_{pnr}.pdf"'
     return response
 
+@replica_reads
 @require_http_methods(["GET"])
-def station_autocomplete(request):
-    """AJAX autocomplete for stations"""
+async def station_autocomplete(request):
+    """AJAX autocomplete for stations (async ORM, never queued behind searches)"""
     query = request.GET.get('q', '')
     stations = Station.objects.filter(
         Q(name__icontains=query) | Q(code__icontains=query)
     )[:10]
     
-    data = [{'id': s.id, 'text': f"{s.code} - {s.name}"} for s in stations]
+    data = [{'id': s.id, 'text': f"{s.code} - {s.name}"} async for s in stations]
     return JsonResponse(data, safe=False)
 
+# Versioned catalog URLs never change content; unversioned ones revalidate with the ETag
+STATION_LIST_MAX_AGE = 365 * 24 * 3600
+
+@require_http_methods(["GET", "HEAD"])
+def station_list(request):
+    """All stations as precompressed JSON with an ETag (served from memory, no queries when warm)"""
+    catalog = get_station_catalog()
+    if request.GET.get('v') == catalog.tag:
+        cache_control = f'public, max-age={STATION_LIST_MAX_AGE}, immutable'
+    else:
+        cache_control = 'public, max-age=0, must-revalidate'
+    
+    if catalog.etag in [tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')]:
+        response = HttpResponse(status=304)
+    else:
+        encoding, body = catalog.negotiate(request.headers.get('Accept-Encoding', ''))
+        response = HttpResponse(body, content_type='application/json')
+        if encoding:
+            response['Content-Encoding'] = encoding
+    response['ETag'] = catalog.etag
+    response['Cache-Control'] = cache_control
+    response['Vary'] = 'Accept-Encoding'
+    return response
+
+@require_http_methods(["GET"])
+@replica_reads
+def nearby_stations(request):
+    """
+    JSON API: stations near a point. Query: lat & lon, or station_id, or city;
+    optional radius_km (default 50) and limit (default 10).
+    """
+    index = get_station_index()
+    try:
+        radius_km = min(float(request.GET.get('radius_km', 50)), MAX_NEARBY_RADIUS_KM)
+        limit = min(max(int(request.GET.get('limit', 10)), 1), 50)
+        if request.GET.get('station_id'):
+            centre = index.coords(int(request.GET['station_id']))
+        elif request.GET.get('city'):
+            centre = index.city_centre(request.GET['city'])
+        else:
+            centre = (float(request.GET['lat']), float(request.GET['lon']))
+    except (KeyError, ValueError) as e:
+        return JsonResponse({'status': 'error', 'error': f'Invalid request: {e}'}, status=400)
+    
+    if centre is None:
+        return JsonResponse({'status': 'error', 'error': 'No coordinates known for that station or city'}, status=404)
+    
+    stations = []
+    for distance, station_id in index.nearby(centre[0], centre[1], radius_km, limit):
+        code, name, city, _, _ = index.stations[station_id]
+        stations.append({
+            'id': station_id,
+            'code': code,
+            'name': name,
+            'city': city,
+            'distance_km': round(distance, 1),
+        })
+    return JsonResponse({'status': 'success', 'stations': stations})
+
 # ==================== AUTH VIEWS ====================
 
 def register(request):
@@ -550,6 +1313,7 @@ def is_admin(user):
 
 @login_required
 @user_passes_test(is_admin)
+@replica_reads
 def admin_dashboard(request):
     """Admin dashboard"""
     context = {
@@ -578,6 +1342,19 @@ def manage_stations(request):
     context = {'stations': stations}
     return render(request, 'admin/manage_stations.html', context)
 
+@login_required
+@user_passes_test(is_admin)
+def lookup(request, kind):
+    """JSON API for AutocompleteSelect: one page of stations, trains or routes matching q"""
+    if kind not in LOOKUP_KINDS:
+        return JsonResponse({'status': 'error', 'error': f'Unknown lookup: {kind}'}, status=404)
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+    results, has_more = get_lookup_index(kind).search(request.GET.get('q', ''), page)
+    return JsonResponse({'results': results, 'has_more': has_more})
+
 @login_required
 @user_passes_test(is_admin)
 def manage_routes(request):
@@ -604,6 +1381,21 @@ def manage_bookings(request):
 
 @login_required
 @user_passes_test(is_admin)
+@require_http_methods(["GET"])
+def ticket_revocations(request):
+    """JSON API for ticket checkers: PNRs cancelled since ?since=<synced_at of the previous sync>"""
+    since = request.GET.get('since')
+    if since:
+        since = parse_datetime(since)
+        if since is None:
+            return JsonResponse({'status': 'error', 'error': 'since must be an ISO 8601 datetime'}, status=400)
+        if timezone.is_naive(since):
+            since = timezone.make_aware(since)
+    return JsonResponse({'status': 'success', **ticket_tokens.revoked_since(since or None)})
+
+@login_required
+@user_passes_test(is_admin)
+@replica_reads
 def analytics(request):
     """Analytics page"""
     total_revenue = Booking.objects.filter(status='CONFIRMED').aggregate(Sum('total_fare'))['total_fare__sum'] or 0
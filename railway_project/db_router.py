@@ -0,0 +1,174 @@
+"""
+Primary/replica database routing.
+
+Reads go to the 'replica' alias only inside views decorated with @replica_reads
+(search, autocomplete, analytics). Everything else, and every write, goes to
+'default'. Once a request writes, the rest of that request reads from the primary,
+and StickyPrimaryMiddleware keeps the client on the primary for
+REPLICA_STICKY_SECONDS so it always sees its own booking or cancellation.
+
+Archived bookings (ArchivedBooking, ArchivedBookingLeg) live in the 'archive'
+alias when one is configured, and in 'default' otherwise.
+"""
+import contextlib
+import contextvars
+import functools
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+REPLICA_ALIAS = 'replica'
+ARCHIVE_ALIAS = 'archive'
+ARCHIVE_MODELS = {'archivedbooking', 'archivedbookingleg'}
+STICKY_COOKIE = 'db_primary_until'
+
+
+class _RoutingState:
+    __slots__ = ('use_replica', 'sticky', 'wrote')
+
+    def __init__(self, sticky=False):
+        self.use_replica = False
+        self.sticky = sticky
+        self.wrote = False
+
+
+_state = contextvars.ContextVar('db_routing_state', default=None)
+
+
+def replica_available():
+    return REPLICA_ALIAS in connections.databases
+
+
+def archive_alias():
+    return ARCHIVE_ALIAS if ARCHIVE_ALIAS in connections.databases else 'default'
+
+
+def is_archive_model(app_label, model_name):
+    return app_label == 'railway_app' and model_name in ARCHIVE_MODELS
+
+
+class PrimaryReplicaRouter:
+    """Send opted-in reads to the replica, everything else to the primary"""
+
+    def db_for_read(self, model, **hints):
+        if is_archive_model(model._meta.app_label, model._meta.model_name):
+            return archive_alias()
+        state = _state.get()
+        if state and state.use_replica and not (state.sticky or state.wrote) and replica_available():
+            return REPLICA_ALIAS
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        if is_archive_model(model._meta.app_label, model._meta.model_name):
+            return archive_alias()
+        state = _state.get()
+        if state:
+            state.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Primary and replica hold the same data; archive models only relate to each other
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == REPLICA_ALIAS:
+            return False
+        if model_name is not None and is_archive_model(app_label, model_name):
+            return db == archive_alias()
+        # Everything else, including data migrations, runs where the hot tables are
+        return db != ARCHIVE_ALIAS
+
+
+@contextlib.contextmanager
+def replica_scope():
+    """Route reads in this block to the replica (unless the client is sticky)"""
+    state = _state.get()
+    token = None
+    if state is None:
+        state = _RoutingState()
+        token = _state.set(state)
+    previous = state.use_replica
+    state.use_replica = True
+    try:
+        yield
+    finally:
+        state.use_replica = previous
+        if token is not None:
+            _state.reset(token)
+
+
+@contextlib.contextmanager
+def primary_scope():
+    """
+    Run this block on the primary, reads included, even inside a replica scope.
+    For housekeeping writes (e.g. releasing expired seat holds) that are not the
+    client's own: they do not pin the client to the primary afterwards.
+    """
+    token = _state.set(_RoutingState())
+    try:
+        yield
+    finally:
+        _state.reset(token)
+
+
+def replica_reads(view):
+    """Let a view's reads be served by the replica"""
+    if iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            with replica_scope():
+                return await view(request, *args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        with replica_scope():
+            return view(request, *args, **kwargs)
+    return wrapper
+
+
+class StickyPrimaryMiddleware:
+    """Pin a client to the primary for a short window after it writes (sync and async)"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state, token = self._enter(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self._leave(state, response)
+
+    async def __acall__(self, request):
+        state, token = self._enter(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self._leave(state, response)
+
+    @staticmethod
+    def _enter(request):
+        try:
+            sticky = float(request.COOKIES.get(STICKY_COOKIE, 0)) > time.time()
+        except ValueError:
+            sticky = False
+        state = _RoutingState(sticky=sticky)
+        return state, _state.set(state)
+
+    @staticmethod
+    def _leave(state, response):
+        if state.wrote and replica_available():
+            window = getattr(settings, 'REPLICA_STICKY_SECONDS', 5)
+            response.set_cookie(STICKY_COOKIE, str(time.time() + window), max_age=window, httponly=True, samesite='Lax')
+        return response
@@ -24,6 +24,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'railway_project.db_router.StickyPrimaryMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -46,13 +47,56 @@ TEMPLATES = [
     },
 ]
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# Database configuration comes from the environment; with nothing set this is the
+# local SQLite file. DB_ENGINE, DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT
+# configure the primary; setting DB_REPLICA_HOST (or DB_REPLICA_NAME) adds a
+# 'replica' alias that takes search, autocomplete and analytics reads.
+def database_from_env(prefix='DB_', base=None):
+    base = base or {}
+    config = {
+        'ENGINE': os.environ.get(f'{prefix}ENGINE', base.get('ENGINE', 'django.db.backends.sqlite3')),
+        'NAME': os.environ.get(f'{prefix}NAME', base.get('NAME', BASE_DIR / 'db.sqlite3')),
+        'USER': os.environ.get(f'{prefix}USER', base.get('USER', '')),
+        'PASSWORD': os.environ.get(f'{prefix}PASSWORD', base.get('PASSWORD', '')),
+        'HOST': os.environ.get(f'{prefix}HOST', base.get('HOST', '')),
+        'PORT': os.environ.get(f'{prefix}PORT', base.get('PORT', '')),
+        # Persistent connections, re-validated before reuse
+        'CONN_MAX_AGE': int(os.environ.get(f'{prefix}CONN_MAX_AGE', base.get('CONN_MAX_AGE', 60))),
+        'CONN_HEALTH_CHECKS': True,
     }
+    return config
+
+DATABASES = {
+    'default': database_from_env('DB_'),
 }
 
+if os.environ.get('DB_REPLICA_HOST') or os.environ.get('DB_REPLICA_NAME'):
+    DATABASES['replica'] = database_from_env('DB_REPLICA_', base=DATABASES['default'])
+    DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
+
+# Performance profile applied to every new SQLite connection (railway_project/sqlite_tuning.py).
+# Set DB_SQLITE_TUNING=0 to keep SQLite defaults.
+SQLITE_PRAGMAS = {
+    'busy_timeout': 5000,        # ms
+    'cache_size': -20000,        # negative = KiB, i.e. ~20 MB page cache
+    'mmap_size': 134217728,      # 128 MB
+    'temp_store': 'MEMORY',
+} if os.environ.get('DB_SQLITE_TUNING', '1') != '0' else {}
+# WAL journalling (with synchronous=NORMAL) lets readers run alongside the writer. It is
+# a persistent change to the database file, so only servers turn it on: DB_SQLITE_WAL=1.
+SQLITE_WAL = os.environ.get('DB_SQLITE_WAL', '0') == '1'
+
+# Setting DB_ARCHIVE_NAME (or DB_ARCHIVE_HOST) keeps archived bookings in an 'archive'
+# database of their own, e.g. a separate SQLite file; create its tables with
+# `python manage.py migrate --database archive`. Unset, they live in the primary.
+if os.environ.get('DB_ARCHIVE_HOST') or os.environ.get('DB_ARCHIVE_NAME'):
+    DATABASES['archive'] = database_from_env('DB_ARCHIVE_', base=DATABASES['default'])
+
+DATABASE_ROUTERS = ['railway_project.db_router.PrimaryReplicaRouter']
+
+# After a write, the client reads from the primary for this many seconds
+REPLICA_STICKY_SECONDS = int(os.environ.get('DB_REPLICA_STICKY_SECONDS', 5))
+
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
     {'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator'},
@@ -74,6 +118,109 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Generated PNRs (railway_app/pnr.py): a host id, 0-63, unique per host running workers
+# (workers on one host are told apart by pid), and the key that scrambles PNRs so they
+# cannot be guessed (defaults to a key derived from SECRET_KEY)
+PNR_NODE_ID = os.environ.get('PNR_NODE_ID')
+PNR_SECRET = os.environ.get('PNR_SECRET')
+
+# PNR status API cache, per process: entries kept, and how long another process's
+# booking change can take to show up (this process's own changes show at once)
+PNR_STATUS_CACHE_SIZE = int(os.environ.get('PNR_STATUS_CACHE_SIZE', 10000))
+PNR_STATUS_CACHE_SECONDS = float(os.environ.get('PNR_STATUS_CACHE_SECONDS', 30))
+
+# Async search: threads available for search planning (0 = Django's shared sync thread)
+# and the per-request time limit
+SEARCH_EXECUTOR_WORKERS = int(os.environ.get('SEARCH_EXECUTOR_WORKERS', 4))
+SEARCH_TIMEOUT_SECONDS = float(os.environ.get('SEARCH_TIMEOUT_SECONDS', 10))
+
+# Identical concurrent searches share one computation in each process. With a
+# directory set, processes on the same host also coalesce through lock files there.
+SEARCH_COALESCE = os.environ.get('SEARCH_COALESCE', '1') != '0'
+SEARCH_COALESCE_DIR = os.environ.get('SEARCH_COALESCE_DIR') or None
+# Lock files idle this long are swept from SEARCH_COALESCE_DIR (each process sweeps at
+# most once per interval)
+SEARCH_COALESCE_MAX_AGE_SECONDS = float(os.environ.get('SEARCH_COALESCE_MAX_AGE_SECONDS', 60))
+
+# Admission control (railway_app/admission.py), per process. Booking POSTs are let
+# through at `rate` per second (bursts up to `burst`; rate 0 = off); the rest queue in
+# a FIFO waiting room of up to `max_queue` tickets. Tickets not polled for
+# `idle_seconds` are dropped; admitted tickets must be used within `admit_seconds`.
+# At most `max_active` admitted bookings run at once; others wait up to `max_wait` seconds.
+ADMISSION_CONTROL = {
+    'booking': {
+        'rate': float(os.environ.get('BOOKING_ADMISSION_RATE', 20)),
+        'burst': int(os.environ.get('BOOKING_ADMISSION_BURST', 20)),
+        'max_queue': int(os.environ.get('BOOKING_QUEUE_MAX', 10000)),
+        'idle_seconds': 30,
+        'admit_seconds': 60,
+        'max_active': int(os.environ.get('BOOKING_MAX_ACTIVE', 8)),
+        'max_wait': 5,
+    },
+}
+
+# Per-client limits (railway_app/admission.py) for endpoints one client could hammer:
+# requests per second and burst, per signed-in user or per IP address when anonymous
+# (behind a proxy, make sure REMOTE_ADDR is the client's address)
+CLIENT_RATE_LIMITS = {
+    'pnr_status': {
+        'rate': float(os.environ.get('PNR_STATUS_RATE', 1)),
+        'burst': int(os.environ.get('PNR_STATUS_BURST', 20)),
+    },
+    'seat_hold': {
+        'rate': float(os.environ.get('SEAT_HOLD_RATE', 0.2)),
+        'burst': int(os.environ.get('SEAT_HOLD_BURST', 5)),
+    },
+}
+
+# Seat holds (hold_seats API, signed-in users only): live holds allowed per user
+SEAT_HOLD_MAX_PER_USER = int(os.environ.get('SEAT_HOLD_MAX_PER_USER', 2))
+
+# Parallel connecting search: pool size (0 = off) and the number of first-leg schedules
+# from the source before the pool is used. Pool workers are forked and share the
+# timetable snapshot copy-on-write; fork-based, so not available on Windows.
+SEARCH_PARALLEL_WORKERS = int(os.environ.get('SEARCH_PARALLEL_WORKERS', 0))
+SEARCH_PARALLEL_MIN_FIRST_LEGS = int(os.environ.get('SEARCH_PARALLEL_MIN_FIRST_LEGS', 200))
+
+# Connecting search skips intermediate stations where source -> via -> destination is
+# more than this many times the straight-line distance (needs station coordinates; 0 = off)
+SEARCH_MAX_DETOUR_RATIO = float(os.environ.get('SEARCH_MAX_DETOUR_RATIO', 2.5))
+
+# Compiled timetable snapshot (python manage.py compile_timetable). Workers map it
+# read-only instead of rebuilding the timetable from the ORM; unset = build from the DB.
+TIMETABLE_SNAPSHOT_PATH = os.environ.get('TIMETABLE_SNAPSHOT_PATH') or None
+
+# How often each process checks the timetable version (TimetableChange) to refresh
+# its timetable snapshot and fare tables after edits made elsewhere
+TIMETABLE_VERSION_POLL_SECONDS = float(os.environ.get('TIMETABLE_VERSION_POLL_SECONDS', 2))
+
+# A gap in the change log ids (a change not yet committed) holds the version back for
+# at most this long before it is taken as rolled back; keep it above the longest
+# transaction that edits the timetable
+TIMETABLE_CHANGE_SETTLE_SECONDS = float(os.environ.get('TIMETABLE_CHANGE_SETTLE_SECONDS', 30))
+
+# How many days ahead extend_dated_trips materializes schedule runs (run it nightly).
+# Searches beyond the horizon fall back to weekday matching on schedules.
+DATED_TRIP_HORIZON_DAYS = int(os.environ.get('DATED_TRIP_HORIZON_DAYS', 60))
+
+# Keys for signing ticket tokens (ticket_tokens), by key id. New tickets are signed
+# with TICKET_SIGNING_KEY_ID; keep retired keys here until their tickets have travelled.
+# Checkers verifying offline need the same keys. Set TICKET_SIGNING_KEY in production;
+# a key left unset (None) is derived from SECRET_KEY and the key id, never SECRET_KEY itself.
+TICKET_SIGNING_KEY_ID = os.environ.get('TICKET_SIGNING_KEY_ID', 'k1')
+TICKET_SIGNING_KEYS = {
+    TICKET_SIGNING_KEY_ID: os.environ.get('TICKET_SIGNING_KEY'),
+}
+
+# Revocation syncs re-read cancellations from this long before the previous sync, so
+# one whose transaction committed after that sync is still picked up
+TICKET_REVOCATION_OVERLAP_SECONDS = float(os.environ.get('TICKET_REVOCATION_OVERLAP_SECONDS', 300))
+
+# archive_bookings (run nightly) moves bookings whose journey date is more than this
+# many days past out of the hot booking tables, in batches of BOOKING_ARCHIVE_BATCH_SIZE
+BOOKING_ARCHIVE_AFTER_DAYS = int(os.environ.get('BOOKING_ARCHIVE_AFTER_DAYS', 180))
+BOOKING_ARCHIVE_BATCH_SIZE = int(os.environ.get('BOOKING_ARCHIVE_BATCH_SIZE', 500))
+
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 # For production: use SMTP backend
 
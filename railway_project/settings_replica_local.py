@@ -0,0 +1,30 @@
+"""
+Local primary/replica setup on two SQLite files, for exercising the database
+router offline:
+
+    DJANGO_SETTINGS_MODULE=railway_project.settings_replica_local python manage.py migrate
+    cp db_primary.sqlite3 db_replica.sqlite3   # "replicate"
+    DJANGO_SETTINGS_MODULE=railway_project.settings_replica_local python manage.py runserver
+
+Nothing copies data between the files automatically. That makes replica lag easy
+to see: writes show up on replica-routed pages only after the next copy, except
+for a client inside its sticky-after-write window.
+"""
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db_primary.sqlite3',
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
+    },
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db_replica.sqlite3',
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
+        'TEST': {'MIRROR': 'default'},
+    },
+}
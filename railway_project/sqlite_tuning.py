@@ -0,0 +1,63 @@
+"""
+SQLite performance profile.
+
+apply_sqlite_pragmas() runs on every new SQLite connection (connection_created
+signal) and applies settings.SQLITE_PRAGMAS: mmap, page cache and a busy timeout.
+With settings.SQLITE_WAL it also switches to WAL journalling with
+synchronous=NORMAL; that rewrites the database file header and adds -wal/-shm
+files beside it, so it is left to servers that opt in.
+
+immediate_transaction() is atomic() with BEGIN IMMEDIATE, so booking transactions
+take the write lock up front instead of failing with "database is locked" when
+two deferred transactions both try to upgrade their read lock.
+"""
+import contextlib
+
+from django.conf import settings
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+
+
+# Applied first, and only with SQLITE_WAL: synchronous=NORMAL is only safe in WAL mode
+WAL_PRAGMAS = {'journal_mode': 'WAL', 'synchronous': 'NORMAL'}
+
+
+def sqlite_pragmas(wal=None):
+    """Pragmas for new connections; wal overrides settings.SQLITE_WAL"""
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', {})
+    if wal is None:
+        wal = getattr(settings, 'SQLITE_WAL', False)
+    return {**WAL_PRAGMAS, **pragmas} if wal and pragmas else dict(pragmas)
+
+
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    """connection_created receiver: tune new SQLite connections"""
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = sqlite_pragmas()
+    if not pragmas:
+        return
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+@contextlib.contextmanager
+def immediate_transaction(using=None):
+    """transaction.atomic() that starts with BEGIN IMMEDIATE on SQLite"""
+    using = using or DEFAULT_DB_ALIAS
+    connection = connections[using]
+    if connection.vendor != 'sqlite' or connection.in_atomic_block:
+        with transaction.atomic(using=using):
+            yield
+        return
+
+    # transaction_mode is reset from OPTIONS on connect, so connect first
+    connection.ensure_connection()
+    previous = connection.transaction_mode
+    connection.transaction_mode = 'IMMEDIATE'
+    try:
+        with transaction.atomic(using=using):
+            connection.transaction_mode = previous
+            yield
+    finally:
+        connection.transaction_mode = previous